@@ -1,10 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server'
 import { withAuth } from '@/lib/authMiddleware'
-import { execSync } from 'child_process'
-import { writeFileSync, readFileSync, unlinkSync, existsSync } from 'fs'
-import { mkdirSync } from 'fs'
-import path from 'path'
-import os from 'os'
+import { decodeQR, QRWorkerResponse } from '@/lib/qrWorker'
 
 // Cache Buster: 20251127130000
 interface QRData {
@@ -27,53 +23,36 @@ interface QRData {
   retencao_iva: number | null
   hash: string | null
   numero_certificado: string | null
+  // Só com o índice de faturas ligado (QR_DEDUP=1): primeira leitura da mesma fatura
+  duplicado?: {
+    origem: string
+    visto_em: string
+    vezes: number
+    fatura: any
+  }
 }
 
 async function processQRText(qrText: string, req: NextRequest) {
   try {
-    // Use Python script to process QR text directly
-    const pythonScript = path.join(process.cwd(), 'scripts', 'leitor_qr_faturas_at.py')
-    const timestamp = Date.now()
-    const tempDir = os.tmpdir()
-    const jsonPath = path.join(tempDir, `qr-output-${timestamp}.json`)
-
-    // Create temporary JSON file to store raw QR text for processing
-    const tempInput = path.join(tempDir, `qr-text-${timestamp}.txt`)
-    writeFileSync(tempInput, qrText)
-
+    // Decode QR text through the persistent Python worker (no temp files, no process spawn)
+    let response: QRWorkerResponse | undefined
     try {
-      // Call Python script with --text parameter
-      const output = execSync(
-        `python3 "${pythonScript}" --text "${tempInput}" --json "${jsonPath}"`,
-        {
-          encoding: 'utf-8',
-          timeout: 10000,
-          maxBuffer: 10 * 1024 * 1024
-        }
-      )
-      console.log('Python QR text processing output:', output)
+      response = await decodeQR({ text: qrText }, 10000)
     } catch (error: any) {
-      console.error('Python execution error:', error.message)
+      console.error('Python QR worker error:', error.message)
     }
 
-    // Check if JSON output exists
-    if (!existsSync(jsonPath)) {
-      // Cleanup
-      if (existsSync(tempInput)) unlinkSync(tempInput)
-
+    if (!response || !response.ok || !response.result) {
+      if (response?.error) {
+        console.error('Python QR text processing error:', response.error)
+      }
       return NextResponse.json(
         { message: 'Não foi possível processar o código QR' },
         { status: 400 }
       )
     }
 
-    // Read the processed QR data
-    const qrDataJson = readFileSync(jsonPath, 'utf-8')
-    const qrData: QRData = JSON.parse(qrDataJson)
-
-    // Cleanup
-    if (existsSync(tempInput)) unlinkSync(tempInput)
-    if (existsSync(jsonPath)) unlinkSync(jsonPath)
+    const qrData: QRData = response.result
 
     // Transform QR data to match expense form fields (same as file upload method)
     const baseTributavel = qrData.linhas_iva.reduce((sum, linha) => sum + (linha.base_tributavel || 0), 0)
@@ -132,6 +111,7 @@ async function processQRText(qrText: string, req: NextRequest) {
       base_tributavel: baseTributavel,
       valor_iva: valorIva,
       valor_total: valorTotal,
+      duplicado: qrData.duplicado || null,
       raw_qr_data: qrData
     }
 
@@ -180,173 +160,120 @@ const handler = async (req: NextRequest, context: any) => {
       )
     }
 
-    if (!file.type.startsWith('image/')) {
+    // PDFs go to the worker as-is: the Python reader decodes the page images embedded in the PDF
+    if (!file.type.startsWith('image/') && file.type !== 'application/pdf') {
       return NextResponse.json(
-        { message: 'Ficheiro deve ser uma imagem (JPG, PNG, etc)' },
+        { message: 'Ficheiro deve ser uma imagem (JPG, PNG, etc) ou um PDF' },
         { status: 400 }
       )
     }
 
-    // Save image to temporary file
+    // Send the image bytes to the worker in memory (no temp file round-trip)
     const buffer = await file.arrayBuffer()
     const bufferNode = Buffer.from(buffer)
-    const tempDir = os.tmpdir()
-    const timestamp = Date.now()
-    const imagePath = path.join(tempDir, `qr-input-${timestamp}.png`)
-
-    writeFileSync(imagePath, bufferNode)
 
+    // Read the QR code through the persistent Python worker
+    let response: QRWorkerResponse
     try {
-      // Call Python script to read QR code
-      const pythonScript = path.join(process.cwd(), 'scripts', 'leitor_qr_faturas_at.py')
+      console.log(`A enviar imagem para o worker QR: ${file.name} (${bufferNode.length} bytes)`)
+      // The Python side stops searching at max_ms, well before the 30 s worker timeout
+      response = await decodeQR({ image_b64: bufferNode.toString('base64'), max_ms: 20000 }, 30000)
+    } catch (error: any) {
+      console.error('Python QR worker error:', error.message)
+      return NextResponse.json(
+        { message: 'Nenhum código QR encontrado na imagem. Verifique se a imagem contém um QR code válido e está legível.' },
+        { status: 400 }
+      )
+    }
 
-      // Check if Python script exists
-      if (!existsSync(pythonScript)) {
-        throw new Error('Script de leitura QR não encontrado')
+    if (!response.ok || !response.result) {
+      console.error('Python script error:', response.error)
+      if (response.not_found) {
+        console.error(`QR não encontrado (${response.not_found.motivo}) após ${response.not_found.tentativas.length} tentativas em ${response.not_found.tempo_ms} ms`)
       }
+      return NextResponse.json(
+        { message: response.error || 'Nenhum código QR encontrado na imagem. Verifique se a imagem contém um QR code válido e está legível.' },
+        { status: 400 }
+      )
+    }
 
-      // Execute Python script
-      let output = ''
-      let pythonError: { stdout?: string; stderr?: string; message?: string } | null = null
-      try {
-        console.log(`Executing: python3 "${pythonScript}" "${imagePath}" --json /tmp/qr-output-${timestamp}.json`)
-        output = execSync(`python3 "${pythonScript}" "${imagePath}" --json /tmp/qr-output-${timestamp}.json`, {
-          encoding: 'utf-8',
-          timeout: 30000,
-          maxBuffer: 10 * 1024 * 1024
-        })
-        console.log('Python output:', output)
-      } catch (error: any) {
-        console.error('Python execution error:')
-        console.error('stderr:', error.stderr)
-        console.error('stdout:', error.stdout)
-        console.error('message:', error.message)
-        pythonError = error
-      }
+    const qrData: QRData = response.result
 
-      // Check if JSON output file was created
-      const jsonPath = `/tmp/qr-output-${timestamp}.json`
-      if (!existsSync(jsonPath)) {
-        console.error('JSON output file not created. Python likely failed to find QR code.')
-
-        // Try to parse stdout as JSON error from Python script
-        if (pythonError?.stdout) {
-          try {
-            const errorData = JSON.parse(pythonError.stdout)
-            if (errorData.error) {
-              console.error('Python script error:', errorData.error)
-              return NextResponse.json(
-                { message: errorData.error },
-                { status: 400 }
-              )
-            }
-          } catch (e) {
-            // Not valid JSON, fall through to default error
-          }
-        }
+    // Transform QR data to match expense form fields
+    // Extract base and IVA from first line (or sum if multiple lines)
+    const baseTributavel = qrData.linhas_iva.reduce((sum, linha) => sum + (linha.base_tributavel || 0), 0)
+    const valorIva = qrData.linhas_iva.reduce((sum, linha) => sum + (linha.valor_iva || 0), 0)
+    const valorTotal = baseTributavel + valorIva
 
-        return NextResponse.json(
-          { message: 'Nenhum código QR encontrado na imagem. Verifique se a imagem contém um QR code válido e está legível.' },
-          { status: 400 }
-        )
-      }
+    // Tentar obter o nome da empresa e categoria através do NIF
+    let companyName = 'Fatura'
+    let categoryId = null
+    if (qrData.nif_emitente) {
+      console.log(`A procurar NIF emitente: ${qrData.nif_emitente}`)
+      try {
+        // Always use localhost for internal calls to avoid SSL issues
+        // (even in production, since we're calling our own API internally)
+        const apiUrl = 'http://localhost:8520/api/nif-lookup'
 
-      // Read and parse the JSON output
-      const jsonContent = readFileSync(jsonPath, 'utf-8')
-      const qrData: QRData = JSON.parse(jsonContent)
+        console.log(`Calling NIF lookup API: ${apiUrl}`)
+        const nifLookupRes = await fetch(apiUrl, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': req.headers.get('Authorization') || ''
+          },
+          body: JSON.stringify({ nif: qrData.nif_emitente })
+        })
 
-      // Clean up temp files
-      try {
-        unlinkSync(imagePath)
-        unlinkSync(jsonPath)
-      } catch (e) {
-        console.warn('Erro ao limpar ficheiros temporários:', e)
-      }
+        console.log(`NIF lookup response status: ${nifLookupRes.status}`)
 
-      // Transform QR data to match expense form fields
-      // Extract base and IVA from first line (or sum if multiple lines)
-      const baseTributavel = qrData.linhas_iva.reduce((sum, linha) => sum + (linha.base_tributavel || 0), 0)
-      const valorIva = qrData.linhas_iva.reduce((sum, linha) => sum + (linha.valor_iva || 0), 0)
-      const valorTotal = baseTributavel + valorIva
-
-      // Tentar obter o nome da empresa e categoria através do NIF
-      let companyName = 'Fatura'
-      let categoryId = null
-      if (qrData.nif_emitente) {
-        console.log(`A procurar NIF emitente: ${qrData.nif_emitente}`)
-        try {
-          // Always use localhost for internal calls to avoid SSL issues
-          // (even in production, since we're calling our own API internally)
-          const apiUrl = 'http://localhost:8520/api/nif-lookup'
-
-          console.log(`Calling NIF lookup API: ${apiUrl}`)
-          const nifLookupRes = await fetch(apiUrl, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-              'Authorization': req.headers.get('Authorization') || ''
-            },
-            body: JSON.stringify({ nif: qrData.nif_emitente })
-          })
-
-          console.log(`NIF lookup response status: ${nifLookupRes.status}`)
-
-          if (nifLookupRes.ok) {
-            const nifData = await nifLookupRes.json()
-            console.log('NIF lookup response data:', nifData)
-            if (nifData.company_name) {
-              companyName = nifData.company_name
-              console.log(`✓ Nome da empresa obtido: ${companyName}`)
-            } else {
-              console.warn('⚠ NIF lookup OK mas company_name vazio')
-            }
-            if (nifData.category_id) {
-              categoryId = nifData.category_id
-              console.log(`✓ Categoria obtida da cache: ${categoryId}`)
-            }
+        if (nifLookupRes.ok) {
+          const nifData = await nifLookupRes.json()
+          console.log('NIF lookup response data:', nifData)
+          if (nifData.company_name) {
+            companyName = nifData.company_name
+            console.log(`✓ Nome da empresa obtido: ${companyName}`)
           } else {
-            const errorData = await nifLookupRes.json()
-            console.error(`✗ NIF lookup falhou com status ${nifLookupRes.status}:`, errorData)
+            console.warn('⚠ NIF lookup OK mas company_name vazio')
           }
-        } catch (err) {
-          console.error('✗ Erro ao fazer NIF lookup:', err)
+          if (nifData.category_id) {
+            categoryId = nifData.category_id
+            console.log(`✓ Categoria obtida da cache: ${categoryId}`)
+          }
+        } else {
+          const errorData = await nifLookupRes.json()
+          console.error(`✗ NIF lookup falhou com status ${nifLookupRes.status}:`, errorData)
         }
-      } else {
-        console.warn('⚠ NIF emitente não encontrado no QR code')
+      } catch (err) {
+        console.error('✗ Erro ao fazer NIF lookup:', err)
       }
+    } else {
+      console.warn('⚠ NIF emitente não encontrado no QR code')
+    }
 
-      const expenseData = {
-        description: companyName,
-        // Use total amount (base + IVA)
-        amount: valorTotal.toString(),
-        date: qrData.data_emissao || new Date().toISOString().split('T')[0],
-        vat_value: valorIva > 0 ? valorIva.toString() : '',
-        category_id: categoryId,
-        numero_documento: qrData.numero_documento,
-        nif_emitente: qrData.nif_emitente,
-        nif_adquirente: qrData.nif_adquirente,
-        atcud: qrData.atcud,
-        base_tributavel: baseTributavel,
-        valor_iva: valorIva,
-        valor_total: valorTotal,
-        raw_qr_data: qrData
-      }
+    const expenseData = {
+      description: companyName,
+      // Use total amount (base + IVA)
+      amount: valorTotal.toString(),
+      date: qrData.data_emissao || new Date().toISOString().split('T')[0],
+      vat_value: valorIva > 0 ? valorIva.toString() : '',
+      category_id: categoryId,
+      numero_documento: qrData.numero_documento,
+      nif_emitente: qrData.nif_emitente,
+      nif_adquirente: qrData.nif_adquirente,
+      atcud: qrData.atcud,
+      base_tributavel: baseTributavel,
+      valor_iva: valorIva,
+      valor_total: valorTotal,
+      duplicado: qrData.duplicado || null,
+      raw_qr_data: qrData
+    }
 
-      console.log('QR Data Extraction Result:')
-      console.log('Date from QR:', qrData.data_emissao)
-      console.log('Final expense data:', expenseData)
+    console.log('QR Data Extraction Result:')
+    console.log('Date from QR:', qrData.data_emissao)
+    console.log('Final expense data:', expenseData)
 
-      return NextResponse.json({ qr_data: expenseData }, { status: 200 })
-    } finally {
-      // Clean up temp image file
-      try {
-        if (existsSync(imagePath)) {
-          unlinkSync(imagePath)
-        }
-      } catch (e) {
-        console.warn('Erro ao limpar ficheiros temporários:', e)
-      }
-    }
+    return NextResponse.json({ qr_data: expenseData }, { status: 200 })
   } catch (error: any) {
     console.error('Erro ao processar QR code:', error)
     return NextResponse.json(
@@ -0,0 +1,168 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process'
+import readline from 'readline'
+import path from 'path'
+
+// Processo Python de longa duração (`leitor_qr_faturas_at.py --serve`) partilhado por todos os pedidos.
+// Evita pagar o arranque do interpretador e o import do OpenCV em cada leitura de QR.
+
+export interface QRWorkerRequest {
+  image?: string
+  // Bytes do ficheiro de imagem (ou PDF) em base64, descodificados em memória pelo Python
+  image_b64?: string
+  // Prazo da leitura da imagem em ms; o Python devolve "not_found" em vez de continuar a procurar.
+  // decodeQR limita-o sempre a um pouco menos do tempo limite do pedido
+  max_ms?: number
+  // Todas as faturas da imagem: "result" passa a ser uma lista (sem repetidas)
+  multi?: boolean
+  // Perfil da leitura (true: sempre; número: só se demorar pelo menos esses ms)
+  profile?: boolean | number
+  // Tempos da leitura na resposta ("metrics"), com o resumo por nível da pirâmide
+  metrics?: boolean
+  // Frames da câmara: os pedidos com o mesmo "stream" partilham o estado (último QR e variante)
+  stream?: string
+  frame_b64?: string
+  // Tempo de cada frame em ms (por omissão 150); max_ms continua a ser o prazo do fluxo inteiro
+  frame_ms?: number
+  text?: string
+}
+
+export interface QRWorkerResponse {
+  id: string | null
+  ok: boolean
+  result?: any
+  error?: string
+  not_found?: {
+    motivo: string
+    tempo_ms: number
+    max_ms: number | null
+    tentativas: Array<{ variante: string; backend: string; nivel: string; ms: number; sucesso: boolean }>
+  }
+  // Só com "metrics": tempos por etapa, tentativas e níveis da pirâmide (MetricasLeitura.para_dict)
+  metrics?: {
+    resultado: string | null
+    total_ms: number | null
+    max_ms: number | null
+    niveis: Array<{ nivel: string; largura: number; altura: number; ms: number; sucesso: boolean }>
+    por_etapa: Record<string, { n: number; ms: number }>
+    [campo: string]: any
+  }
+  // Caminhos do perfil gravado e da cópia da imagem (só com "profile" ou QR_PERFIL_MS)
+  profile?: { ms: number; perfil?: string; imagem?: string }
+  // Frames: sem QR ainda (continuar a enviar); skipped = frame descartado com o anterior em curso
+  pending?: boolean
+  skipped?: boolean
+  frames?: number
+  stream?: { frames: number; ms: number; variante: string | null; backend: string | null }
+}
+
+interface PendingRequest {
+  resolve: (response: QRWorkerResponse) => void
+  reject: (error: Error) => void
+  timer: NodeJS.Timeout
+}
+
+const pythonScript = path.join(process.cwd(), 'scripts', 'leitor_qr_faturas_at.py')
+const numWorkers = process.env.QR_WORKERS || '2'
+// Sem mensagens de progresso por imagem no log do servidor (QR_QUIET=0 para as ver)
+const quiet = process.env.QR_QUIET !== '0'
+// Folga entre o prazo dado ao Python (max_ms) e o tempo limite do pedido: o Python desiste e
+// responde antes de o pedido ser abandonado aqui, em vez de continuar a ocupar um worker
+const timeoutMarginMs = 2000
+
+let worker: ChildProcessWithoutNullStreams | null = null
+let nextId = 1
+const pending = new Map<string, PendingRequest>()
+
+function failAll(error: Error) {
+  for (const [id, request] of pending) {
+    clearTimeout(request.timer)
+    request.reject(error)
+    pending.delete(id)
+  }
+}
+
+function getWorker(): ChildProcessWithoutNullStreams {
+  if (worker && worker.exitCode === null && !worker.killed) {
+    return worker
+  }
+
+  const args = [pythonScript, '--serve', '--workers', numWorkers, ...(quiet ? ['--quiet'] : [])]
+  console.log(`A iniciar worker QR: python3 ${args.join(' ')}`)
+  const child = spawn('python3', args, {
+    stdio: ['pipe', 'pipe', 'pipe']
+  })
+
+  const lines = readline.createInterface({ input: child.stdout })
+  lines.on('line', (line) => {
+    let response: QRWorkerResponse & { ready?: boolean }
+    try {
+      response = JSON.parse(line)
+    } catch (e) {
+      console.warn('Worker QR: linha inválida no stdout:', line)
+      return
+    }
+    if (response.ready) {
+      return
+    }
+    const id = response.id === null || response.id === undefined ? null : String(response.id)
+    const request = id ? pending.get(id) : undefined
+    if (!id || !request) {
+      console.warn('Worker QR: resposta sem pedido correspondente:', line)
+      return
+    }
+    clearTimeout(request.timer)
+    pending.delete(id)
+    request.resolve(response)
+  })
+
+  child.stderr.on('data', (data) => {
+    console.log('Python QR worker:', data.toString().trimEnd())
+  })
+
+  child.on('exit', (code, signal) => {
+    console.error(`Worker QR terminou (code=${code}, signal=${signal})`)
+    if (worker === child) {
+      worker = null
+    }
+    failAll(new Error('Worker QR terminou inesperadamente'))
+  })
+
+  child.on('error', (error) => {
+    console.error('Erro no worker QR:', error)
+    if (worker === child) {
+      worker = null
+    }
+    failAll(error)
+  })
+
+  // Escrever para um worker que já morreu (EPIPE) emite 'error' no stdin, não no processo
+  child.stdin.on('error', (error) => {
+    console.error('Erro ao escrever para o worker QR:', error)
+    if (worker === child) {
+      worker = null
+    }
+    child.kill()
+    failAll(error)
+  })
+
+  worker = child
+  return child
+}
+
+export function decodeQR(request: QRWorkerRequest, timeoutMs = 30000): Promise<QRWorkerResponse> {
+  return new Promise((resolve, reject) => {
+    const child = getWorker()
+    const id = String(nextId++)
+
+    const timer = setTimeout(() => {
+      pending.delete(id)
+      reject(new Error(`Tempo limite excedido ao ler QR (${timeoutMs} ms)`))
+    }, timeoutMs)
+
+    // Prazo sempre abaixo do tempo limite, em todos os tipos de pedido
+    const maxMs = Math.min(request.max_ms ?? Infinity, timeoutMs - Math.min(timeoutMarginMs, timeoutMs / 4))
+
+    pending.set(id, { resolve, reject, timer })
+    child.stdin.write(JSON.stringify({ id, ...request, max_ms: maxMs }) + '\n')
+  })
+}
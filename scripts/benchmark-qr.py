@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Benchmark sintético do leitor QR de faturas AT
+
+Gera payloads AT realistas, desenha-os com o codificador QR do OpenCV numa "fatura"
+e aplica degradações controladas (desfoque, JPEG, perspetiva, foto inclinada, contraste,
+papel térmico, rotação, escala minúscula, talão numa digitalização A4). Mede a taxa de leitura (recall) e os percentis de
+latência de ler_qr_de_imagem, no total e por combinação variante/backend.
+
+Uso:
+    python3 scripts/benchmark-qr.py [--amostras 10] [--seed 1] [--degradacoes limpa,jpeg,...]
+                                    [--por-tentativa] [--parallel] [--tiles] [--max-ms N] [--json resultados.json]
+                                    [--comparar anterior.json]
+"""
+
+import sys
+import os
+import json
+import time
+import random
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('QR_QUIET', '1')
+
+from leitor_qr_faturas_at import LeitorQRFaturaAT, EstatisticasTentativas, definir_silencioso  # noqa: E402
+
+# Perda de recall (pontos percentuais) a partir da qual --comparar assinala uma regressão
+TOLERANCIA_RECALL = 2.0
+
+
+# ---------------------------------------------------------------------------
+# Payloads AT
+# ---------------------------------------------------------------------------
+
+def _nif(rng: random.Random) -> str:
+    """NIF português com dígito de controlo válido"""
+    base = str(rng.choice((1, 2, 5, 5, 5, 6))) + ''.join(str(rng.randint(0, 9)) for _ in range(7))
+    soma = sum(int(d) * (9 - i) for i, d in enumerate(base))
+    controlo = 11 - soma % 11
+    return base + str(0 if controlo >= 10 else controlo)
+
+
+def gerar_payload(rng: random.Random) -> str:
+    """Payload QR AT (campos A..S, separados por asteriscos) com 1 a 3 linhas de IVA"""
+    tipo = rng.choice(('FT', 'FS', 'FR', 'NC'))
+    serie = rng.choice(('A', 'FS', '2024', 'POS1'))
+    numero = rng.randint(1, 99999)
+    campos = [
+        f"A:{_nif(rng)}",
+        f"B:{rng.choice(('999999990', _nif(rng)))}",
+        "C:PT",
+        f"D:{tipo}",
+        "E:N",
+        f"F:2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+        f"G:{tipo} {serie}/{numero}",
+        f"H:{''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(8))}-{numero}",
+        "I1:PT",
+    ]
+    total_iva = 0.0
+    total = 0.0
+    # Pares (base, IVA) por taxa: I3/I4 reduzida 6%, I5/I6 intermédia 13%, I7/I8 normal 23%
+    for campo_base, taxa in sorted(rng.sample(((3, 0.06), (5, 0.13), (7, 0.23)), rng.randint(1, 3))):
+        base = round(rng.uniform(0.5, 400), 2)
+        iva = round(base * taxa, 2)
+        campos += [f"I{campo_base}:{base:.2f}", f"I{campo_base + 1}:{iva:.2f}"]
+        total_iva += iva
+        total += base + iva
+    campos += [
+        f"N:{total_iva:.2f}",
+        f"O:{total:.2f}",
+        f"Q:{''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz') for _ in range(4))}",
+        f"R:{rng.randint(1, 9999)}",
+    ]
+    return '*'.join(campos)
+
+
+# ---------------------------------------------------------------------------
+# Imagens sintéticas
+# ---------------------------------------------------------------------------
+
+def desenhar_fatura(payload: str, rng: random.Random) -> np.ndarray:
+    """Fatura em tons de cinza (papel, texto e o QR no rodapé), como uma foto de telemóvel"""
+    codificador = cv2.QRCodeEncoder.create() if hasattr(cv2.QRCodeEncoder, 'create') else cv2.QRCodeEncoder()
+    qr = codificador.encode(payload)
+    modulo = rng.randint(5, 8)
+    qr = cv2.resize(qr, None, fx=modulo, fy=modulo, interpolation=cv2.INTER_NEAREST)
+
+    altura, largura = 3000, 2200
+    fatura = np.full((altura, largura), rng.randint(225, 245), np.uint8)
+    y = 250
+    for linha in ("FATURA SIMPLIFICADA", payload[:28], "IVA INCLUIDO", "OBRIGADO PELA PREFERENCIA"):
+        cv2.putText(fatura, linha, (180, y), cv2.FONT_HERSHEY_SIMPLEX, 2.2, 20, 5)
+        y += 160
+    qy = rng.randint(1700, altura - qr.shape[0] - 100)
+    qx = rng.randint(150, largura - qr.shape[1] - 150)
+    fatura[qy:qy + qr.shape[0], qx:qx + qr.shape[1]] = qr
+    return cv2.cvtColor(fatura, cv2.COLOR_GRAY2BGR)
+
+
+def _perspetiva(imagem, rng):
+    altura, largura = imagem.shape[:2]
+    d = lambda: rng.uniform(0.03, 0.12)  # noqa: E731
+    origem = np.float32([[0, 0], [largura, 0], [largura, altura], [0, altura]])
+    destino = np.float32([[largura * d(), altura * d()], [largura * (1 - d()), altura * d() / 2],
+                          [largura, altura], [0, altura * (1 - d() / 2)]])
+    matriz = cv2.getPerspectiveTransform(origem, destino)
+    return cv2.warpPerspective(imagem, matriz, (largura, altura), borderValue=(235, 235, 235))
+
+
+def _inclinada(imagem, rng):
+    # Foto de telemóvel tirada de lado: um dos lados do talão fica muito mais curto que o outro
+    altura, largura = imagem.shape[:2]
+    f = rng.uniform(0.4, 0.6)
+    origem = np.float32([[0, 0], [largura, 0], [largura, altura], [0, altura]])
+    if rng.random() < 0.5:
+        destino = np.float32([[0, 0], [largura, altura * f / 2], [largura, altura * (1 - f / 2)], [0, altura]])
+    else:
+        destino = np.float32([[largura * f / 2, 0], [largura * (1 - f / 2), 0], [largura, altura], [0, altura]])
+    matriz = cv2.getPerspectiveTransform(origem, destino)
+    inclinada = cv2.warpPerspective(imagem, matriz, (largura, altura), borderValue=(235, 235, 235))
+    return cv2.GaussianBlur(inclinada, (0, 0), rng.uniform(1.2, 2.2))
+
+
+def _papel_termico(imagem, rng):
+    # Impressão térmica desbotada: tinta clara, gradiente de desvanecimento e ruído do papel
+    altura, largura = imagem.shape[:2]
+    desbotada = imagem.astype(np.float32) * rng.uniform(0.25, 0.4) + 150
+    gradiente = np.linspace(0, rng.uniform(30, 60), largura, dtype=np.float32)[None, :, None]
+    ruido = np.random.default_rng(rng.randint(0, 2**31)).normal(0, 6, imagem.shape).astype(np.float32)
+    return np.clip(desbotada + gradiente + ruido, 0, 255).astype(np.uint8)
+
+
+def _rodada(imagem, rng):
+    altura, largura = imagem.shape[:2]
+    angulo = rng.choice((rng.uniform(-12, 12), 90, 180, 270))
+    matriz = cv2.getRotationMatrix2D((largura / 2, altura / 2), angulo, 1.0)
+    return cv2.warpAffine(imagem, matriz, (largura, altura), borderValue=(235, 235, 235))
+
+
+def _digitalizacao(imagem, rng):
+    # Talão pequeno numa página A4 digitalizada a 300 dpi: o QR fica com 2-3 px por módulo
+    pagina = np.full((3508, 2480, 3), rng.randint(240, 252), np.uint8)
+    talao = cv2.resize(imagem, None, fx=0.4, fy=0.4, interpolation=cv2.INTER_AREA)
+    y = rng.randint(0, pagina.shape[0] - talao.shape[0])
+    x = rng.randint(0, pagina.shape[1] - talao.shape[1])
+    pagina[y:y + talao.shape[0], x:x + talao.shape[1]] = talao
+    return pagina
+
+
+def _jpeg(imagem, rng):
+    _, dados = cv2.imencode('.jpg', imagem, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(12, 30)])
+    return cv2.imdecode(dados, cv2.IMREAD_COLOR)
+
+
+DEGRADACOES = {
+    'limpa': lambda imagem, rng: imagem,
+    'desfocada': lambda imagem, rng: cv2.GaussianBlur(imagem, (0, 0), rng.uniform(2.0, 4.0)),
+    'jpeg': _jpeg,
+    'perspetiva': _perspetiva,
+    'inclinada': _inclinada,
+    'baixo_contraste': lambda imagem, rng: (imagem.astype(np.float32) * rng.uniform(0.2, 0.35)
+                                            + rng.uniform(120, 160)).astype(np.uint8),
+    'papel_termico': _papel_termico,
+    'rodada': _rodada,
+    'minuscula': lambda imagem, rng: cv2.resize(imagem, None, fx=rng.uniform(0.18, 0.3),
+                                                fy=rng.uniform(0.18, 0.3), interpolation=cv2.INTER_AREA),
+    'digitalizacao': _digitalizacao,
+}
+
+
+def gerar_amostras(degradacao: str, amostras: int, seed: int):
+    """Lista de (payload, bytes JPEG) para uma degradação; determinística para a mesma seed"""
+    rng = random.Random(f"{seed}:{degradacao}")
+    resultado = []
+    for _ in range(amostras):
+        payload = gerar_payload(rng)
+        imagem = DEGRADACOES[degradacao](desenhar_fatura(payload, rng), rng)
+        _, dados = cv2.imencode('.jpg', imagem, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        resultado.append((payload, dados.tobytes()))
+    return resultado
+
+
+# ---------------------------------------------------------------------------
+# Medição
+# ---------------------------------------------------------------------------
+
+class LeitorUmaTentativa(LeitorQRFaturaAT):
+    """Leitor restrito a uma única combinação (variante, backend), para a matriz --por-tentativa"""
+
+    def __init__(self, variante: str, backend: str, **opcoes):
+        super().__init__(**opcoes)
+        self._tentativa = (variante, backend)
+
+    def _tentativas_disponiveis(self):
+        return [self._tentativa]
+
+
+def _percentil(valores, p):
+    return round(float(np.percentile(valores, p)), 1) if valores else None
+
+
+def medir(leitor: LeitorQRFaturaAT, amostras) -> dict:
+    """Recall e latências (ms) de ler_qr_de_imagem sobre as amostras; conta as tentativas vencedoras"""
+    latencias = []
+    lidos = 0
+    vencedoras = {}
+    for payload, dados in amostras:
+        inicio = time.perf_counter()
+        lido = leitor.ler_qr_de_imagem(dados)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        if lido == payload:
+            lidos += 1
+            sucesso = leitor.ultimas_metricas.sucesso if leitor.ultimas_metricas else None
+            if sucesso:
+                chave = f"{sucesso['variante']}|{sucesso['backend']}"
+                vencedoras[chave] = vencedoras.get(chave, 0) + 1
+    return {
+        'amostras': len(amostras),
+        'recall': round(100.0 * lidos / len(amostras), 1) if amostras else None,
+        'p50_ms': _percentil(latencias, 50),
+        'p90_ms': _percentil(latencias, 90),
+        'p99_ms': _percentil(latencias, 99),
+        'vencedoras': vencedoras,
+    }
+
+
+def _novo_leitor(classe=LeitorQRFaturaAT, *args, **opcoes):
+    # Estatísticas só em memória e sem cache: cada execução parte do mesmo estado
+    return classe(*args, estatisticas=EstatisticasTentativas(None), usar_cache=False, **opcoes)
+
+
+def _comparar(atual: dict, anterior: dict) -> int:
+    """Mostra as diferenças para um resultado anterior; devolve o número de regressões de recall"""
+    print("\n" + "=" * 60)
+    print("COMPARAÇÃO COM RESULTADO ANTERIOR")
+    print("=" * 60)
+    regressoes = 0
+    for grupo in ('total', 'por_tentativa'):
+        for chave, medida in atual.get(grupo, {}).items():
+            antes = anterior.get(grupo, {}).get(chave)
+            if not antes or medida['recall'] is None or antes['recall'] is None:
+                continue
+            delta_recall = medida['recall'] - antes['recall']
+            delta_p50 = (medida['p50_ms'] or 0) - (antes['p50_ms'] or 0)
+            marca = '✗' if delta_recall < -TOLERANCIA_RECALL else '✓'
+            regressoes += marca == '✗'
+            print(f"{marca} {chave:38s} recall {delta_recall:+6.1f} pp   p50 {delta_p50:+8.1f} ms")
+    return regressoes
+
+
+def main():
+    args = sys.argv[1:]
+
+    def opcao(nome, default=None):
+        return args[args.index(nome) + 1] if nome in args and args.index(nome) + 1 < len(args) else default
+
+    amostras = int(opcao('--amostras', '10'))
+    seed = int(opcao('--seed', '1'))
+    degradacoes = opcao('--degradacoes', ','.join(DEGRADACOES)).split(',')
+    desconhecidas = [d for d in degradacoes if d not in DEGRADACOES]
+    if desconhecidas:
+        print(f"Degradações desconhecidas: {', '.join(desconhecidas)} (disponíveis: {', '.join(DEGRADACOES)})")
+        return 1
+    opcoes_leitor = {'paralelo': '--parallel' in args, 'mosaico': '--tiles' in args}
+    if opcao('--max-ms'):
+        opcoes_leitor['max_ms'] = float(opcao('--max-ms'))
+    definir_silencioso('--verbose' not in args)
+
+    resultados = {'versao_opencv': cv2.__version__, 'amostras': amostras, 'seed': seed,
+                  'total': {}, 'por_tentativa': {}}
+
+    print("=" * 60)
+    print(f"BENCHMARK QR AT ({amostras} amostras por degradação, seed {seed})")
+    print("=" * 60)
+    print(f"{'degradação':18s} {'recall':>7s} {'p50':>8s} {'p90':>8s} {'p99':>8s}  vencedoras")
+    conjuntos = {}
+    for degradacao in degradacoes:
+        conjuntos[degradacao] = gerar_amostras(degradacao, amostras, seed)
+        medida = medir(_novo_leitor(**opcoes_leitor), conjuntos[degradacao])
+        resultados['total'][degradacao] = medida
+        vencedoras = ', '.join(f"{k}×{n}" for k, n in sorted(medida['vencedoras'].items(), key=lambda x: -x[1]))
+        print(f"{degradacao:18s} {medida['recall']:6.1f}% {medida['p50_ms']:7.0f}ms "
+              f"{medida['p90_ms']:7.0f}ms {medida['p99_ms']:7.0f}ms  {vencedoras}")
+
+    if '--por-tentativa' in args:
+        print("\n" + "=" * 60)
+        print("RECALL POR VARIANTE/BACKEND (uma só tentativa, pirâmide completa)")
+        print("=" * 60)
+        for variante, backend in _novo_leitor()._tentativas_disponiveis():
+            for degradacao in degradacoes:
+                leitor = _novo_leitor(LeitorUmaTentativa, variante, backend, **opcoes_leitor)
+                medida = medir(leitor, conjuntos[degradacao])
+                resultados['por_tentativa'][f"{variante}|{backend}|{degradacao}"] = medida
+                print(f"{variante + '|' + backend:24s} {degradacao:16s} {medida['recall']:6.1f}% "
+                      f"p50 {medida['p50_ms']:6.0f}ms  p90 {medida['p90_ms']:6.0f}ms")
+
+    caminho_json = opcao('--json')
+    if caminho_json:
+        with open(caminho_json, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+        print(f"\nResultados gravados em {caminho_json}")
+
+    caminho_anterior = opcao('--comparar')
+    if caminho_anterior:
+        with open(caminho_anterior, 'r', encoding='utf-8') as f:
+            if _comparar(resultados, json.load(f)):
+                print(f"\n✗ Recall desceu mais de {TOLERANCIA_RECALL} pp em pelo menos uma configuração")
+                return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
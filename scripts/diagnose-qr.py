@@ -6,6 +6,11 @@ Testa todas as dependências e funcionalidades
 
 import sys
 import os
+import json
+import subprocess
+
+# Tempo máximo de import do leitor para o modo --text (sem OpenCV/NumPy)
+LIMITE_IMPORT_TEXTO_MS = 150
 
 def test_imports():
     """Test Python imports"""
@@ -25,8 +30,8 @@ def test_imports():
         from pyzbar import pyzbar
         print("✓ pyzbar - OK")
     except ImportError as e:
-        print(f"✗ pyzbar - FALHOU: {e}")
-        return False
+        # Backend opcional: o leitor funciona só com o OpenCV (ver test_backends)
+        print(f"⚠ pyzbar - não disponível (backend opcional): {e}")
 
     try:
         import json
@@ -45,7 +50,8 @@ def test_qr_detection():
     print("=" * 60)
 
     import cv2
-    from pyzbar import pyzbar
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from leitor_qr_faturas_at import LeitorQRFaturaAT, _opcoes_leitor
 
     # Create a simple test image
     test_image = cv2.imread("test.jpg")
@@ -57,31 +63,22 @@ def test_qr_detection():
     print(f"✓ Imagem de teste carregada")
     print(f"  Dimensões: {test_image.shape}")
 
-    # Try detection
+    # Try detection with every active backend, on the grayscale image
     print("\nTentando detectar QR codes...")
-    codes = pyzbar.decode(test_image)
-
-    if codes:
-        print(f"✓ {len(codes)} QR code(s) encontrado(s)")
-        for i, code in enumerate(codes):
-            data = code.data.decode('utf-8')
-            print(f"  QR {i+1}: {data[:50]}...")
-            print(f"    Tipo: {code.type}")
-            print(f"    Rect: {code.rect}")
-    else:
-        print("✗ Nenhum QR code encontrado")
-        print("  Tentando com processamento...")
-
-        # Try with grayscale
-        gray = cv2.cvtColor(test_image, cv2.COLOR_BGR2GRAY)
-        codes = pyzbar.decode(gray)
-
+    leitor = LeitorQRFaturaAT(**_opcoes_leitor([]))
+    gray = cv2.cvtColor(test_image, cv2.COLOR_BGR2GRAY)
+    encontrados = False
+    for backend in leitor.backends_ativos():
+        codes = [texto for texto, _ in backend.descodificar_todos(leitor, gray) if texto]
         if codes:
-            print(f"✓ {len(codes)} QR code(s) encontrado(s) com grayscale")
+            encontrados = True
+            print(f"✓ {backend.nome}: {len(codes)} QR code(s) encontrado(s)")
+            for i, data in enumerate(codes):
+                print(f"  QR {i+1}: {data[:50]}...")
         else:
-            print("✗ Ainda nenhum QR code encontrado")
+            print(f"✗ {backend.nome}: nenhum QR code encontrado")
 
-    return codes is not None and len(codes) > 0
+    return encontrados
 
 
 def test_script():
@@ -125,6 +122,66 @@ def test_script():
         return False
 
 
+def test_backends():
+    """Lista os backends de descodificação registados e quais estão ativos"""
+    print("\n" + "=" * 60)
+    print("BACKENDS DE DESCODIFICAÇÃO")
+    print("=" * 60)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from leitor_qr_faturas_at import LeitorQRFaturaAT, BACKENDS_QR, _opcoes_leitor
+
+    # Mesma seleção que o script (QR_BACKENDS, QR_POLITICA)
+    leitor = LeitorQRFaturaAT(**_opcoes_leitor([]))
+    ativos = [backend.nome for backend in leitor.backends_ativos()]
+    for nome, backend in BACKENDS_QR.items():
+        descricao = backend.descricao()
+        if nome in ativos:
+            marca = "✓"
+        elif descricao['disponivel']:
+            marca = "○"   # instalado, mas fora de QR_BACKENDS
+        else:
+            marca = "✗"
+        extra = "" if descricao['corrige_perspetiva'] else ", sem correção de perspetiva"
+        print(f"{marca} {nome:8s} custo x{descricao['fator_custo']:.1f}, "
+              f"entradas: {', '.join(descricao['entradas'])}{extra}")
+    print(f"  Ativos: {', '.join(ativos) or 'nenhum'}  |  política: {leitor.politica}")
+    return bool(ativos)
+
+
+def test_arranque_texto():
+    """Testa que o import do leitor (caminho --text) não carrega OpenCV nem NumPy"""
+    print("\n" + "=" * 60)
+    print("TESTANDO ARRANQUE DO MODO TEXTO")
+    print("=" * 60)
+
+    # Processo novo: medir o import a frio, como no arranque do script
+    codigo = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        "import leitor_qr_faturas_at\n"
+        "ms = (time.perf_counter() - t) * 1000\n"
+        "print(json.dumps({'ms': ms, 'pesados': [m for m in ('cv2', 'numpy', 'pyzbar') if m in sys.modules]}))\n"
+    )
+    resultado = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if resultado.returncode != 0:
+        print(f"✗ Erro ao importar o leitor: {resultado.stderr.strip()}")
+        return False
+
+    medida = json.loads(resultado.stdout)
+    if medida['pesados']:
+        print(f"✗ O import carregou módulos pesados: {', '.join(medida['pesados'])}")
+        return False
+    print("✓ OpenCV/NumPy não são importados no arranque")
+
+    if medida['ms'] > LIMITE_IMPORT_TEXTO_MS:
+        print(f"✗ Import demorou {medida['ms']:.0f} ms (limite {LIMITE_IMPORT_TEXTO_MS} ms)")
+        return False
+    print(f"✓ Import em {medida['ms']:.0f} ms (limite {LIMITE_IMPORT_TEXTO_MS} ms)")
+    return True
+
+
 def main():
     print("\n")
     print("╔" + "=" * 58 + "╗")
@@ -145,6 +202,16 @@ def main():
         print("\n✗ DIAGNÓSTICO FALHOU: Script principal com erro")
         return 1
 
+    # Backends de descodificação ativos
+    if not test_backends():
+        print("\n✗ DIAGNÓSTICO FALHOU: Nenhum backend de descodificação disponível")
+        return 1
+
+    # Test text-mode startup time
+    if not test_arranque_texto():
+        print("\n✗ DIAGNÓSTICO FALHOU: Arranque do modo texto demasiado lento")
+        return 1
+
     print("\n" + "=" * 60)
     print("RESUMO")
     print("=" * 60)
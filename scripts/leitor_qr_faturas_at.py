@@ -3,26 +3,2165 @@ Leitor de QR Code de Faturas Portuguesas (AT)
 Extrai e descodifica informação estruturada dos códigos QR das faturas emitidas em Portugal
 """
 
-import cv2
-try:
-    from pyzbar import pyzbar
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
-    pyzbar = None
+from __future__ import annotations
 
 import json
+import copy
+import gc
+import re
+import math
+import zlib
+import struct
+import binascii
+import hashlib
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Iterator, Iterable, Tuple, Callable, Union
+from functools import lru_cache, cached_property
+from contextlib import contextmanager, nullcontext
 import sys
 import os
-import numpy as np
+import time
+import atexit
+import glob
+import base64
+import importlib
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturosTimeoutError
+
+
+class _ImportacaoPreguicosa:
+    """
+    Módulo importado só no primeiro acesso a um atributo. O modo --text e o parser AT não
+    precisam do OpenCV nem do NumPy, por isso não pagam o tempo de import da pilha de visão.
+    Depois do primeiro acesso o módulo real substitui este objeto nos globais.
+    """
+
+    def __init__(self, nome_modulo: str, nome_global: str):
+        self._nome_modulo = nome_modulo
+        self._nome_global = nome_global
+
+    def carregar(self):
+        modulo = importlib.import_module(self._nome_modulo)
+        globals()[self._nome_global] = modulo
+        return modulo
+
+    def __getattr__(self, atributo: str):
+        return getattr(self.carregar(), atributo)
+
+
+cv2 = _ImportacaoPreguicosa('cv2', 'cv2')
+np = _ImportacaoPreguicosa('numpy', 'np')
+
+
+def _carregar_visao():
+    """
+    Importa já o OpenCV e o NumPy. Chamado antes de começar a contar um prazo, para que o
+    import (uma vez por processo, centenas de ms) não gaste o tempo da primeira leitura.
+    """
+    for modulo in (cv2, np):
+        if isinstance(modulo, _ImportacaoPreguicosa):
+            modulo.carregar()
+
+
+def _validar_ms(valor, nome: str = 'max_ms') -> Optional[float]:
+    """Um tempo em ms (número positivo) como float, ou None; ValueError com uma mensagem clara"""
+    if valor is None:
+        return None
+    try:
+        if isinstance(valor, bool):
+            raise ValueError
+        ms = float(valor)
+    except (TypeError, ValueError):
+        ms = None
+    if ms is None or not math.isfinite(ms) or ms <= 0:
+        raise ValueError(f"{nome} tem de ser um número positivo de milissegundos (recebido: {valor!r})")
+    return ms
+
+
+@lru_cache(maxsize=None)
+def _carregar_pyzbar():
+    """Módulo pyzbar, ou None se não estiver instalado (ou faltar a libzbar)"""
+    try:
+        from pyzbar import pyzbar
+        return pyzbar
+    except ImportError:
+        return None
+
+
+def __getattr__(nome: str):
+    # Compatibilidade: PYZBAR_AVAILABLE era uma constante calculada no import
+    if nome == 'PYZBAR_AVAILABLE':
+        return _carregar_pyzbar() is not None
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+# Versão do algoritmo de leitura; mudar invalida os resultados guardados na cache
+VERSAO_LEITOR = '4'
+
+# Modo silencioso (--quiet ou QR_QUIET=1): sem mensagens de progresso no stderr.
+# Avisos e erros continuam a ser escritos.
+_SILENCIOSO = os.environ.get('QR_QUIET', '') not in ('', '0')
+
+
+def definir_silencioso(silencioso: bool = True):
+    """Liga/desliga as mensagens de progresso de todo o processo"""
+    global _SILENCIOSO
+    _SILENCIOSO = silencioso
+
+
+def _log(mensagem: str):
+    """Mensagem de progresso no stderr (suprimida no modo silencioso)"""
+    if not _SILENCIOSO:
+        print(mensagem, file=sys.stderr)
+
+
+class VariantesImagem:
+    """
+    Variantes de pré-processamento de uma imagem, calculadas só quando são pedidas.
+
+    Os intermédios partilhados (grayscale, upscale) são calculados uma única vez e
+    todas as variantes ficam em cache para serem reutilizadas por outros decoders.
+
+    No modo de pouca memória (economica=True) cada variante é libertada depois da última
+    tentativa que a usa (ver contar_usos/libertar) e o seu buffer é reaproveitado, via dst=,
+    pela variante seguinte do mesmo tamanho; os bytes vivos são reservados no orçamento da
+    leitura (MetricasLeitura.reservar_memoria) e as variantes que não cabem são saltadas.
+    """
+
+    # Ordem pela qual as variantes são tentadas (das mais baratas para as mais caras)
+    ORDEM = ('gray', 'upscaled', 'otsu', 'adaptive_gauss', 'adaptive_mean',
+             'clahe', 'equalized', 'sharpened', 'denoised', 'morph')
+
+    # Variantes geométricas: só a região do QR, retificada a partir dos cantos detetados
+    GEOMETRIA = ('retificada',)
+
+    # Tipo de imagem de cada variante, comparado com as entradas aceites por cada backend
+    TIPOS = {'original': 'cor', 'gray': 'cinzento', 'upscaled': 'cinzento', 'otsu': 'binaria',
+             'adaptive_gauss': 'binaria', 'adaptive_mean': 'binaria', 'clahe': 'cinzento',
+             'equalized': 'cinzento', 'sharpened': 'cinzento', 'denoised': 'cinzento',
+             'morph': 'cinzento', 'retificada': 'cinzento'}
+
+    # Lado (mín., máx.) do QR retificado em px e zona de silêncio à volta, em fração do lado
+    LADO_RETIFICADA = (240, 1000)
+    MARGEM_RETIFICADA = 0.12
+
+    # Variantes do tamanho da imagem em tons de cinzento, calculadas num buffer de destino (dst=)
+    COM_DESTINO = ('otsu', 'adaptive_gauss', 'adaptive_mean', 'clahe', 'equalized',
+                   'sharpened', 'denoised', 'morph')
+    # Intermédios de que as outras variantes dependem: nunca são libertados antes do fim
+    BASE = ('gray',)
+    # Buffers libertados guardados para reaproveitar (modo de pouca memória)
+    MAX_LIVRES = 1
+
+    def __init__(self, leitor: 'LeitorQRFaturaAT', imagem: np.ndarray,
+                 metricas: Optional['MetricasLeitura'] = None, economica: bool = False):
+        self.leitor = leitor
+        self.imagem = imagem
+        self.metricas = metricas
+        self.economica = economica
+        self._cache: Dict[str, Optional[np.ndarray]] = {}
+        # Um lock por variante: no modo paralelo cada variante é calculada uma única vez
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock_locks = threading.Lock()
+        # Modo de pouca memória: tentativas por fazer de cada variante, bytes reservados por
+        # variante e buffers livres para reaproveitar
+        self._usos: Dict[str, int] = {}
+        self._bytes: Dict[str, int] = {}
+        self._livres: List[np.ndarray] = []
+
+    def __enter__(self) -> 'VariantesImagem':
+        return self
+
+    def __exit__(self, *excecao):
+        self.fechar()
+
+    def obter(self, nome: str) -> Optional[np.ndarray]:
+        """Devolve a variante `nome`, calculando-a (e às suas dependências) se necessário"""
+        if nome in self._cache:
+            return self._cache.get(nome)
+        with self._lock_locks:
+            lock = self._locks.setdefault(nome, threading.Lock())
+        with lock:
+            if nome not in self._cache:
+                inicio = time.perf_counter()
+                if self.economica:
+                    if not self._calcular_com_orcamento(nome):
+                        return None
+                else:
+                    self._cache[nome] = self._CONSTRUTORES[nome](self)
+                if self.metricas is not None:
+                    self.metricas.registar('pre_processamento', (time.perf_counter() - inicio) * 1000,
+                                           variante=nome)
+            return self._cache.get(nome)
+
+    def _reservar(self, n: int, forcar: bool = False) -> bool:
+        return self.metricas is None or self.metricas.reservar_memoria(n, forcar)
+
+    def _libertar_bytes(self, n: int):
+        if self.metricas is not None and n:
+            self.metricas.libertar_memoria(n)
+
+    def _bytes_estimados(self, nome: str) -> int:
+        """Bytes que a variante vai ocupar (majorante para as de tamanho variável)"""
+        height, width = self.imagem.shape[:2]
+        if nome == 'gray':
+            return 0 if self.imagem.ndim == 2 else height * width
+        if nome == 'upscaled':
+            lado = max(height, width)
+            return 0 if lado >= 1000 else int(height * width * (1000 / lado) ** 2)
+        if nome == 'retificada':
+            return int(self.LADO_RETIFICADA[1] * (1 + 2 * self.MARGEM_RETIFICADA)) ** 2
+        return height * width
+
+    def _calcular_com_orcamento(self, nome: str) -> bool:
+        """
+        Calcula a variante reservando os seus bytes no orçamento da leitura; devolve False
+        (variante saltada, sem ficar em cache) se não couber.
+        """
+        destino = None
+        if nome in self.COM_DESTINO:
+            with self._lock_locks:
+                destino = self._livres.pop() if self._livres else None
+        reserva = 0
+        if destino is None:
+            reserva = self._bytes_estimados(nome)
+            if not self._reservar(reserva):
+                _log(f"  Variante {nome} saltada: orçamento de memória da leitura esgotado")
+                return False
+
+        if destino is not None:
+            resultado = self._CONSTRUTORES[nome](self, dst=destino)
+        else:
+            resultado = self._CONSTRUTORES[nome](self)
+
+        proprios = 0 if resultado is None or resultado is self.imagem else resultado.nbytes
+        if destino is not None and resultado is not destino:
+            # O OpenCV não usou o buffer (tamanho diferente): deixa de existir
+            self._libertar_bytes(destino.nbytes)
+            self._reservar(proprios, forcar=True)
+        elif destino is None:
+            # Acertar a estimativa pelo tamanho real
+            if proprios > reserva:
+                self._reservar(proprios - reserva, forcar=True)
+            else:
+                self._libertar_bytes(reserva - proprios)
+        self._bytes[nome] = proprios
+        self._cache[nome] = resultado
+        return True
+
+    def contar_usos(self, tentativas: Iterable[Tuple[str, str]]):
+        """Modo de pouca memória: regista quantas tentativas vão usar cada variante"""
+        if not self.economica:
+            return
+        with self._lock_locks:
+            for nome, _backend in tentativas:
+                self._usos[nome] = self._usos.get(nome, 0) + 1
+
+    def libertar(self, nome: str):
+        """
+        Fim de uma tentativa com a variante `nome`. No modo de pouca memória, depois da última
+        a variante sai da cache e o buffer fica livre para a seguinte (ou é devolvido).
+        """
+        if not self.economica:
+            return
+        with self._lock_locks:
+            restantes = self._usos.get(nome, 0) - 1
+            self._usos[nome] = restantes
+            if restantes > 0 or nome in self.BASE:
+                return
+            imagem = self._cache.pop(nome, None)
+            proprios = self._bytes.pop(nome, 0)
+            gray = self._cache.get('gray')
+            if (imagem is not None and proprios and gray is not None and imagem.shape == gray.shape
+                    and imagem.dtype == gray.dtype and len(self._livres) < self.MAX_LIVRES):
+                self._livres.append(imagem)
+                return
+        self._libertar_bytes(proprios)
+
+    def fechar(self):
+        """Liberta todas as variantes e buffers (e as respetivas reservas de memória)"""
+        with self._lock_locks:
+            total = sum(self._bytes.values()) + sum(buffer.nbytes for buffer in self._livres)
+            self._cache.clear()
+            self._bytes.clear()
+            self._livres.clear()
+        self._libertar_bytes(total)
+
+    def _gray(self) -> np.ndarray:
+        if self.imagem.ndim == 2:
+            return self.imagem
+        return cv2.cvtColor(self.imagem, cv2.COLOR_BGR2GRAY)
+
+    def _upscaled(self) -> Optional[np.ndarray]:
+        # Aumentar resolução se muito pequena
+        gray = self.obter('gray')
+        height, width = gray.shape
+        if max(height, width) >= 1000:
+            return None
+        scale = 1000 / max(height, width)
+        return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+    # As variantes em COM_DESTINO aceitam dst: um buffer livre do mesmo tamanho (ou None)
+
+    def _otsu(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        # Otsu's thresholding (binarização automática)
+        _, otsu = cv2.threshold(self.obter('gray'), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=dst)
+        return otsu
+
+    def _adaptive_gauss(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.adaptiveThreshold(self.obter('gray'), 255,
+                                     cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                     cv2.THRESH_BINARY, 11, 2, dst=dst)
+
+    def _adaptive_mean(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.adaptiveThreshold(self.obter('gray'), 255,
+                                     cv2.ADAPTIVE_THRESH_MEAN_C,
+                                     cv2.THRESH_BINARY, 11, 2, dst=dst)
+
+    def _clahe(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        # CLAHE (Contrast Limited Adaptive Histogram Equalization)
+        return self.leitor._objeto_da_thread('clahe').apply(self.obter('gray'), dst=dst)
+
+    def _equalized(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.equalizeHist(self.obter('gray'), dst=dst)
+
+    def _sharpened(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        return cv2.filter2D(self.obter('gray'), -1, self.leitor.kernel_sharpening, dst=dst)
+
+    def _denoised(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        # Denoise: o filtro mais caro, por isso fica perto do fim
+        return cv2.fastNlMeansDenoising(self.obter('gray'), dst, 10, 7, 21)
+
+    def _morph(self, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        # Morphological operations para limpar ruído
+        return cv2.morphologyEx(self.obter('gray'), cv2.MORPH_CLOSE, self.leitor.kernel_morph, dst=dst)
+
+    def _original(self) -> np.ndarray:
+        return self.imagem
+
+    def _retificada(self) -> Optional[np.ndarray]:
+        """
+        O QR visto de frente: os quatro cantos dados pelos finder patterns são levados a um
+        quadrado direito, com a zona de silêncio à volta. Corrige a inclinação e a perspetiva
+        das fotos de telemóvel (e a rotação) trabalhando só na região do QR.
+        """
+        cantos = self.leitor._cantos_qr(self.obter('gray'))
+        if cantos is None:
+            return None
+        lados = np.linalg.norm(cantos - np.roll(cantos, -1, axis=0), axis=1)
+        lado = int(np.clip(lados.max(), *self.LADO_RETIFICADA))
+        margem = int(lado * self.MARGEM_RETIFICADA)
+        destino = np.array([[margem, margem], [margem + lado, margem],
+                            [margem + lado, margem + lado], [margem, margem + lado]], dtype=np.float32)
+        matriz = cv2.getPerspectiveTransform(cantos, destino)
+        return cv2.warpPerspective(self.obter('gray'), matriz, (lado + 2 * margem, lado + 2 * margem),
+                                   flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+    _CONSTRUTORES: Dict[str, Callable[['VariantesImagem'], Optional[np.ndarray]]] = {
+        'original': _original,
+        'gray': _gray,
+        'upscaled': _upscaled,
+        'otsu': _otsu,
+        'adaptive_gauss': _adaptive_gauss,
+        'adaptive_mean': _adaptive_mean,
+        'clahe': _clahe,
+        'equalized': _equalized,
+        'sharpened': _sharpened,
+        'denoised': _denoised,
+        'morph': _morph,
+        'retificada': _retificada,
+    }
+
+
+class BackendQR:
+    """
+    Um descodificador de QR, registado em BACKENDS_QR.
+
+    Cada backend declara se está disponível (dependências opcionais), o custo relativo de uma
+    tentativa, os tipos de imagem que aceita (ver VariantesImagem.TIPOS) e se corrige sozinho a
+    perspetiva. O ciclo de procura só gera as combinações variante/backend compatíveis, por isso
+    um descodificador novo é só mais uma subclasse registada.
+    """
+
+    nome = ''
+    # Multiplica o custo estimado da variante enquanto não há medições (ver EstatisticasTentativas)
+    fator_custo = 1.0
+    entradas: Tuple[str, ...] = ('cinzento', 'binaria')
+    # Sem correção de perspetiva própria, o QR retificado é tentado antes das outras variantes
+    corrige_perspetiva = True
+
+    def disponivel(self) -> bool:
+        return True
+
+    def descodificar(self, leitor: 'LeitorQRFaturaAT', imagem: np.ndarray) -> Optional[str]:
+        """Texto do primeiro QR lido na imagem, ou None"""
+        raise NotImplementedError
+
+    def descodificar_todos(self, leitor: 'LeitorQRFaturaAT',
+                           imagem: np.ndarray) -> List[Tuple[str, Optional[np.ndarray]]]:
+        """
+        Todos os QR da imagem (modo multi-QR), como pares (texto, cantos). Texto vazio com
+        cantos quer dizer um QR detetado mas não descodificado.
+        """
+        texto = self.descodificar(leitor, imagem)
+        return [(texto, None)] if texto else []
+
+    def descricao(self) -> Dict:
+        return {'nome': self.nome, 'disponivel': self.disponivel(), 'fator_custo': self.fator_custo,
+                'entradas': list(self.entradas), 'corrige_perspetiva': self.corrige_perspetiva}
+
+
+class BackendOpenCV(BackendQR):
+    """QRCodeDetector do OpenCV (e o detetor Aruco, no modo multi-QR)"""
+
+    nome = 'opencv'
+
+    def descodificar(self, leitor, imagem):
+        texto, _pontos, _qr = leitor._objeto_da_thread('qr_detector').detectAndDecode(imagem)
+        return texto or None
+
+    def descodificar_todos(self, leitor, imagem):
+        codigos = []
+        for detetor in (leitor._objeto_da_thread('qr_detector'), leitor.qr_localizador):
+            if detetor is None:
+                continue
+            ok, textos, pontos = detetor.detectAndDecodeMulti(imagem)[:3]
+            if not ok:
+                continue
+            # Os dois detetores costumam ver os mesmos QR: cada texto lido só conta uma vez
+            lidos = {texto for texto, _ in codigos if texto}
+            codigos += [(texto, pontos[i] if pontos is not None else None)
+                        for i, texto in enumerate(textos or ()) if not texto or texto not in lidos]
+        return codigos
+
+
+class BackendPyzbar(BackendQR):
+    """ZBar via pyzbar (opcional): só símbolos QR, sem correção de perspetiva"""
+
+    nome = 'pyzbar'
+    fator_custo = 2.0
+    corrige_perspetiva = False
+
+    def disponivel(self):
+        return _carregar_pyzbar() is not None
+
+    def _ler(self, imagem):
+        pyzbar = _carregar_pyzbar()
+        # Restringir aos QR evita correr os leitores de códigos de barras 1D em cada imagem
+        return pyzbar.decode(imagem, symbols=[pyzbar.ZBarSymbol.QRCODE])
+
+    def descodificar(self, leitor, imagem):
+        codigos_qr = self._ler(imagem)
+        return codigos_qr[0].data.decode('utf-8') if codigos_qr else None
+
+    def descodificar_todos(self, leitor, imagem):
+        return [(codigo.data.decode('utf-8'), np.array(codigo.polygon, dtype=np.float32))
+                for codigo in self._ler(imagem)]
+
+
+class BackendWeChat(BackendQR):
+    """
+    Detetor WeChat do opencv-contrib (opcional). Com os modelos CNN em QR_WECHAT_MODELOS
+    (detect.prototxt, detect.caffemodel, sr.prototxt, sr.caffemodel) usa deteção e
+    super-resolução por rede neuronal; sem eles, o detetor clássico do módulo.
+    Faz a sua própria binarização, por isso só recebe variantes em tons de cinzento.
+    """
+
+    nome = 'wechat'
+    fator_custo = 3.0
+    entradas = ('cinzento',)
+
+    def disponivel(self):
+        return hasattr(cv2, 'wechat_qrcode_WeChatQRCode')
+
+    @staticmethod
+    def criar():
+        diretoria = os.environ.get('QR_WECHAT_MODELOS', '')
+        modelos = [os.path.join(diretoria, nome) for nome in
+                   ('detect.prototxt', 'detect.caffemodel', 'sr.prototxt', 'sr.caffemodel')]
+        if diretoria and all(os.path.exists(caminho) for caminho in modelos):
+            return cv2.wechat_qrcode_WeChatQRCode(*modelos)
+        return cv2.wechat_qrcode_WeChatQRCode()
+
+    def descodificar_todos(self, leitor, imagem):
+        textos, pontos = leitor._objeto_da_thread('wechat').detectAndDecode(imagem)
+        return [(texto, pontos[i] if i < len(pontos) else None) for i, texto in enumerate(textos)]
+
+    def descodificar(self, leitor, imagem):
+        lidos = [texto for texto, _ in self.descodificar_todos(leitor, imagem) if texto]
+        return lidos[0] if lidos else None
+
+
+# Backends por nome, pela ordem de prioridade por omissão
+BACKENDS_QR: Dict[str, BackendQR] = {}
+
+
+def registar_backend(backend: BackendQR) -> BackendQR:
+    """Regista (ou substitui) um backend de descodificação"""
+    BACKENDS_QR[backend.nome] = backend
+    return backend
+
+
+for _backend in (BackendOpenCV(), BackendPyzbar(), BackendWeChat()):
+    registar_backend(_backend)
+
+
+class EstatisticasTentativas:
+    """
+    Estatísticas de sucesso e custo de cada par (variante, backend), persistidas num ficheiro JSON.
+
+    A ordem das tentativas é dada pela probabilidade estimada de sucesso por milissegundo:
+    as combinações que descodificam as faturas habituais (poucos modelos de POS) passam
+    para a frente, e as que nunca funcionam vão para o fim ou são ignoradas.
+    """
+
+    # Custo inicial estimado (ms) de cada variante, usado enquanto não há medições
+    CUSTO_INICIAL_MS = {
+        'original': 5, 'gray': 5, 'upscaled': 15, 'otsu': 10, 'adaptive_gauss': 20,
+        'adaptive_mean': 20, 'clahe': 20, 'equalized': 10, 'sharpened': 15,
+        'denoised': 600, 'morph': 15, 'retificada': 30,
+    }
+
+    # Pares com pelo menos este número de tentativas e nenhum sucesso deixam de ser tentados (0 desativa)
+    PODA_MIN_TENTATIVAS = int(os.environ.get('QR_STATS_PODA_MIN', '200'))
+
+    # Intervalo mínimo entre escritas do ficheiro de estatísticas
+    INTERVALO_GRAVACAO_S = 5.0
+
+    _partilhadas: Dict[str, 'EstatisticasTentativas'] = {}
+    _lock_partilhadas = threading.Lock()
+
+    def __init__(self, caminho: Optional[str] = None):
+        self.caminho = caminho
+        self._dados: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._alterado = False
+        self._ultima_gravacao = 0.0
+        self._carregar()
+
+    @classmethod
+    def partilhadas(cls, caminho: Optional[str] = None) -> 'EstatisticasTentativas':
+        """
+        Instância partilhada por caminho (os leitores de todas as threads atualizam as mesmas contagens).
+        O caminho vem de QR_STATS_PATH; com QR_STATS_PATH vazio as estatísticas ficam só em memória.
+        """
+        if caminho is None:
+            caminho = os.environ.get('QR_STATS_PATH',
+                                     os.path.join(os.path.expanduser('~'), '.cache', 'despesify', 'qr_stats.json'))
+        with cls._lock_partilhadas:
+            if caminho not in cls._partilhadas:
+                estatisticas = cls(caminho or None)
+                atexit.register(estatisticas.guardar, True)
+                cls._partilhadas[caminho] = estatisticas
+            return cls._partilhadas[caminho]
+
+    @staticmethod
+    def _chave(variante: str, backend: str) -> str:
+        return f"{variante}|{backend}"
+
+    def _carregar(self):
+        if not self.caminho or not os.path.exists(self.caminho):
+            return
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as f:
+                self._dados = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Aviso: estatísticas de QR ignoradas ({self.caminho}): {e}", file=sys.stderr)
+            self._dados = {}
+
+    def guardar(self, forcar: bool = False):
+        """Grava o ficheiro se houver alterações (no máximo uma vez por INTERVALO_GRAVACAO_S)"""
+        if not self.caminho:
+            return
+        with self._lock:
+            if not self._alterado:
+                return
+            if not forcar and time.monotonic() - self._ultima_gravacao < self.INTERVALO_GRAVACAO_S:
+                return
+            dados = json.dumps(self._dados, indent=1, sort_keys=True)
+            self._alterado = False
+            self._ultima_gravacao = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+            temporario = f"{self.caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(dados)
+            os.replace(temporario, self.caminho)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar estatísticas de QR: {e}", file=sys.stderr)
+
+    def registar(self, variante: str, backend: str, sucesso: bool, duracao_ms: float):
+        with self._lock:
+            entrada = self._dados.setdefault(self._chave(variante, backend),
+                                             {'tentativas': 0, 'sucessos': 0, 'tempo_ms': 0.0})
+            entrada['tentativas'] += 1
+            entrada['sucessos'] += 1 if sucesso else 0
+            entrada['tempo_ms'] = round(entrada['tempo_ms'] + duracao_ms, 3)
+            self._alterado = True
+
+    def custo_estimado_ms(self, variante: str, backend: str) -> float:
+        """Custo médio medido de uma tentativa (ou a estimativa inicial, sem medições)"""
+        entrada = self._dados.get(self._chave(variante, backend))
+        if entrada and entrada['tentativas']:
+            return entrada['tempo_ms'] / entrada['tentativas']
+        fator = BACKENDS_QR[backend].fator_custo if backend in BACKENDS_QR else 1.0
+        return self.CUSTO_INICIAL_MS.get(variante, 50) * fator
+
+    def pontuacao(self, variante: str, backend: str) -> float:
+        """Probabilidade estimada de sucesso (suavizada) a dividir pelo custo médio em ms"""
+        entrada = self._dados.get(self._chave(variante, backend))
+        tentativas = entrada['tentativas'] if entrada else 0
+        sucessos = entrada['sucessos'] if entrada else 0
+        probabilidade = (sucessos + 1) / (tentativas + 2)
+        return probabilidade / max(self.custo_estimado_ms(variante, backend), 0.1)
+
+    def ordenar(self, tentativas: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Ordena as tentativas pela pontuação, removendo as que nunca tiveram sucesso"""
+        with self._lock:
+            if self.PODA_MIN_TENTATIVAS > 0:
+                def util(par):
+                    entrada = self._dados.get(self._chave(*par))
+                    return not entrada or entrada['sucessos'] > 0 or entrada['tentativas'] < self.PODA_MIN_TENTATIVAS
+                tentativas = [par for par in tentativas if util(par)]
+            # sorted é estável: sem estatísticas mantém-se a ordem por custo estimado / ordem original
+            return sorted(tentativas, key=lambda par: -self.pontuacao(*par))
+
+
+class CacheDescodificacao:
+    """
+    Cache de resultados de leitura indexada pelo hash do conteúdo da imagem.
+
+    Duas camadas: um LRU em memória (útil no modo servidor) e ficheiros JSON em disco,
+    limitados em tamanho total e despejados pelos menos usados recentemente (mtime).
+    As imagens sem QR também ficam em cache, mas só durante TTL_FALHAS segundos.
+    """
+
+    MAX_MEMORIA = 256
+    MAX_DISCO_BYTES = int(float(os.environ.get('QR_CACHE_MAX_MB', '50')) * 1024 * 1024)
+    TTL_FALHAS = float(os.environ.get('QR_CACHE_TTL_FALHAS', '300'))
+
+    _partilhadas: Dict[str, 'CacheDescodificacao'] = {}
+    _lock_partilhadas = threading.Lock()
+
+    def __init__(self, diretoria: Optional[str] = None):
+        self.diretoria = diretoria
+        self._memoria: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._tamanho_disco: Optional[int] = None
+
+    @classmethod
+    def partilhada(cls, diretoria: Optional[str] = None) -> 'CacheDescodificacao':
+        """
+        Instância partilhada por diretoria. A diretoria vem de QR_CACHE_DIR;
+        com QR_CACHE_DIR vazio a cache fica só em memória.
+        """
+        if diretoria is None:
+            diretoria = os.environ.get('QR_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'despesify', 'qr_cache'))
+        with cls._lock_partilhadas:
+            if diretoria not in cls._partilhadas:
+                cls._partilhadas[diretoria] = cls(diretoria or None)
+            return cls._partilhadas[diretoria]
+
+    @staticmethod
+    def chave(conteudo: bytes, assinatura: str = '') -> str:
+        """Chave da cache: SHA-256 dos bytes da imagem mais a versão/configuração do leitor"""
+        h = hashlib.sha256(assinatura.encode('utf-8') + b'\0')
+        h.update(conteudo)
+        return h.hexdigest()
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretoria, chave[:2], f"{chave}.json")
+
+    def _valida(self, entrada: Dict) -> bool:
+        return not entrada.get('falhou') or time.time() - entrada.get('criado', 0) < self.TTL_FALHAS
+
+    def obter(self, chave: str) -> Optional[Dict]:
+        """Devolve a entrada ({'dados_qr', 'fatura'} ou {'falhou': True}) ou None se não existir/expirou"""
+        with self._lock:
+            entrada = self._memoria.get(chave)
+            if entrada is not None:
+                if self._valida(entrada):
+                    self._memoria.move_to_end(chave)
+                    return copy.deepcopy(entrada)
+                del self._memoria[chave]
+
+        if not self.diretoria:
+            return None
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                entrada = json.load(f)
+            if not self._valida(entrada):
+                os.remove(caminho)
+                return None
+            os.utime(caminho)  # marca como usada recentemente (LRU)
+        except (OSError, ValueError):
+            return None
+
+        self._lembrar(chave, entrada)
+        return copy.deepcopy(entrada)
+
+    def guardar(self, chave: str, resultado: Optional[Dict]):
+        """Guarda um resultado de leitura; resultado None regista uma falha (com TTL)"""
+        entrada = dict(resultado) if resultado else {'falhou': True}
+        entrada['criado'] = time.time()
+        self._lembrar(chave, copy.deepcopy(entrada))
+
+        if not self.diretoria:
+            return
+        caminho = self._caminho(chave)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            dados = json.dumps(entrada, ensure_ascii=False).encode('utf-8')
+            temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporario, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except OSError as e:
+            print(f"Aviso: não foi possível gravar na cache de QR: {e}", file=sys.stderr)
+            return
+
+        with self._lock:
+            if self._tamanho_disco is not None:
+                self._tamanho_disco += len(dados)
+        self._despejar_se_necessario()
+
+    def _lembrar(self, chave: str, entrada: Dict):
+        with self._lock:
+            self._memoria[chave] = entrada
+            self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.MAX_MEMORIA:
+                self._memoria.popitem(last=False)
+
+    def _despejar_se_necessario(self):
+        """Remove os ficheiros menos usados recentemente até a cache caber em MAX_DISCO_BYTES"""
+        with self._lock:
+            if self._tamanho_disco is not None and self._tamanho_disco <= self.MAX_DISCO_BYTES:
+                return
+            ficheiros = []
+            for raiz, _, nomes in os.walk(self.diretoria):
+                for nome in nomes:
+                    if nome.endswith('.json'):
+                        caminho = os.path.join(raiz, nome)
+                        try:
+                            info = os.stat(caminho)
+                        except OSError:
+                            continue
+                        ficheiros.append((info.st_mtime, info.st_size, caminho))
+            total = sum(tamanho for _, tamanho, _ in ficheiros)
+            if total > self.MAX_DISCO_BYTES:
+                # Despejar até 90% do limite para não repetir a varrimento a cada escrita
+                for _, tamanho, caminho in sorted(ficheiros):
+                    if total <= self.MAX_DISCO_BYTES * 0.9:
+                        break
+                    try:
+                        os.remove(caminho)
+                        total -= tamanho
+                    except OSError:
+                        pass
+            self._tamanho_disco = total
+
+
+class IndiceFaturas:
+    """
+    Índice persistente (SQLite) das faturas já lidas, para reconhecer uma fatura repetida logo
+    a seguir à descodificação, sem consultas à tabela de despesas.
+
+    A chave junta o NIF do emitente, o ATCUD (ou, sem ATCUD, o número do documento) e o hash
+    do QR (campo P). Cada entrada guarda quando e de onde a fatura foi vista pela primeira vez,
+    quantas vezes apareceu e o resultado dessa primeira leitura. O ficheiro usa WAL, por isso
+    os workers do modo lote (processos) e do servidor (threads) partilham o mesmo índice.
+    """
+
+    _partilhados: Dict[str, 'IndiceFaturas'] = {}
+    _lock_partilhados = threading.Lock()
+
+    def __init__(self, caminho: Optional[str] = None):
+        import sqlite3
+
+        self.caminho = caminho
+        if caminho:
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._ligacao = sqlite3.connect(caminho or ':memory:', timeout=10, check_same_thread=False,
+                                        isolation_level=None)
+        if caminho:
+            self._ligacao.execute('PRAGMA journal_mode=WAL')
+            self._ligacao.execute('PRAGMA synchronous=NORMAL')
+        self._ligacao.execute(
+            'CREATE TABLE IF NOT EXISTS faturas ('
+            ' chave TEXT PRIMARY KEY, nif_emitente TEXT, atcud TEXT, numero_documento TEXT, hash TEXT,'
+            ' origem TEXT, visto_em REAL, vezes INTEGER, fatura TEXT) WITHOUT ROWID')
+        self._ligacao.execute('CREATE INDEX IF NOT EXISTS faturas_nif ON faturas (nif_emitente)')
+
+    @classmethod
+    def partilhado(cls, caminho: Optional[str] = None) -> 'IndiceFaturas':
+        """
+        Instância partilhada por caminho. O caminho vem de QR_INDICE_PATH; com QR_INDICE_PATH
+        vazio o índice fica só em memória (duplicados dentro do mesmo processo).
+        """
+        if caminho is None:
+            caminho = cls.caminho_padrao()
+        with cls._lock_partilhados:
+            if caminho not in cls._partilhados:
+                cls._partilhados[caminho] = cls(caminho or None)
+            return cls._partilhados[caminho]
+
+    @staticmethod
+    def caminho_padrao() -> str:
+        return os.environ.get('QR_INDICE_PATH',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'despesify', 'faturas.sqlite3'))
+
+    @staticmethod
+    def chave(fatura: Dict) -> Optional[str]:
+        """Chave da fatura (NIF|ATCUD ou número|hash), ou None se faltar o que a identifica"""
+        nif = fatura.get('nif_emitente')
+        documento = fatura.get('atcud') or fatura.get('numero_documento')
+        if not nif or not documento or 'erro' in fatura:
+            return None
+        return f"{nif}|{documento}|{fatura.get('hash') or ''}"
+
+    @staticmethod
+    def _anterior(linha) -> Dict:
+        origem, visto_em, vezes, fatura = linha
+        return {'origem': origem, 'visto_em': datetime.fromtimestamp(visto_em).isoformat(timespec='seconds'),
+                'vezes': vezes, 'fatura': json.loads(fatura)}
+
+    def consultar(self, fatura: Dict) -> Optional[Dict]:
+        """A primeira leitura da mesma fatura ({'origem', 'visto_em', 'vezes', 'fatura'}), ou None"""
+        chave = self.chave(fatura)
+        if chave is None:
+            return None
+        with self._lock:
+            linha = self._ligacao.execute('SELECT origem, visto_em, vezes, fatura FROM faturas WHERE chave = ?',
+                                          (chave,)).fetchone()
+        return self._anterior(linha) if linha else None
+
+    def registar(self, fatura: Dict, origem: str = '') -> Optional[Dict]:
+        """
+        Consulta e atualiza numa só transação: devolve a leitura anterior se a fatura já foi
+        vista (e conta mais uma vez), ou None depois de a registar como nova.
+        """
+        chave = self.chave(fatura)
+        if chave is None:
+            return None
+        with self._lock:
+            self._ligacao.execute('BEGIN IMMEDIATE')
+            try:
+                linha = self._ligacao.execute('SELECT origem, visto_em, vezes, fatura FROM faturas WHERE chave = ?',
+                                              (chave,)).fetchone()
+                if linha:
+                    self._ligacao.execute('UPDATE faturas SET vezes = vezes + 1 WHERE chave = ?', (chave,))
+                else:
+                    self._ligacao.execute('INSERT INTO faturas VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)',
+                                          self._valores(chave, fatura, origem))
+                self._ligacao.execute('COMMIT')
+            except BaseException:
+                self._ligacao.execute('ROLLBACK')
+                raise
+        return self._anterior(linha) if linha else None
+
+    @staticmethod
+    def _valores(chave: str, fatura: Dict, origem: str) -> Tuple:
+        return (chave, fatura.get('nif_emitente'), fatura.get('atcud'), fatura.get('numero_documento'),
+                fatura.get('hash'), origem, time.time(), json.dumps(fatura, ensure_ascii=False))
+
+    def carregar_lote(self, faturas: Iterable[Tuple[Dict, str]]) -> int:
+        """
+        Carrega muitas faturas (fatura, origem) de uma vez, numa só transação; as que já estão
+        no índice ficam como estavam. Devolve quantas entraram.
+        """
+        valores = [self._valores(chave, fatura, origem) for fatura, origem in faturas
+                   for chave in (self.chave(fatura),) if chave is not None]
+        with self._lock:
+            antes = self._ligacao.total_changes
+            self._ligacao.execute('BEGIN IMMEDIATE')
+            try:
+                self._ligacao.executemany('INSERT OR IGNORE INTO faturas VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)', valores)
+                self._ligacao.execute('COMMIT')
+            except BaseException:
+                self._ligacao.execute('ROLLBACK')
+                raise
+            return self._ligacao.total_changes - antes
+
+    def fechar(self):
+        with self._lock:
+            self._ligacao.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._ligacao.execute('SELECT COUNT(*) FROM faturas').fetchone()[0]
+
+
+class MetricasLeitura:
+    """
+    Tempos por etapa de uma leitura (uma imagem): carregamento, localização, cada variante
+    de pré-processamento, cada tentativa de descodificação e o parse do payload AT.
+
+    Pode ser alimentada por várias threads (modo paralelo). para_dict() devolve o bloco JSON.
+
+    Guarda também o prazo da leitura (max_ms), verificado pela procura entre tentativas, e
+    o orçamento de memória (max_memoria_mb) do modo de pouca memória: as imagens e variantes
+    vivas reservam os seus bytes antes de serem criadas e o pico fica registado.
+    """
+
+    def __init__(self, max_ms: Optional[float] = None, max_memoria_mb: Optional[float] = None):
+        self._inicio = time.perf_counter()
+        self._lock = threading.Lock()
+        self.etapas: List[Dict] = []
+        self.dimensoes: Optional[Tuple[int, int]] = None
+        self.sucesso: Optional[Dict] = None
+        self.resultado: Optional[str] = None
+        self.total_ms: Optional[float] = None
+        self.max_ms = max_ms
+        self.prazo = self._inicio + max_ms / 1000 if max_ms else None
+        self.prazo_atingido = False
+        self.max_memoria = int(max_memoria_mb * 1024 * 1024) if max_memoria_mb else None
+        self.memoria_usada = 0
+        self.memoria_pico = 0
+        # As tentativas desta leitura contam para a ordenação aprendida (EstatisticasTentativas)
+        self.aprender = True
+
+    def reservar_memoria(self, n: int, forcar: bool = False) -> bool:
+        """
+        Reserva n bytes do orçamento; devolve False (sem reservar) se o ultrapassassem.
+        Com forcar=True reserva sempre (memória que já existe e não pode ser evitada).
+        """
+        with self._lock:
+            if not forcar and self.max_memoria is not None and self.memoria_usada + n > self.max_memoria:
+                return False
+            self.memoria_usada += n
+            self.memoria_pico = max(self.memoria_pico, self.memoria_usada)
+            return True
+
+    def libertar_memoria(self, n: int):
+        with self._lock:
+            self.memoria_usada = max(0, self.memoria_usada - n)
+
+    def restante_ms(self) -> float:
+        """Milissegundos até ao prazo (infinito se a leitura não tiver prazo)"""
+        if self.prazo is None:
+            return float('inf')
+        return (self.prazo - time.perf_counter()) * 1000
+
+    def esgotado(self) -> bool:
+        """True (e marca o prazo como atingido) se o prazo da leitura já passou"""
+        if self.prazo is not None and time.perf_counter() >= self.prazo:
+            self.prazo_atingido = True
+        return self.prazo_atingido
+
+    def tentativas(self) -> List[Dict]:
+        """Tentativas de descodificação feitas, pela ordem em que terminaram"""
+        with self._lock:
+            return [{k: v for k, v in entrada.items() if k != 'etapa'}
+                    for entrada in self.etapas if entrada['etapa'] == 'descodificar']
+
+    def registar(self, etapa: str, duracao_ms: float, **detalhes):
+        entrada = {'etapa': etapa, 'ms': round(duracao_ms, 2)}
+        entrada.update(detalhes)
+        with self._lock:
+            self.etapas.append(entrada)
+
+    @contextmanager
+    def medir(self, etapa: str, **detalhes):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registar(etapa, (time.perf_counter() - inicio) * 1000, **detalhes)
+
+    def concluir(self, resultado: str):
+        """Fecha a leitura com o resultado ('sucesso', 'sem_qr', 'cache', 'erro')"""
+        self.resultado = resultado
+        self.total_ms = round((time.perf_counter() - self._inicio) * 1000, 2)
+
+    def para_dict(self) -> Dict:
+        por_etapa: Dict[str, Dict] = {}
+        with self._lock:
+            etapas = list(self.etapas)
+        for entrada in etapas:
+            soma = por_etapa.setdefault(entrada['etapa'], {'n': 0, 'ms': 0.0})
+            soma['n'] += 1
+            soma['ms'] = round(soma['ms'] + entrada['ms'], 2)
+        return {
+            'resultado': self.resultado,
+            'total_ms': self.total_ms,
+            'max_ms': self.max_ms,
+            **({'memoria_pico_mb': round(self.memoria_pico / 1024 / 1024, 1),
+                'max_memoria_mb': round(self.max_memoria / 1024 / 1024, 1)} if self.max_memoria else {}),
+            'dimensoes': {'largura': self.dimensoes[0], 'altura': self.dimensoes[1]} if self.dimensoes else None,
+            'sucesso': self.sucesso,
+            # Resumo da pirâmide: tempo de cada nível procurado (e do mosaico), pela ordem da procura
+            'niveis': [{k: v for k, v in entrada.items() if k != 'etapa'}
+                       for entrada in etapas if entrada['etapa'] == 'nivel'],
+            'por_etapa': por_etapa,
+            'etapas': etapas,
+        }
+
+
+class RegistoMetricas:
+    """
+    Contadores e histogramas acumulados de todas as leituras do processo, exportáveis no
+    formato de texto do Prometheus (modo servidor: op 'metrics'; modo lote: --metrics prometheus).
+    """
+
+    # Limites (ms) dos buckets dos histogramas de tempo por etapa
+    LIMITES_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    _partilhado: Optional['RegistoMetricas'] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leituras: Dict[str, int] = {}
+        self.tentativas: Dict[Tuple[str, str, str], int] = {}
+        # etapa -> [contagens por bucket..., +Inf, soma_ms]
+        self.histogramas: Dict[str, List[float]] = {}
+
+    @classmethod
+    def partilhado(cls) -> 'RegistoMetricas':
+        if cls._partilhado is None:
+            cls._partilhado = cls()
+        return cls._partilhado
+
+    def _observar(self, nome: str, valor_ms: float):
+        histograma = self.histogramas.get(nome)
+        if histograma is None:
+            histograma = self.histogramas[nome] = [0] * (len(self.LIMITES_MS) + 1) + [0.0]
+        for i, limite in enumerate(self.LIMITES_MS):
+            if valor_ms <= limite:
+                histograma[i] += 1
+        histograma[len(self.LIMITES_MS)] += 1
+        histograma[-1] += valor_ms
+
+    def acumular(self, metricas: Dict):
+        """Acrescenta uma leitura (o dicionário de MetricasLeitura.para_dict())"""
+        with self._lock:
+            resultado = metricas.get('resultado') or 'desconhecido'
+            self.leituras[resultado] = self.leituras.get(resultado, 0) + 1
+            if metricas.get('total_ms') is not None:
+                self._observar('total', metricas['total_ms'])
+            for entrada in metricas.get('etapas', ()):
+                self._observar(entrada['etapa'], entrada['ms'])
+                if entrada['etapa'] == 'descodificar':
+                    chave = (entrada.get('variante', ''), entrada.get('backend', ''),
+                             'sucesso' if entrada.get('sucesso') else 'falha')
+                    self.tentativas[chave] = self.tentativas.get(chave, 0) + 1
+
+    def para_prometheus(self) -> str:
+        """Texto no formato de exposição do Prometheus"""
+        linhas = ['# HELP qr_leituras_total Leituras de imagem por resultado',
+                  '# TYPE qr_leituras_total counter']
+        with self._lock:
+            for resultado, n in sorted(self.leituras.items()):
+                linhas.append(f'qr_leituras_total{{resultado="{resultado}"}} {n}')
+            linhas += ['# HELP qr_tentativas_total Tentativas de descodificação por variante, backend e resultado',
+                       '# TYPE qr_tentativas_total counter']
+            for (variante, backend, resultado), n in sorted(self.tentativas.items()):
+                linhas.append(f'qr_tentativas_total{{variante="{variante}",backend="{backend}",'
+                              f'resultado="{resultado}"}} {n}')
+            linhas += ['# HELP qr_etapa_ms Tempo por etapa da leitura em milissegundos',
+                       '# TYPE qr_etapa_ms histogram']
+            for etapa, histograma in sorted(self.histogramas.items()):
+                for limite, n in zip(self.LIMITES_MS, histograma):
+                    linhas.append(f'qr_etapa_ms_bucket{{etapa="{etapa}",le="{limite}"}} {n}')
+                total = histograma[len(self.LIMITES_MS)]
+                linhas.append(f'qr_etapa_ms_bucket{{etapa="{etapa}",le="+Inf"}} {total}')
+                linhas.append(f'qr_etapa_ms_sum{{etapa="{etapa}"}} {round(histograma[-1], 3)}')
+                linhas.append(f'qr_etapa_ms_count{{etapa="{etapa}"}} {total}')
+        return "\n".join(linhas) + "\n"
+
+
+class PerfilLeitura:
+    """
+    Perfil de uma leitura lenta: cProfile (.pstats, só a thread que chama) ou amostragem das
+    pilhas a cada INTERVALO_AMOSTRAS_S (.folded, formato "a;b;c N" do flamegraph.pl), que também
+    apanha as threads do pool que trabalham para esta leitura (modo paralelo, ladrilhos) e só
+    essas: as tarefas de outras leituras no mesmo pool (modo servidor) não entram.
+
+    A leitura corre sempre com o perfil ligado; só as que passam do limite ficam gravadas em
+    DIRETORIA, ao lado de uma cópia da imagem, com o mesmo nome base.
+    """
+
+    MODOS = ('cprofile', 'amostras')
+    DIRETORIA = os.environ.get('QR_PERFIL_DIR',
+                               os.path.join(os.path.expanduser('~'), '.cache', 'despesify', 'perfis'))
+    INTERVALO_AMOSTRAS_S = 0.005
+
+    def __init__(self, modo: str = 'cprofile'):
+        if modo not in self.MODOS:
+            raise ValueError(f"modo de perfil inválido: {modo} (válidos: {', '.join(self.MODOS)})")
+        self.modo = modo
+        self._perfil = None
+        self._amostras: Dict[str, int] = {}
+        self._parar = threading.Event()
+        self._amostrador: Optional[threading.Thread] = None
+        # Threads que trabalham para esta leitura: a que chama e as do pool enquanto correm
+        # tarefas dela (ver LeitorQRFaturaAT._submeter)
+        self._threads: Dict[int, int] = {threading.get_ident(): 1}
+        self._lock_threads = threading.Lock()
+
+    @contextmanager
+    def na_thread(self):
+        """Amostra a thread atual enquanto corre uma tarefa desta leitura"""
+        ident = threading.get_ident()
+        with self._lock_threads:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock_threads:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def iniciar(self):
+        if self.modo == 'cprofile':
+            import cProfile
+            self._perfil = cProfile.Profile()
+            try:
+                self._perfil.enable()
+            except ValueError:
+                # Já há outro profiler ativo nesta thread (ex.: python -m cProfile)
+                self._perfil = None
+        else:
+            self._amostrador = threading.Thread(target=self._amostrar, name='qr-perfil', daemon=True)
+            self._amostrador.start()
+
+    def terminar(self):
+        if self._perfil is not None:
+            self._perfil.disable()
+        if self._amostrador is not None:
+            self._parar.set()
+            self._amostrador.join()
+
+    @staticmethod
+    def _nome_frame(frame) -> str:
+        codigo = frame.f_code
+        return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+    def _amostrar(self):
+        while not self._parar.wait(self.INTERVALO_AMOSTRAS_S):
+            with self._lock_threads:
+                threads = set(self._threads)
+            for ident, frame in sys._current_frames().items():
+                if ident not in threads:
+                    continue
+                pilha = []
+                while frame is not None:
+                    pilha.append(self._nome_frame(frame))
+                    frame = frame.f_back
+                chave = ';'.join(reversed(pilha))
+                self._amostras[chave] = self._amostras.get(chave, 0) + 1
+
+    def guardar(self, origem: OrigemImagem, total_ms: float) -> Dict:
+        """Grava o perfil e a imagem em DIRETORIA; devolve {'ms', 'perfil', 'imagem'}"""
+        os.makedirs(self.DIRETORIA, exist_ok=True)
+        nome = os.path.splitext(os.path.basename(origem))[0] if isinstance(origem, str) else 'memoria'
+        base = os.path.join(self.DIRETORIA, f"{datetime.now():%Y%m%d-%H%M%S}_{os.getpid()}_"
+                                            f"{threading.get_ident() % 10000}_{total_ms:.0f}ms_{nome}")
+        guardado = {'ms': round(total_ms, 1)}
+
+        if self._perfil is not None:
+            guardado['perfil'] = f"{base}.pstats"
+            self._perfil.dump_stats(guardado['perfil'])
+        elif self._amostras:
+            guardado['perfil'] = f"{base}.folded"
+            with open(guardado['perfil'], 'w', encoding='utf-8') as f:
+                for pilha, n in sorted(self._amostras.items(), key=lambda item: -item[1]):
+                    f.write(f"{pilha} {n}\n")
+
+        if isinstance(origem, str):
+            guardado['imagem'] = base + os.path.splitext(origem)[1].lower()
+            shutil.copyfile(origem, guardado['imagem'])
+        elif isinstance(origem, np.ndarray):
+            guardado['imagem'] = f"{base}.png"
+            cv2.imwrite(guardado['imagem'], origem)
+        elif _origem_em_memoria(origem):
+            guardado['imagem'] = base + _extensao_conteudo(origem)
+            with open(guardado['imagem'], 'wb') as f:
+                f.write(origem)
+        return guardado
+
+    @staticmethod
+    def resumo(caminhos: Iterable[str], n: int = 20) -> str:
+        """
+        Relatório com os N pontos quentes de vários perfis juntos: por tempo próprio e acumulado
+        (.pstats) ou por amostras próprias e inclusivas (.folded)
+        """
+        import io
+        import pstats
+
+        caminhos = list(caminhos)
+        partes = []
+        pstats_ = [caminho for caminho in caminhos if caminho.endswith('.pstats')]
+        if pstats_:
+            for ordem in ('tottime', 'cumulative'):
+                texto = io.StringIO()
+                estatisticas = pstats.Stats(*pstats_, stream=texto)
+                estatisticas.strip_dirs().sort_stats(ordem).print_stats(n)
+                partes.append(f"== {len(pstats_)} perfil(is) cProfile, por {ordem} ==\n{texto.getvalue()}")
+
+        proprias: Dict[str, int] = {}
+        inclusivas: Dict[str, int] = {}
+        total = 0
+        for caminho in caminhos:
+            if not caminho.endswith('.folded'):
+                continue
+            with open(caminho, 'r', encoding='utf-8') as f:
+                for linha in f:
+                    pilha, _, contagem = linha.rstrip('\n').rpartition(' ')
+                    if not pilha or not contagem.isdigit():
+                        continue
+                    contagem = int(contagem)
+                    total += contagem
+                    frames = pilha.split(';')
+                    proprias[frames[-1]] = proprias.get(frames[-1], 0) + contagem
+                    for frame in set(frames):
+                        inclusivas[frame] = inclusivas.get(frame, 0) + contagem
+        if total:
+            for titulo, contagens in (('próprias', proprias), ('inclusivas', inclusivas)):
+                linhas = [f"{contagem:8d} {100 * contagem / total:5.1f}%  {frame}"
+                          for frame, contagem in sorted(contagens.items(), key=lambda item: -item[1])[:n]]
+                partes.append(f"== {total} amostras, por amostras {titulo} ==\n" + '\n'.join(linhas) + '\n')
+        return '\n'.join(partes)
+
+
+# ---------------------------------------------------------------------------
+# Descodificação do payload QR AT (tabela de campos, uma só passagem)
+# ---------------------------------------------------------------------------
+
+# Campos de texto copiados diretamente para o resultado
+_CAMPOS_TEXTO_AT = {
+    'A': 'nif_emitente',
+    'B': 'nif_adquirente',
+    'C': 'pais_adquirente',
+    'D': 'tipo_documento',
+    'E': 'estado_documento',
+    'G': 'numero_documento',
+    'H': 'atcud',
+    'P': 'hash',
+    'Q': 'numero_certificado',
+    'R': 'outras_infos',
+}
+
+
+def _posicao_campo_iva(numero: int) -> Optional[Tuple[int, str, bool]]:
+    """
+    Mapeia o número de um campo I<n> para (linha, campo, cria_linha_se_invalido).
+
+    Os pares base/IVA aparecem em dois formatos:
+      Formato 1: I3/I4 = linha 1, I7/I8 = linha 2, I11/I12 = linha 3... (padrão antigo)
+      Formato 2: I5/I6 = linha 1, I7/I8 = linha 2, I9/I10 = linha 3... (padrão novo)
+    Ímpares são bases tributáveis e pares são valores de IVA. I1 é normalmente o país,
+    mas se for numérico é tratado como base da linha 1. I2 é ignorado.
+    """
+    if numero == 1:
+        return 1, 'base_tributavel', False
+    if numero < 3:
+        return None
+    if numero % 2 == 1:
+        linha = (numero - 5) // 2 + 1 if numero >= 5 else (numero - 3) // 4 + 1
+        return linha, 'base_tributavel', True
+    linha = (numero - 6) // 2 + 1 if numero >= 6 else (numero - 4) // 4 + 1
+    return linha, 'valor_iva', True
+
+
+# Tabela pré-calculada para as chaves I1..I199 (as outras são calculadas na hora)
+_MAPA_CAMPOS_IVA = {f"I{n}": _posicao_campo_iva(n) for n in range(1, 200)}
+
+
+@lru_cache(maxsize=4096)
+def _normalizar_data_at(valor: str) -> str:
+    """Data no formato YYYYMMDD -> YYYY-MM-DD (ou o valor original se não for uma data)"""
+    try:
+        return datetime.strptime(valor, '%Y%m%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return valor
+
+
+def _copiar_fatura(fatura: Dict) -> Dict:
+    """Cópia independente de um resultado de descodificação (só as linhas de IVA são mutáveis)"""
+    copia = dict(fatura)
+    if 'linhas_iva' in copia:
+        copia['linhas_iva'] = [dict(linha) for linha in copia['linhas_iva']]
+    return copia
+
+
+def _descodificar_payload_at(dados_qr: str) -> Dict:
+    """
+    Descodifica um payload QR AT numa só passagem pelos campos separados por '*'.
+    Lança ValueError se os campos N/O não forem numéricos (tratado em descodificar_qr_fatura).
+
+    Em CPython são ~75 mil payloads distintos por segundo por núcleo (~13 µs cada, quase tudo
+    o próprio ciclo do interpretador): as centenas de milhares por segundo só se atingem com
+    payloads repetidos, memoizados em LeitorQRFaturaAT.descodificar_lote.
+    """
+    fatura = {
+        'raw_data': dados_qr,
+        'nif_emitente': None,
+        'nif_adquirente': None,
+        'pais_adquirente': None,
+        'tipo_documento': None,
+        'estado_documento': None,
+        'data_emissao': None,
+        'numero_documento': None,
+        'atcud': None,
+        'linhas_iva': [],
+        'valor_total': None,
+        'retencao_iva': None,
+        'hash': None,
+        'numero_certificado': None,
+        'outras_infos': None
+    }
+    campos_texto = _CAMPOS_TEXTO_AT
+    mapa_iva = _MAPA_CAMPOS_IVA
+    linhas_iva: Dict[int, Dict] = {}
+    campo_n = None
+    campo_o = None
+
+    for campo in dados_qr.split('*'):
+        chave, separador, valor = campo.partition(':')
+        if not separador:
+            continue
+
+        destino = campos_texto.get(chave)
+        if destino is not None:
+            fatura[destino] = valor
+        elif chave == 'F':
+            fatura['data_emissao'] = _normalizar_data_at(valor)
+        elif chave == 'N':
+            # N pode ser valor total OU IVA total, decide-se no fim
+            campo_n = float(valor)
+        elif chave == 'O':
+            # O pode ser retenção OU valor total, decide-se no fim
+            campo_o = float(valor) if valor else 0
+        elif chave[:1] == 'I':
+            posicao = mapa_iva.get(chave)
+            if posicao is None:
+                try:
+                    posicao = _posicao_campo_iva(int(chave[1:]))
+                except ValueError:
+                    continue
+                if posicao is None:
+                    continue
+            num_linha, nome_campo, cria_se_invalido = posicao
+            try:
+                numero = float(valor)
+            except ValueError:
+                if cria_se_invalido and num_linha not in linhas_iva:
+                    linhas_iva[num_linha] = {}
+                continue
+            linha = linhas_iva.get(num_linha)
+            if linha is None:
+                linha = linhas_iva[num_linha] = {}
+            linha[nome_campo] = numero
+
+    # Completar linhas de IVA (taxa calculada a partir da base e do IVA) e totais
+    total_base = 0
+    total_iva = 0
+    lista_linhas = fatura['linhas_iva']
+    for num_linha in sorted(linhas_iva):
+        linha = linhas_iva[num_linha]
+        if 'base_tributavel' in linha and 'valor_iva' in linha:
+            base = linha['base_tributavel']
+            iva_valor = linha['valor_iva']
+            if base > 0:
+                calculated_taxa = round((iva_valor / base) * 100, 2)
+                linha['taxa_iva_percentagem'] = calculated_taxa
+                linha['taxa_iva_codigo'] = f"CALC({calculated_taxa}%)"
+            elif iva_valor == 0:
+                # Base 0 e IVA 0: isento
+                linha['taxa_iva_percentagem'] = 0
+                linha['taxa_iva_codigo'] = 'ISE'
+        total_base += linha.get('base_tributavel', 0)
+        total_iva += linha.get('valor_iva', 0)
+        lista_linhas.append(linha)
+
+    # Calcular o valor total esperado (base + IVA)
+    valor_total_calculado = round(total_base + total_iva, 2)
+    campo_n = campo_n if campo_n is not None else 0
+    campo_o = campo_o if campo_o is not None else 0
+
+    if lista_linhas and total_base > 0:
+        # Temos linhas de IVA válidas - usar valor calculado como total
+        fatura['valor_total'] = valor_total_calculado
+        if abs(campo_n - total_iva) < 0.01:
+            # N é o IVA total
+            fatura['total_iva_qr'] = campo_n
+            fatura['retencao_iva'] = campo_o if campo_o else 0
+        elif abs(campo_o - total_iva) < 0.01:
+            # O é o IVA total
+            fatura['total_iva_qr'] = campo_o
+            fatura['retencao_iva'] = campo_n if campo_n else 0
+        else:
+            # Nenhum corresponde ao IVA - guardar ambos para referência
+            fatura['campo_n_original'] = campo_n
+            fatura['campo_o_original'] = campo_o
+            fatura['retencao_iva'] = 0
+    elif abs(campo_n - valor_total_calculado) < abs(campo_o - valor_total_calculado):
+        # Sem linhas de IVA válidas: o campo mais próximo do valor calculado é o total
+        fatura['valor_total'] = campo_n
+        fatura['retencao_iva'] = campo_o
+    else:
+        fatura['valor_total'] = campo_o
+        fatura['retencao_iva'] = campo_n
+
+    # Campos auxiliares para debug/verificação
+    fatura['total_base_calculado'] = round(total_base, 2)
+    fatura['total_iva_calculado'] = round(total_iva, 2)
+    return fatura
+
+
+def _payload_at_valido(dados_qr: str) -> bool:
+    """Se o texto lido tem o formato de um QR de fatura AT (outros QR da página: URLs, talões, ...)"""
+    if not dados_qr.startswith('A:') or '*' not in dados_qr:
+        return False
+    try:
+        _descodificar_payload_at(dados_qr)
+    except Exception:
+        return False
+    return True
+
+
+class ColunasFaturas:
+    """
+    Faturas descodificadas em formato colunar (arrays estruturados NumPy), para agregações rápidas.
+
+    - cabecalhos: uma linha por fatura (NIFs, data, totais)
+    - linhas: uma linha por linha de IVA, com 'fatura' = posição da fatura em `cabecalhos`
+    """
+
+    # Listas de campos (e não np.dtype) para não importar o NumPy com o módulo
+    DTYPE_CABECALHO = [
+        ('indice', 'i4'),             # posição da fatura na lista de entrada
+        ('nif_emitente', 'U12'),
+        ('nif_adquirente', 'U12'),
+        ('tipo_documento', 'U4'),
+        ('data_emissao', 'M8[D]'),    # NaT se a data não for válida
+        ('valor_total', 'f8'),
+        ('retencao_iva', 'f8'),
+        ('total_base', 'f8'),
+        ('total_iva', 'f8'),
+    ]
+
+    DTYPE_LINHA = [
+        ('fatura', 'i4'),             # índice em cabecalhos
+        ('base_tributavel', 'f8'),
+        ('valor_iva', 'f8'),
+        ('taxa_iva_percentagem', 'f8'),  # NaN se não calculável
+        ('taxa_iva_codigo', 'U4'),       # NOR/INT/RED/ISE (taxas_iva_pt) ou OUT
+    ]
+
+    DTYPE_TOTAIS = [('base_tributavel', 'f8'), ('valor_iva', 'f8'), ('valor_total', 'f8'), ('num_faturas', 'i8')]
+
+    def __init__(self, cabecalhos: np.ndarray, linhas: np.ndarray):
+        self.cabecalhos = cabecalhos
+        self.linhas = linhas
+
+    def __len__(self) -> int:
+        return len(self.cabecalhos)
+
+    def guardar(self, caminho: str):
+        """Grava as duas tabelas num ficheiro .npz comprimido"""
+        np.savez_compressed(caminho, cabecalhos=self.cabecalhos, linhas=self.linhas)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> 'ColunasFaturas':
+        with np.load(caminho) as dados:
+            return cls(dados['cabecalhos'], dados['linhas'])
+
+    def _agregar_faturas(self, chaves: np.ndarray, nome_chave: str, dtype_chave) -> np.ndarray:
+        """
+        Soma base, IVA e total por chave (uma chave por fatura, em `cabecalhos`) e conta as
+        faturas. O total é o do QR (campo O), e as faturas sem linhas de IVA também contam.
+        """
+        valores, inverso = np.unique(chaves, return_inverse=True)
+        inverso = inverso.ravel()
+        resultado = np.zeros(len(valores), dtype=[(nome_chave, dtype_chave)] + self.DTYPE_TOTAIS)
+        resultado[nome_chave] = valores
+        for campo, coluna in (('base_tributavel', 'total_base'), ('valor_iva', 'total_iva'),
+                              ('valor_total', 'valor_total')):
+            resultado[campo] = np.round(np.bincount(inverso, weights=self.cabecalhos[coluna],
+                                                    minlength=len(valores)), 2)
+        resultado['num_faturas'] = np.bincount(inverso, minlength=len(valores))
+        return resultado
+
+    def _agregar(self, chaves_linhas: np.ndarray, nome_chave: str, dtype_chave) -> np.ndarray:
+        """Soma base, IVA e total por chave (uma chave por linha de IVA) e conta faturas distintas"""
+        valores, inverso = np.unique(chaves_linhas, return_inverse=True)
+        inverso = inverso.ravel()
+        resultado = np.zeros(len(valores), dtype=[(nome_chave, dtype_chave)] + self.DTYPE_TOTAIS)
+        resultado[nome_chave] = valores
+        base = np.bincount(inverso, weights=self.linhas['base_tributavel'], minlength=len(valores))
+        iva = np.bincount(inverso, weights=self.linhas['valor_iva'], minlength=len(valores))
+        resultado['base_tributavel'] = np.round(base, 2)
+        resultado['valor_iva'] = np.round(iva, 2)
+        resultado['valor_total'] = np.round(base + iva, 2)
+        # Faturas distintas por chave: pares (chave, fatura) únicos
+        pares = np.unique(np.stack([inverso, self.linhas['fatura']]), axis=1)
+        resultado['num_faturas'] = np.bincount(pares[0], minlength=len(valores))
+        return resultado
+
+    def totais_por_nif(self) -> np.ndarray:
+        """Base, IVA, total do QR e número de faturas por NIF do emitente"""
+        return self._agregar_faturas(self.cabecalhos['nif_emitente'], 'nif_emitente', 'U12')
+
+    def totais_por_periodo(self, unidade: str = 'M') -> np.ndarray:
+        """
+        Base, IVA, total do QR e número de faturas por período da data de emissão
+        ('D', 'M' mês, 'Y' ano); NaT = sem data
+        """
+        periodos = self.cabecalhos['data_emissao'].astype(f'M8[{unidade}]')
+        return self._agregar_faturas(periodos, 'periodo', f'M8[{unidade}]')
+
+    def totais_por_taxa(self) -> np.ndarray:
+        """
+        Base, IVA e total (base + IVA) por código de taxa de IVA (NOR, INT, RED, ISE, OUT),
+        a partir das linhas de IVA: uma fatura com várias taxas conta em cada uma
+        """
+        return self._agregar(self.linhas['taxa_iva_codigo'], 'taxa_iva_codigo', 'U4')
+
+
+# Origem de uma imagem: caminho, bytes do ficheiro (upload, stdin) ou imagem já descodificada
+OrigemImagem = Union[str, bytes, bytearray, memoryview, 'np.ndarray']
+
+
+def _origem_em_memoria(origem: OrigemImagem) -> bool:
+    return isinstance(origem, (bytes, bytearray, memoryview))
+
+
+# Orientações EXIF que espelham a imagem (as restantes são só rotações)
+_ORIENTACOES_ESPELHADAS = (2, 4, 5, 7)
+
+
+def _cabecalho_imagem(origem: OrigemImagem, tamanho: int) -> bytes:
+    """Primeiros `tamanho` bytes do ficheiro ou do buffer (vazio se não for possível ler)"""
+    if isinstance(origem, np.ndarray):
+        return b''
+    if _origem_em_memoria(origem):
+        return bytes(memoryview(origem)[:tamanho])
+    try:
+        with open(origem, 'rb') as f:
+            return f.read(tamanho)
+    except OSError:
+        return b''
+
+
+def _orientacao_exif(origem: OrigemImagem) -> int:
+    """
+    Tag Orientation (0x0112) do EXIF de um JPEG, lida só dos segmentos do cabeçalho
+    (o APP1 tem no máximo 64 KiB). Devolve 1 (normal) se não houver EXIF ou se for inválido.
+    """
+    dados = _cabecalho_imagem(origem, 128 * 1024)
+    if dados[:2] != b'\xff\xd8':
+        return 1
+    posicao = 2
+    while posicao + 4 <= len(dados) and dados[posicao] == 0xFF:
+        marcador = dados[posicao + 1]
+        if marcador in (0xD9, 0xDA):   # fim da imagem / início dos dados comprimidos
+            break
+        comprimento = struct.unpack('>H', dados[posicao + 2:posicao + 4])[0]
+        segmento = dados[posicao + 4:posicao + 2 + comprimento]
+        posicao += 2 + comprimento
+        if marcador != 0xE1 or segmento[:6] != b'Exif\x00\x00':
+            continue
+        tiff = segmento[6:]
+        ordem = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+        if ordem is None or len(tiff) < 8:
+            return 1
+        try:
+            ifd = struct.unpack(ordem + 'I', tiff[4:8])[0]
+            (entradas,) = struct.unpack(ordem + 'H', tiff[ifd:ifd + 2])
+            for i in range(entradas):
+                inicio = ifd + 2 + 12 * i
+                tag, _tipo, _contagem, valor = struct.unpack(ordem + 'HHIH', tiff[inicio:inicio + 10])
+                if tag == 0x0112:
+                    return valor if 1 <= valor <= 8 else 1
+        except struct.error:
+            pass
+        return 1
+    return 1
+
+
+def _ler_imagem(origem: OrigemImagem, flag: Optional[int] = None) -> Optional[np.ndarray]:
+    """
+    Lê uma imagem de um caminho ou de um buffer em memória. Os bytes são descodificados com
+    cv2.imdecode sobre uma vista np.frombuffer, sem cópia nem ficheiro temporário.
+
+    A orientação EXIF não é aplicada pelo OpenCV (rodar a foto inteira custa tanto como
+    uma boa parte da descompressão e o QR lê-se em qualquer rotação); só as orientações
+    espelhadas são desfeitas, com um flip horizontal, porque um QR espelhado não descodifica.
+    """
+    if isinstance(origem, np.ndarray):
+        return origem
+    if flag is None:
+        flag = cv2.IMREAD_COLOR
+    flag |= cv2.IMREAD_IGNORE_ORIENTATION
+    if _origem_em_memoria(origem):
+        buffer = np.frombuffer(origem, dtype=np.uint8)
+        if buffer.size == 0:
+            return None
+        imagem = cv2.imdecode(buffer, flag)
+    else:
+        imagem = cv2.imread(origem, flag)
+    if imagem is not None and _orientacao_exif(origem) in _ORIENTACOES_ESPELHADAS:
+        imagem = cv2.flip(imagem, 1)
+    return imagem
+
+
+# Assinaturas (magic bytes) dos formatos aceites, para dar nome a bytes recebidos em memória
+_ASSINATURAS_FORMATO = ((b'\xff\xd8\xff', '.jpg'), (b'\x89PNG\r\n\x1a\n', '.png'), (b'BM', '.bmp'),
+                        (b'II*\x00', '.tif'), (b'MM\x00*', '.tif'), (b'GIF8', '.gif'))
+
+
+def _extensao_conteudo(conteudo: bytes) -> str:
+    """Extensão do ficheiro pelos primeiros bytes (.jpg, .png, .pdf, ...); '.bin' se for desconhecido"""
+    cabecalho = bytes(memoryview(conteudo)[:16])
+    for assinatura, extensao in _ASSINATURAS_FORMATO:
+        if cabecalho.startswith(assinatura):
+            return extensao
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return '.webp'
+    if DocumentoPDF.e_pdf(conteudo):
+        return '.pdf'
+    return '.bin'
+
+
+def _descrever_origem(origem: OrigemImagem) -> str:
+    if isinstance(origem, np.ndarray):
+        return f"<imagem {origem.shape}>"
+    if _origem_em_memoria(origem):
+        return f"<{len(origem)} bytes em memória>"
+    return origem
+
+
+# ---------------------------------------------------------------------------
+# PDF: imagens embutidas lidas diretamente dos bytes do ficheiro, sem rasterizar a página
+# ---------------------------------------------------------------------------
+
+_PDF_ESPACOS = b' \t\r\n\f\x00'
+_PDF_DELIMITADORES = b'()<>[]{}/%'
+_PDF_NUMERO = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)')
+_PDF_REFERENCIA = re.compile(rb'\s+\d+\s+R(?![^\s()<>\[\]{}/%])')
+_PDF_INICIO_OBJETO = re.compile(rb'(?<!\d)(\d+)\s+(\d+)\s+obj\b')
+# Componentes por espaço de cor (os restantes, como DeviceN ou Pattern, não são suportados)
+_PDF_COMPONENTES = {'DeviceGray': 1, 'CalGray': 1, 'G': 1, 'DeviceRGB': 3, 'CalRGB': 3, 'RGB': 3,
+                    'DeviceCMYK': 4, 'CMYK': 4, 'Lab': 3}
+
+
+class _RefPDF:
+    """Referência indireta 'n g R' de um PDF"""
+
+    __slots__ = ('numero',)
+
+    def __init__(self, numero: int):
+        self.numero = numero
+
+
+class _StreamPDF:
+    """Stream de um PDF: dicionário e bytes ainda comprimidos"""
+
+    __slots__ = ('dicionario', 'dados', 'numero')
+
+    def __init__(self, dicionario: Dict, dados: bytes, numero: Optional[int] = None):
+        self.dicionario = dicionario
+        self.dados = dados
+        self.numero = numero
+
+
+def _pdf_saltar_espacos(dados: bytes, pos: int) -> int:
+    while pos < len(dados):
+        if dados[pos] in _PDF_ESPACOS:
+            pos += 1
+        elif dados[pos] == 0x25:   # comentário '%' até ao fim da linha
+            while pos < len(dados) and dados[pos] not in b'\r\n':
+                pos += 1
+        else:
+            break
+    return pos
+
+
+def _pdf_analisar(dados: bytes, pos: int):
+    """
+    Analisa o objeto PDF que começa em `pos` e devolve (objeto, posição seguinte).
+    Nomes são str (sem '/'), strings são bytes, dicionários dict e referências _RefPDF.
+    """
+    pos = _pdf_saltar_espacos(dados, pos)
+    if pos >= len(dados):
+        raise ValueError("fim inesperado do PDF")
+    c = dados[pos]
+    if dados.startswith(b'<<', pos):
+        dicionario = {}
+        pos += 2
+        while True:
+            pos = _pdf_saltar_espacos(dados, pos)
+            if dados.startswith(b'>>', pos) or pos >= len(dados):
+                return dicionario, pos + 2
+            chave, pos = _pdf_analisar(dados, pos)
+            valor, pos = _pdf_analisar(dados, pos)
+            if isinstance(chave, str):
+                dicionario[chave] = valor
+    if c == 0x5B:   # '['
+        lista = []
+        pos += 1
+        while True:
+            pos = _pdf_saltar_espacos(dados, pos)
+            if pos >= len(dados) or dados[pos] == 0x5D:
+                return lista, pos + 1
+            valor, pos = _pdf_analisar(dados, pos)
+            lista.append(valor)
+    if c == 0x2F:   # '/'
+        fim = pos + 1
+        while fim < len(dados) and dados[fim] not in _PDF_ESPACOS and dados[fim] not in _PDF_DELIMITADORES:
+            fim += 1
+        nome = re.sub(rb'#([0-9A-Fa-f]{2})', lambda m: bytes([int(m.group(1), 16)]), dados[pos + 1:fim])
+        return nome.decode('latin-1'), fim
+    if c == 0x28:   # '(' string literal, com parênteses aninhados e escapes
+        nivel, fim = 1, pos + 1
+        while fim < len(dados) and nivel:
+            if dados[fim] == 0x5C:
+                fim += 1
+            elif dados[fim] == 0x28:
+                nivel += 1
+            elif dados[fim] == 0x29:
+                nivel -= 1
+            fim += 1
+        return dados[pos + 1:fim - 1], fim
+    if c == 0x3C:   # '<' string hexadecimal
+        fim = dados.index(b'>', pos)
+        hexa = re.sub(rb'\s', b'', dados[pos + 1:fim])
+        return bytes.fromhex((hexa + b'0' * (len(hexa) % 2)).decode('ascii')), fim + 1
+    numero = _PDF_NUMERO.match(dados, pos)
+    if numero:
+        texto = numero.group()
+        if b'.' not in texto:
+            referencia = _PDF_REFERENCIA.match(dados, numero.end())
+            if referencia:
+                return _RefPDF(int(texto)), referencia.end()
+            return int(texto), numero.end()
+        return float(texto), numero.end()
+    fim = pos
+    while fim < len(dados) and dados[fim] not in _PDF_ESPACOS and dados[fim] not in _PDF_DELIMITADORES:
+        fim += 1
+    palavra = dados[pos:max(fim, pos + 1)]
+    return {b'true': True, b'false': False, b'null': None}.get(palavra, palavra.decode('latin-1')), max(fim, pos + 1)
+
+
+# Formato PNG equivalente a cada número de bytes por pixel dos preditores: (tipo de cor, bits,
+# componentes); o filtro PNG só depende de bpp, por isso as linhas valem tal como vêm do PDF
+_PNG_POR_BPP = {1: (0, 8, 1), 2: (0, 16, 1), 3: (2, 8, 3), 4: (6, 8, 4), 6: (2, 16, 3), 8: (6, 16, 4)}
+# Bytes acima dos quais o caminho em Python (bpp sem equivalente PNG) recusa desfazer Average/Paeth
+_PDF_MAX_BYTES_PREDITOR_PYTHON = 1 << 20
+
+
+def _png_chunk(tipo: bytes, dados: bytes) -> bytes:
+    return struct.pack('>I', len(dados)) + tipo + dados + struct.pack('>I', zlib.crc32(tipo + dados))
+
+
+def _pdf_despredizer_png(bruto: np.ndarray, bpp: int) -> Optional[np.ndarray]:
+    """
+    Desfaz os filtros com a libpng do OpenCV: as linhas (byte de filtro + dados) são o IDAT de
+    um PNG com o mesmo bpp. Devolve as linhas sem filtro, ou None se o PNG não for aceite.
+    """
+    tipo_cor, bits, componentes = _PNG_POR_BPP[bpp]
+    linhas, largura = bruto.shape[0], bruto.shape[1] - 1
+    cabecalho = struct.pack('>IIBBBBB', largura // bpp, linhas, bits, tipo_cor, 0, 0, 0)
+    png = (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', cabecalho)
+           # Nível 0 (blocos sem compressão): o zlib só copia e soma o adler32
+           + _png_chunk(b'IDAT', zlib.compress(bruto.tobytes(), 0)) + _png_chunk(b'IEND', b''))
+    imagem = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if imagem is None:
+        return None
+    if componentes >= 3:
+        # O OpenCV devolve BGR(A): repor a ordem das amostras do PDF
+        imagem = imagem[:, :, [2, 1, 0, 3][:componentes]]
+    if bits == 16:
+        imagem = imagem.astype('>u2')
+    return np.ascontiguousarray(imagem).view(np.uint8).reshape(linhas, largura)
+
+
+def _pdf_despredizer(dados: bytes, parametros: Dict, colunas_padrao: int = 1) -> bytes:
+    """
+    Desfaz os preditores PNG (Predictor >= 10) de um stream Flate/LZW. Average e Paeth dependem
+    do byte anterior da mesma linha: em Python custariam segundos numa página digitalizada, por
+    isso as linhas vão para a libpng (ver _pdf_despredizer_png); só um bpp sem formato PNG
+    equivalente fica no caminho em Python, limitado a _PDF_MAX_BYTES_PREDITOR_PYTHON.
+    """
+    preditor = parametros.get('Predictor', 1)
+    if preditor < 10:
+        return dados
+    bpp = max(1, parametros.get('Colors', 1) * parametros.get('BitsPerComponent', 8) // 8)
+    largura = (parametros.get('Columns', colunas_padrao) * parametros.get('Colors', 1)
+               * parametros.get('BitsPerComponent', 8) + 7) // 8
+    linhas = len(dados) // (largura + 1)
+    bruto = np.frombuffer(dados, dtype=np.uint8)[:linhas * (largura + 1)].reshape(linhas, largura + 1)
+    if not linhas:
+        return b''
+    if bruto[:, 0].max() > 4:
+        raise ValueError(f"filtro PNG inválido no preditor: {int(bruto[:, 0].max())}")
+    if bpp in _PNG_POR_BPP and largura % bpp == 0:
+        saida = _pdf_despredizer_png(bruto, bpp)
+        if saida is None:
+            raise ValueError("linhas do preditor PNG ilegíveis")
+        return saida.tobytes()
+    if np.isin(bruto[:, 0], (3, 4)).any() and bruto.size > _PDF_MAX_BYTES_PREDITOR_PYTHON:
+        raise ValueError(f"preditor Average/Paeth com {bpp} bytes por pixel demasiado grande ({bruto.size} bytes)")
+    saida = np.zeros((linhas, largura), dtype=np.uint8)
+    anterior = np.zeros(largura, dtype=np.uint8)
+    for y in range(linhas):
+        filtro, linha = bruto[y, 0], bruto[y, 1:]
+        if filtro == 0:
+            atual = linha.copy()
+        elif filtro == 1:   # Sub: soma acumulada por byte do pixel (módulo 256)
+            atual = np.zeros(largura, dtype=np.uint8)
+            for k in range(bpp):
+                atual[k::bpp] = np.cumsum(linha[k::bpp], dtype=np.uint8)
+        elif filtro == 2:   # Up
+            atual = linha + anterior
+        else:               # Average / Paeth: dependência byte a byte
+            atual = bytearray(largura)
+            for i in range(largura):
+                a = atual[i - bpp] if i >= bpp else 0
+                b = int(anterior[i])
+                if filtro == 3:
+                    previsto = (a + b) // 2
+                else:
+                    c = int(anterior[i - bpp]) if i >= bpp else 0
+                    p = a + b - c
+                    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                    previsto = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                atual[i] = (int(linha[i]) + previsto) & 0xFF
+            atual = np.frombuffer(bytes(atual), dtype=np.uint8)
+        saida[y] = atual
+        anterior = atual
+    return saida.tobytes()
+
+
+class DocumentoPDF:
+    """
+    Leitor mínimo de PDF (sem dependências) para chegar às imagens de cada página: objetos
+    localizados por varrimento (tolera tabelas xref partidas e atualizações incrementais),
+    object streams, árvore de páginas com recursos herdados e XObjects de formulário.
+
+    As imagens DCT/JPX vão diretas para o cv2.imdecode; as Flate (e ASCIIHex/ASCII85) são
+    reconstruídas a partir das amostras (1 a 16 bits, cinzento, RGB, CMYK, indexadas, com
+    /Decode e /SMask). CCITT, JBIG2 e PDFs cifrados não são suportados: essas páginas só
+    podem ser lidas rasterizadas (ver LeitorQRFaturaAT._rasterizar_pagina_pdf).
+    """
+
+    # Profundidade máxima de XObjects de formulário dentro de outros
+    MAX_NIVEIS_FORMULARIO = 4
+
+    def __init__(self, dados: bytes):
+        self.dados = bytes(dados)
+        self._posicoes: Dict[int, int] = {}
+        for correspondencia in _PDF_INICIO_OBJETO.finditer(self.dados):
+            # Atualizações incrementais: a última definição de cada objeto é a válida
+            self._posicoes[int(correspondencia.group(1))] = correspondencia.end()
+        self._em_streams: Optional[Dict[int, Tuple[bytes, int]]] = None
+        self._cache: Dict[int, object] = {}
+        self.cifrado = re.search(rb'/Encrypt\s', self.dados) is not None
+
+    @staticmethod
+    def e_pdf(origem: OrigemImagem) -> bool:
+        """Se a origem é um PDF (o cabeçalho '%PDF-' pode vir depois de lixo até 1 KiB)"""
+        return b'%PDF-' in _cabecalho_imagem(origem, 1024)
+
+    @classmethod
+    def abrir(cls, origem: OrigemImagem) -> 'DocumentoPDF':
+        if _origem_em_memoria(origem):
+            return cls(origem)
+        with open(origem, 'rb') as f:
+            return cls(f.read())
+
+    # -- objetos ------------------------------------------------------------
+
+    def objeto(self, numero: int):
+        if numero in self._cache:
+            return self._cache[numero]
+        resultado = None
+        if numero in self._posicoes:
+            resultado = self._ler_objeto_em(self._posicoes[numero], numero)
+        else:
+            if self._em_streams is None:
+                self._indexar_object_streams()
+            if numero in self._em_streams:
+                dados, pos = self._em_streams[numero]
+                resultado = _pdf_analisar(dados, pos)[0]
+        self._cache[numero] = resultado
+        return resultado
+
+    def resolver(self, valor, niveis: int = 8):
+        while isinstance(valor, _RefPDF) and niveis:
+            valor = self.objeto(valor.numero)
+            niveis -= 1
+        return valor
+
+    def _ler_objeto_em(self, pos: int, numero: int):
+        valor, pos = _pdf_analisar(self.dados, pos)
+        if not isinstance(valor, dict):
+            return valor
+        pos = _pdf_saltar_espacos(self.dados, pos)
+        if not self.dados.startswith(b'stream', pos):
+            return valor
+        pos += 6
+        if self.dados.startswith(b'\r\n', pos):
+            pos += 2
+        elif self.dados[pos:pos + 1] in (b'\n', b'\r'):
+            pos += 1
+        comprimento = self.resolver(valor.get('Length'))
+        fim = pos + comprimento if isinstance(comprimento, int) and comprimento >= 0 else -1
+        if fim < 0 or b'endstream' not in self.dados[fim:fim + 32]:
+            # /Length ausente ou errado: procurar o fim do stream
+            fim = self.dados.find(b'endstream', pos)
+            if fim < 0:
+                fim = len(self.dados)
+            while fim > pos and self.dados[fim - 1] in b'\r\n':
+                fim -= 1
+        return _StreamPDF(valor, self.dados[pos:fim], numero)
+
+    def _indexar_object_streams(self):
+        self._em_streams = {}
+        for numero in list(self._posicoes):
+            try:
+                stream = self.objeto(numero)
+            except (ValueError, IndexError):
+                continue
+            if not isinstance(stream, _StreamPDF) or stream.dicionario.get('Type') != 'ObjStm':
+                continue
+            try:
+                dados = self.descomprimir(stream)
+                primeiro = self.resolver(stream.dicionario.get('First', 0))
+                cabecalho = dados[:primeiro].split()
+                for i in range(0, len(cabecalho) - 1, 2):
+                    self._em_streams.setdefault(int(cabecalho[i]), (dados, primeiro + int(cabecalho[i + 1])))
+            except (ValueError, zlib.error, TypeError):
+                continue
+
+    def descomprimir(self, stream: _StreamPDF, ate_imagem: bool = False) -> bytes:
+        """
+        Aplica os filtros do stream. Com ate_imagem=True pára antes de um filtro de imagem
+        (DCTDecode, JPXDecode), cujos bytes são o próprio ficheiro JPEG / JPEG 2000.
+        """
+        filtros = self.resolver(stream.dicionario.get('Filter')) or []
+        parametros = self.resolver(stream.dicionario.get('DecodeParms')) or []
+        if not isinstance(filtros, list):
+            filtros = [filtros]
+        if not isinstance(parametros, list):
+            parametros = [parametros]
+        dados = stream.dados
+        for i, filtro in enumerate(filtros):
+            parametros_filtro = self.resolver(parametros[i]) if i < len(parametros) else None
+            if filtro in ('FlateDecode', 'Fl'):
+                descompressor = zlib.decompressobj()
+                dados = descompressor.decompress(dados)   # tolera streams truncados
+                if isinstance(parametros_filtro, dict):
+                    dados = _pdf_despredizer(dados, {k: self.resolver(v) for k, v in parametros_filtro.items()},
+                                             self.resolver(stream.dicionario.get('Width', 1)))
+            elif filtro in ('ASCIIHexDecode', 'AHx'):
+                hexa = re.sub(rb'\s', b'', dados.split(b'>')[0])
+                dados = bytes.fromhex((hexa + b'0' * (len(hexa) % 2)).decode('ascii'))
+            elif filtro in ('ASCII85Decode', 'A85'):
+                dados = base64.a85decode(re.sub(rb'\s', b'', dados).split(b'~>')[0])
+            elif filtro in ('DCTDecode', 'DCT', 'JPXDecode') and ate_imagem:
+                return dados
+            else:
+                raise ValueError(f"filtro PDF não suportado: {filtro}")
+        return dados
+
+    # -- páginas ------------------------------------------------------------
+
+    def paginas(self) -> Iterator[Tuple[int, List[_StreamPDF]]]:
+        """Gera (número da página, XObjects de imagem da página) pela ordem do documento"""
+        raiz = None
+        for correspondencia in re.finditer(rb'/Root\s+(\d+)\s+\d+\s+R', self.dados):
+            raiz = int(correspondencia.group(1))   # a última (atualizações incrementais) é a válida
+        catalogo = self.objeto(raiz) if raiz is not None else None
+        if not isinstance(catalogo, dict):
+            return
+        numero = 0
+        pendentes = [(self.resolver(catalogo.get('Pages')), None)]
+        visitados = set()
+        while pendentes:
+            no, recursos_herdados = pendentes.pop(0)
+            if not isinstance(no, dict) or id(no) in visitados:
+                continue
+            visitados.add(id(no))
+            recursos = self.resolver(no.get('Resources', recursos_herdados))
+            filhos = self.resolver(no.get('Kids'))
+            if isinstance(filhos, list):
+                pendentes[:0] = [(self.resolver(filho), recursos) for filho in filhos]
+                continue
+            numero += 1
+            yield numero, self._imagens_dos_recursos(recursos, 0)
+
+    def _imagens_dos_recursos(self, recursos, nivel: int) -> List[_StreamPDF]:
+        recursos = self.resolver(recursos)
+        xobjects = self.resolver(recursos.get('XObject')) if isinstance(recursos, dict) else None
+        imagens = []
+        for valor in (xobjects or {}).values() if isinstance(xobjects, dict) else ():
+            xobject = self.resolver(valor)
+            if not isinstance(xobject, _StreamPDF):
+                continue
+            tipo = xobject.dicionario.get('Subtype')
+            if tipo == 'Image':
+                imagens.append(xobject)
+            elif tipo == 'Form' and nivel < self.MAX_NIVEIS_FORMULARIO:
+                imagens += self._imagens_dos_recursos(xobject.dicionario.get('Resources'), nivel + 1)
+        return imagens
+
+    # -- imagens ------------------------------------------------------------
+
+    def _componentes(self, espaco_cor) -> Tuple[int, Optional[np.ndarray], bool]:
+        """(componentes por amostra, paleta BGR/cinzento das imagens indexadas, tinta a inverter)"""
+        espaco_cor = self.resolver(espaco_cor)
+        if isinstance(espaco_cor, str):
+            return _PDF_COMPONENTES.get(espaco_cor, 0), None, False
+        if not isinstance(espaco_cor, list) or not espaco_cor:
+            return 0, None, False
+        familia = espaco_cor[0]
+        if familia == 'ICCBased':
+            perfil = self.resolver(espaco_cor[1])
+            return (self.resolver(perfil.dicionario.get('N', 3)) if isinstance(perfil, _StreamPDF) else 3), None, False
+        if familia in ('CalGray', 'CalRGB', 'Lab'):
+            return _PDF_COMPONENTES[familia], None, False
+        if familia == 'Separation':
+            return 1, None, True   # tinta 1 = cor cheia = escuro
+        if familia in ('Indexed', 'I') and len(espaco_cor) >= 4:
+            base, _, _ = self._componentes(espaco_cor[1])
+            tabela = self.resolver(espaco_cor[3])
+            if isinstance(tabela, _StreamPDF):
+                tabela = self.descomprimir(tabela)
+            if not base or not isinstance(tabela, bytes):
+                return 0, None, False
+            paleta = np.frombuffer(tabela, dtype=np.uint8)[:len(tabela) // base * base].reshape(-1, base)
+            return 1, self._para_bgr(paleta.reshape(1, -1, base)).reshape(len(paleta), -1), False
+        return 0, None, False
+
+    @staticmethod
+    def _para_bgr(amostras: np.ndarray) -> np.ndarray:
+        """Amostras (altura, largura, componentes) em cinzento (1) ou BGR (3 / CMYK)"""
+        componentes = amostras.shape[2]
+        if componentes == 1:
+            return amostras[:, :, 0]
+        if componentes == 4:
+            k = 255 - amostras[:, :, 3:4].astype(np.uint16)
+            rgb = ((255 - amostras[:, :, :3].astype(np.uint16)) * k // 255).astype(np.uint8)
+            return rgb[:, :, ::-1].copy()
+        return np.ascontiguousarray(amostras[:, :, 2::-1])
+
+    def imagem(self, stream: _StreamPDF) -> Optional[np.ndarray]:
+        """Descodifica um XObject de imagem (cinzento ou BGR), ou None se não for suportado"""
+        d = {chave: self.resolver(valor) for chave, valor in stream.dicionario.items()}
+        try:
+            dados = self.descomprimir(stream, ate_imagem=True)
+        except (ValueError, zlib.error, binascii.Error) as e:
+            _log(f"PDF: imagem {stream.numero} ignorada ({e})")
+            return None
+        filtros = d.get('Filter') if isinstance(d.get('Filter'), list) else [d.get('Filter')]
+        if filtros and filtros[-1] in ('DCTDecode', 'DCT', 'JPXDecode'):
+            imagem = _ler_imagem(dados)
+        else:
+            imagem = self._imagem_de_amostras(d, dados)
+        if imagem is None:
+            return None
+        mascara = d.get('SMask')
+        if isinstance(mascara, _StreamPDF):
+            alfa = self.imagem(mascara)
+            if alfa is not None and alfa.ndim == 2:
+                # Transparência sobre papel branco (QR em PNG com fundo transparente)
+                alfa = cv2.resize(alfa, (imagem.shape[1], imagem.shape[0]), interpolation=cv2.INTER_NEAREST)
+                alfa = alfa.astype(np.float32)[..., None] / 255 if imagem.ndim == 3 else alfa.astype(np.float32) / 255
+                imagem = (imagem * alfa + 255 * (1 - alfa)).astype(np.uint8)
+        return imagem
+
+    def _imagem_de_amostras(self, d: Dict, dados: bytes) -> Optional[np.ndarray]:
+        largura, altura = d.get('Width'), d.get('Height')
+        if not isinstance(largura, int) or not isinstance(altura, int) or largura <= 0 or altura <= 0:
+            return None
+        if d.get('ImageMask') or d.get('IM'):
+            # Máscara de 1 bit: 0 pinta (preto) por omissão
+            componentes, paleta, inverter, bits = 1, None, False, 1
+        else:
+            componentes, paleta, inverter = self._componentes(d.get('ColorSpace', d.get('CS')))
+            bits = d.get('BitsPerComponent', d.get('BPC', 8))
+        if not componentes or bits not in (1, 2, 4, 8, 16):
+            return None
+        bytes_linha = (largura * componentes * bits + 7) // 8
+        if len(dados) < bytes_linha * altura:
+            altura = len(dados) // bytes_linha
+            if altura == 0:
+                return None
+        linhas = np.frombuffer(dados, dtype=np.uint8)[:bytes_linha * altura].reshape(altura, bytes_linha)
+        if bits == 16:
+            amostras = linhas[:, 0::2]
+        elif bits == 8:
+            amostras = linhas
+        else:
+            deslocamentos = np.arange(8 - bits, -1, -bits, dtype=np.uint8)
+            amostras = ((linhas[:, :, None] >> deslocamentos) & ((1 << bits) - 1)).reshape(altura, -1)
+        amostras = amostras[:, :largura * componentes].reshape(altura, largura, componentes)
+        if paleta is not None:
+            indices = np.minimum(amostras[:, :, 0], len(paleta) - 1)
+            return paleta[indices] if paleta.shape[1] == 3 else paleta[indices][:, :, 0]
+        if bits < 8:
+            amostras = (amostras * (255 // ((1 << bits) - 1))).astype(np.uint8)
+        decode = d.get('Decode', d.get('D'))
+        if isinstance(decode, list) and len(decode) >= 2 and decode[0] > decode[1]:
+            inverter = not inverter
+        if inverter:
+            amostras = 255 - amostras
+        return self._para_bgr(np.ascontiguousarray(amostras))
 
 
 class LeitorQRFaturaAT:
     """Classe para ler e descodificar QR codes de faturas portuguesas"""
-    
-    def __init__(self):
+
+    # Localização do QR: só em imagens com o lado maior acima do limiar, numa cópia reduzida
+    LIMIAR_LOCALIZACAO = 1400
+    LADO_LOCALIZACAO = 1000
+    # Margem à volta do QR detetado, em fração do seu tamanho
+    MARGEM_ROI = 0.25
+    # Pirâmide: lado maior do primeiro nível (fotos maiores são tentadas primeiro reduzidas)
+    LADO_TRABALHO = 1600
+    # Orçamento de memória por leitura (MB) do modo --low-memory sem --max-memory-mb
+    MEMORIA_POUCA_MB = 64
+    # Modo mosaico (digitalizações A4, rasters de várias páginas): ladrilhos sobrepostos medidos
+    # em mm, com a escala (px/mm) estimada pelo lado menor da imagem = largura de uma página A4.
+    # A sobreposição cobre um QR até QR_MAX_MM (cada QR fica inteiro em pelo menos um ladrilho) e
+    # os ladrilhos são reduzidos até os módulos de um QR de QR_MIN_MM terem PASSO_MODULO_PX
+    LARGURA_PAGINA_MM = 210
+    QR_MIN_MM = 10
+    QR_MAX_MM = 40
+    MODULOS_QR_AT = 57   # versão 10, a habitual dos payloads AT
+    PASSO_MODULO_PX = 3
+    # Tentativas da primeira passagem por todos os ladrilhos (as restantes só depois)
+    TENTATIVAS_RAPIDAS_MOSAICO = 3
+    # PDF: lado mínimo (px) a que as imagens embutidas pequenas são ampliadas (QR gerados com
+    # 1 px por módulo) e resolução da rasterização de recurso com o Ghostscript
+    LADO_MIN_IMAGEM_PDF = 400
+    DPI_RASTER_PDF = 200
+
+    # Políticas entre backends: o par variante/backend mais promissor primeiro; todos os backends
+    # em corrida sobre cada variante; ou só aceitar um texto lido por dois backends diferentes
+    POLITICAS = ('fastest-first', 'race', 'consensus')
+
+    # Pools de threads partilhados pelo processo para o modo paralelo, um por max_threads (criados a pedido)
+    _pools_paralelos: Dict[int, ThreadPoolExecutor] = {}
+    _lock_pool = threading.Lock()
+
+    def __init__(self, estatisticas: Optional['EstatisticasTentativas'] = None, piramide: bool = True,
+                 paralelo: bool = False, max_threads: Optional[int] = None,
+                 cache: Optional['CacheDescodificacao'] = None, usar_cache: bool = True,
+                 max_ms: Optional[float] = None, backends: Optional[Iterable[str]] = None,
+                 politica: str = 'fastest-first', max_memoria_mb: Optional[float] = None,
+                 mosaico: bool = False, indice: Optional['IndiceFaturas'] = None, usar_indice: bool = False,
+                 perfil_ms: Optional[float] = None, perfil_modo: str = 'cprofile'):
         self.taxas_iva_pt = {
             'NOR': 23,  # Taxa normal
             'INT': 13,  # Taxa intermédia
@@ -31,168 +2170,1204 @@ class LeitorQRFaturaAT:
             'OUT': 0    # Outros
         }
 
-    def _preprocess_image(self, img: np.ndarray) -> List[np.ndarray]:
+        # Estatísticas partilhadas que decidem a ordem das tentativas (ver EstatisticasTentativas)
+        self.estatisticas = estatisticas or EstatisticasTentativas.partilhadas()
+
+        # Pirâmide multi-resolução para fotos grandes (tempos por nível em MetricasLeitura 'niveis')
+        self.piramide = piramide
+        # Tempos por etapa da última leitura (processar_fatura / ler_qr_de_imagem)
+        self.ultimas_metricas: Optional[MetricasLeitura] = None
+
+        # Modo paralelo: tentativas distribuídas por um pool limitado, ganha a primeira leitura válida
+        self.paralelo = paralelo
+        self.max_threads = max_threads or min(4, os.cpu_count() or 1)
+
+        # Cache de resultados por conteúdo da imagem (memória + disco)
+        self.cache = (cache or CacheDescodificacao.partilhada()) if usar_cache else None
+
+        # Prazo por imagem (ms); sem prazo a procura só acaba quando esgota as tentativas
+        self.max_ms = _validar_ms(max_ms)
+
+        # Backends de descodificação a usar (por omissão todos os registados) e a política entre eles
+        self.backends = list(backends) if backends is not None else None
+        for nome in self.backends or ():
+            if nome not in BACKENDS_QR:
+                print(f"Aviso: backend de QR desconhecido ignorado: {nome} "
+                      f"(disponíveis: {', '.join(BACKENDS_QR)})", file=sys.stderr)
+        if politica not in self.POLITICAS:
+            raise ValueError(f"política de descodificação inválida: {politica} "
+                             f"(válidas: {', '.join(self.POLITICAS)})")
+        self.politica = politica
+
+        # Modo de pouca memória: orçamento (MB) de imagens e variantes vivas em cada leitura
+        self.max_memoria_mb = max_memoria_mb
+
+        # Modo mosaico: imagens maiores que um ladrilho são procuradas por ladrilhos, em paralelo
+        self.mosaico = mosaico
+
+        # Índice de faturas já lidas: as repetidas trazem 'duplicado' com a primeira leitura
+        # (is None e não `or`: um índice ainda vazio tem len() 0)
+        if indice is None and usar_indice:
+            indice = IndiceFaturas.partilhado()
+        self.indice = indice
+
+        # Perfil das leituras mais lentas que perfil_ms (ver PerfilLeitura); o último gravado fica
+        # em self.ultimo_perfil
+        if perfil_modo not in PerfilLeitura.MODOS:
+            raise ValueError(f"modo de perfil inválido: {perfil_modo} (válidos: {', '.join(PerfilLeitura.MODOS)})")
+        self.perfil_ms = perfil_ms
+        self.perfil_modo = perfil_modo
+        self.ultimo_perfil: Optional[Dict] = None
+
+        # QRCodeDetector e CLAHE não são thread-safe: cada thread usa as suas instâncias
+        self._local = threading.local()
+
+    # Objetos OpenCV reutilizados entre leituras (modo servidor mantém a instância viva), criados
+    # só na primeira leitura de imagem: descodificar texto QR não importa o OpenCV
+
+    @property
+    def qr_localizador(self):
+        # Detetor baseado em finder patterns (Aruco), mais robusto só para localizar o QR
+        return self._objeto_da_thread('qr_localizador') if hasattr(cv2, 'QRCodeDetectorAruco') else None
+
+    @cached_property
+    def kernel_sharpening(self) -> np.ndarray:
+        return np.array([[-1,-1,-1],
+                         [-1, 9,-1],
+                         [-1,-1,-1]])
+
+    @cached_property
+    def kernel_morph(self) -> np.ndarray:
+        return cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+
+    def _objeto_da_thread(self, nome: str):
+        """
+        Devolve o QRCodeDetector ('qr_detector'), detetor Aruco ('qr_localizador'), CLAHE ('clahe')
+        ou detetor WeChat ('wechat') da thread atual
+        """
+        objeto = getattr(self._local, nome, None)
+        if objeto is None:
+            if nome == 'qr_detector':
+                objeto = cv2.QRCodeDetector()
+            elif nome == 'qr_localizador':
+                objeto = cv2.QRCodeDetectorAruco()
+            elif nome == 'wechat':
+                objeto = BackendWeChat.criar()
+            else:
+                objeto = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            setattr(self._local, nome, objeto)
+        return objeto
+
+    @classmethod
+    def _obter_pool(cls, max_threads: int) -> ThreadPoolExecutor:
         """
-        Aplica várias técnicas de pré-processamento na imagem para melhorar a deteção de QR Codes.
-        Retorna uma lista de imagens pré-processadas (grayscale, thresholded, CLAHE).
+        Pool partilhado pelos leitores do processo com o mesmo max_threads, para que o total de
+        threads de descodificação fique limitado mesmo com vários workers no modo servidor (que
+        usam todos as mesmas opções). Um leitor com outro limite tem o seu próprio pool, com esse
+        tamanho, em vez de herdar em silêncio o do primeiro leitor.
         """
-        processed_images = []
+        with cls._lock_pool:
+            pool = cls._pools_paralelos.get(max_threads)
+            if pool is None:
+                pool = cls._pools_paralelos[max_threads] = ThreadPoolExecutor(
+                    max_workers=max_threads, thread_name_prefix=f'qr-tentativa-{max_threads}')
+            return pool
 
-        if img is None:
-            return processed_images
+    def _submeter(self, pool: ThreadPoolExecutor, funcao: Callable, *args):
+        """
+        pool.submit que, com uma leitura a ser perfilada nesta thread, associa a thread do pool
+        a esse perfil enquanto a tarefa corre (ver PerfilLeitura.na_thread): o pool é partilhado
+        com as outras leituras do processo, que não entram no perfil.
+        """
+        perfil = getattr(self._local, 'perfil', None)
+        if perfil is None:
+            return pool.submit(funcao, *args)
 
-        # 1. Grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        processed_images.append(gray)
+        def tarefa():
+            anterior = getattr(self._local, 'perfil', None)
+            self._local.perfil = perfil
+            try:
+                with perfil.na_thread():
+                    return funcao(*args)
+            finally:
+                self._local.perfil = anterior
+        return pool.submit(tarefa)
 
-        # 2. Aumentar resolução se muito pequena
-        height, width = gray.shape
-        if max(height, width) < 1000:
-            scale = 1000 / max(height, width)
-            gray_upscaled = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
-            processed_images.append(gray_upscaled)
-
-        # 3. Otsu's thresholding (binarização automática)
-        _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        processed_images.append(otsu)
-
-        # 4. Adaptive Thresholding - Gaussian
-        thresh_gauss = cv2.adaptiveThreshold(gray, 255,
-                                      cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                      cv2.THRESH_BINARY, 11, 2)
-        processed_images.append(thresh_gauss)
-
-        # 5. Adaptive Thresholding - Mean (alternativa)
-        thresh_mean = cv2.adaptiveThreshold(gray, 255,
-                                      cv2.ADAPTIVE_THRESH_MEAN_C,
-                                      cv2.THRESH_BINARY, 11, 2)
-        processed_images.append(thresh_mean)
-
-        # 6. CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        enhanced_gray = clahe.apply(gray)
-        processed_images.append(enhanced_gray)
-
-        # 7. Histogram Equalization (equalização simples)
-        equalized = cv2.equalizeHist(gray)
-        processed_images.append(equalized)
-
-        # 8. Sharpening para melhorar nitidez
-        kernel_sharpening = np.array([[-1,-1,-1],
-                                       [-1, 9,-1],
-                                       [-1,-1,-1]])
-        sharpened = cv2.filter2D(gray, -1, kernel_sharpening)
-        processed_images.append(sharpened)
-
-        # 9. Denoise + sharpen
-        denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-        processed_images.append(denoised)
-
-        # 10. Morphological operations para limpar ruído
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
-        morph = cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
-        processed_images.append(morph)
-
-        return processed_images
-
-    def ler_qr_de_imagem(self, caminho_imagem: str, debug_mode: bool = False) -> Optional[str]:
+    def _assinatura_configuracao(self) -> str:
+        """Parte da chave de cache que depende da versão e das opções do leitor"""
+        backends = ','.join(backend.nome for backend in self.backends_ativos())
+        assinatura = f"v{VERSAO_LEITOR}|piramide={int(self.piramide)}|backends={backends}|politica={self.politica}"
+        if self.max_memoria_mb is not None:
+            # Com pouca memória as imagens grandes são lidas reduzidas: resultados diferentes
+            assinatura += f"|memoria={self.max_memoria_mb:g}"
+        if self.mosaico:
+            assinatura += "|mosaico"
+        return assinatura
+
+    def _novas_metricas(self, max_ms: Optional[float] = None) -> 'MetricasLeitura':
+        """Métricas de uma leitura, com o prazo (max_ms ou self.max_ms) e o orçamento de memória"""
+        max_ms = _validar_ms(max_ms) if max_ms is not None else self.max_ms
+        if max_ms is not None:
+            # O prazo conta só a leitura, não o import da pilha de visão
+            _carregar_visao()
+        return MetricasLeitura(max_ms, self.max_memoria_mb)
+
+    @contextmanager
+    def _perfilar(self, origem: OrigemImagem, perfil_ms: Optional[float] = None):
+        """Perfila a leitura e grava-a se demorar pelo menos perfil_ms (por omissão self.perfil_ms)"""
+        self.ultimo_perfil = None
+        limite = perfil_ms if perfil_ms is not None else self.perfil_ms
+        if limite is None:
+            yield
+            return
+        perfil = PerfilLeitura(self.perfil_modo)
+        inicio = time.perf_counter()
+        perfil.iniciar()
+        self._local.perfil = perfil
+        try:
+            yield
+        finally:
+            self._local.perfil = None
+            perfil.terminar()
+            total_ms = (time.perf_counter() - inicio) * 1000
+            if total_ms >= limite:
+                try:
+                    self.ultimo_perfil = perfil.guardar(origem, total_ms)
+                    _log(f"Perfil da leitura ({total_ms:.0f} ms) gravado em {self.ultimo_perfil.get('perfil')}")
+                except OSError as e:
+                    print(f"Aviso: não foi possível gravar o perfil da leitura: {e}", file=sys.stderr)
+
+    def _variantes(self, imagem: np.ndarray, metricas: Optional['MetricasLeitura']) -> 'VariantesImagem':
+        return VariantesImagem(self, imagem, metricas, economica=self.max_memoria_mb is not None)
+
+    def backends_ativos(self) -> List[BackendQR]:
+        """Backends selecionados (todos os registados, por omissão) cujas dependências estão instaladas"""
+        nomes = self.backends if self.backends is not None else list(BACKENDS_QR)
+        return [BACKENDS_QR[nome] for nome in nomes if nome in BACKENDS_QR and BACKENDS_QR[nome].disponivel()]
+
+    def _tentativas_disponiveis(self) -> List[Tuple[str, str]]:
+        """Todas as combinações (variante, backend) compatíveis, pela ordem original de prioridade"""
+        tentativas = []
+        for backend in self.backends_ativos():
+            nomes = VariantesImagem.ORDEM + VariantesImagem.GEOMETRIA if backend.corrige_perspetiva \
+                else VariantesImagem.GEOMETRIA + VariantesImagem.ORDEM
+            tentativas += [(nome, backend.nome) for nome in nomes
+                           if VariantesImagem.TIPOS[nome] in backend.entradas]
+        return tentativas
+
+    def _descodificar_com(self, backend: str, imagem: np.ndarray) -> Optional[str]:
+        """Tenta descodificar um QR na imagem com o backend indicado (ver BACKENDS_QR)"""
+        return BACKENDS_QR[backend].descodificar(self, imagem)
+
+    def _localizar_qr(self, imagem: np.ndarray, sempre: bool = False) -> List[Tuple[int, int, int, int]]:
+        """
+        Localização rápida do QR numa versão reduzida da imagem.
+
+        Só é usada em imagens maiores que LIMIAR_LOCALIZACAO (ou em qualquer imagem com
+        sempre=True, no modo multi-QR); devolve caixas (x0, y0, x1, y1) em coordenadas da
+        imagem original, com margem, ou lista vazia se nada for encontrado.
+        """
+        height, width = imagem.shape[:2]
+        lado_maior = max(height, width)
+        if lado_maior <= self.LIMIAR_LOCALIZACAO and not sempre:
+            return []
+
+        escala = min(1.0, self.LADO_LOCALIZACAO / lado_maior)
+        gray = imagem if imagem.ndim == 2 else cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
+        reduzida = cv2.resize(gray, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+
+        # Asserções internas do OpenCV (ex.: convexHull) contam como "nada localizado": a procura
+        # continua na imagem completa
+        quadrilateros = []
+        for detetor in (self.qr_localizador, self._objeto_da_thread('qr_detector')):
+            if detetor is None:
+                continue
+            try:
+                encontrados, pontos = detetor.detectMulti(reduzida)
+            except cv2.error:
+                continue
+            if encontrados and pontos is not None:
+                quadrilateros = list(pontos)
+                break
+        if not quadrilateros:
+            try:
+                encontrado, pontos = self._objeto_da_thread('qr_detector').detect(reduzida)
+            except cv2.error:
+                encontrado, pontos = False, None
+            if encontrado and pontos is not None:
+                quadrilateros = [pontos.reshape(-1, 2)]
+
+        caixas = [self._caixa_do_quad(quad, escala, width, height) for quad in quadrilateros]
+        return [caixa for caixa in caixas if caixa is not None]
+
+    def _cantos_qr(self, gray: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Cantos do QR (4x2 float32) pela ordem dos finder patterns, mesmo quando não descodifica.
+        Numa imagem espelhada essa ordem fica no sentido contrário ao dos ponteiros do relógio;
+        troca-se então o 2.º com o 4.º canto, para que a retificação também desfaça o espelho.
+        Um erro interno do OpenCV num detetor conta como "sem cantos" nesse detetor.
+        """
+        for detetor in (self.qr_localizador, self._objeto_da_thread('qr_detector')):
+            if detetor is None:
+                continue
+            try:
+                encontrado, pontos = detetor.detect(gray)
+            except cv2.error:
+                continue
+            if not encontrado or pontos is None:
+                continue
+            cantos = np.asarray(pontos, dtype=np.float32).reshape(-1, 2)
+            if len(cantos) != 4 or cv2.contourArea(cantos) < 64:
+                continue
+            (x0, y0), (x1, y1), (x2, y2) = cantos[:3]
+            if (x1 - x0) * (y2 - y1) - (y1 - y0) * (x2 - x1) < 0:
+                cantos = cantos[[0, 3, 2, 1]]
+            return cantos
+        return None
+
+    def _caixa_do_quad(self, quad, escala: float, width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+        """Caixa (x0, y0, x1, y1) com margem MARGEM_ROI à volta de um quadrilátero detetado a `escala`"""
+        quad = np.asarray(quad, dtype=np.float32).reshape(-1, 2) / escala
+        qx0, qy0 = quad.min(axis=0)
+        qx1, qy1 = quad.max(axis=0)
+        margem = max(qx1 - qx0, qy1 - qy0) * self.MARGEM_ROI + 16
+        x0, y0 = max(0, int(qx0 - margem)), max(0, int(qy0 - margem))
+        x1, y1 = min(width, int(qx1 + margem)), min(height, int(qy1 + margem))
+        if x1 - x0 >= 16 and y1 - y0 >= 16:
+            return x0, y0, x1, y1
+        return None
+
+    def _registar_tentativa(self, metricas: Optional['MetricasLeitura'], nome: str, backend: str,
+                            prefixo: str, dados_qr: Optional[str], duracao_ms: float, inicio_descodificacao: float,
+                            aprender: bool = True):
+        """
+        Regista uma tentativa nas estatísticas de ordenação e nas métricas da leitura. Com
+        aprender=False (ou metricas.aprender falso) só nas métricas: as tentativas em recortes ou
+        frames que quase nunca têm o QR (ladrilhos de papel em branco, câmara à procura) contariam
+        como falhas dos melhores pares e deixariam os nunca tentados, com a probabilidade inicial
+        de 0,5, à frente deles nas leituras normais.
+        """
+        if aprender and (metricas is None or metricas.aprender):
+            self.estatisticas.registar(nome, backend, bool(dados_qr), duracao_ms)
+        if metricas is not None:
+            metricas.registar('descodificar', (time.perf_counter() - inicio_descodificacao) * 1000,
+                              variante=nome, backend=backend, nivel=prefixo.rstrip('_') or 'original',
+                              sucesso=bool(dados_qr))
+
+    @staticmethod
+    def _marcar_vencedora(metricas: Optional['MetricasLeitura'], nome: str, backend: str, prefixo: str):
+        if metricas is not None:
+            metricas.sucesso = {'variante': nome, 'backend': backend, 'nivel': prefixo.rstrip('_') or 'original'}
+
+    def _tentar_variantes(self, variantes: 'VariantesImagem', tentativas: List[Tuple[str, str]],
+                          caminho_imagem: str, debug_mode: bool = False, prefixo: str = '') -> Optional[str]:
+        """Corre as tentativas (variante, backend) sobre uma imagem ou recorte até à primeira leitura"""
+        if self.politica == 'consensus' or (self.politica == 'race' and not self.paralelo):
+            return self._tentar_por_variante(variantes, tentativas, prefixo)
+        if self.paralelo:
+            return self._tentar_variantes_paralelo(variantes, tentativas, prefixo)
+
+        _log(f"A tentar {len(tentativas)} combinações variante/decoder...")
+        metricas = variantes.metricas
+        variantes.contar_usos(tentativas)
+        for i, (nome, backend) in enumerate(tentativas):
+            try:
+                if metricas is not None and metricas.prazo is not None:
+                    if metricas.esgotado():
+                        _log("Prazo da leitura esgotado")
+                        return None
+                    # Com pouco tempo, saltar as tentativas que não cabem no que resta (as seguintes podem caber)
+                    if self.estatisticas.custo_estimado_ms(nome, backend) > metricas.restante_ms():
+                        continue
+                inicio = time.perf_counter()
+                p_img = variantes.obter(nome)
+                if p_img is None:
+                    continue
+                _log(f"  Tentativa {i}: {prefixo}{nome} com {backend}...")
+
+                # Save debug image if in debug mode
+                if debug_mode and backend == 'opencv':
+                    debug_path = caminho_imagem.replace('.png', f'_debug_{prefixo}{nome}.png')
+                    cv2.imwrite(debug_path, p_img)
+                    _log(f"  Debug: Salva em {debug_path}")
+
+                inicio_descodificacao = time.perf_counter()
+                dados_qr = self._descodificar_com(backend, p_img)
+                duracao_ms = (time.perf_counter() - inicio) * 1000
+                self._registar_tentativa(variantes.metricas, nome, backend, prefixo, dados_qr, duracao_ms,
+                                         inicio_descodificacao)
+
+                if dados_qr:
+                    self._marcar_vencedora(variantes.metricas, nome, backend, prefixo)
+                    _log(f"✓ QR encontrado com {backend} em {prefixo}{nome} ({duracao_ms:.0f} ms)!")
+                    _log(f"Dados do QR (primeiros 100 chars): {dados_qr[:100]}...")
+                    return dados_qr
+            finally:
+                variantes.libertar(nome)
+        return None
+
+    def _tentar_variantes_paralelo(self, variantes: 'VariantesImagem', tentativas: List[Tuple[str, str]],
+                                   prefixo: str = '') -> Optional[str]:
+        """
+        Versão paralela de _tentar_variantes: todas as tentativas são submetidas ao pool (pela
+        ordem de prioridade) e a primeira leitura válida ganha. As tentativas que ainda não
+        começaram são canceladas e as que estão a correr terminam sem registar resultado.
+        """
+        _log(f"A tentar {len(tentativas)} combinações variante/decoder em paralelo "
+             f"(até {self.max_threads} threads)...")
+        encontrado = threading.Event()
+
+        metricas = variantes.metricas
+
+        def tentar(nome: str, backend: str) -> Optional[Tuple[str, str, str, float]]:
+            try:
+                if encontrado.is_set() or (metricas is not None and metricas.esgotado()):
+                    return None
+                inicio = time.perf_counter()
+                p_img = variantes.obter(nome)
+                if p_img is None or encontrado.is_set():
+                    return None
+                inicio_descodificacao = time.perf_counter()
+                dados_qr = self._descodificar_com(backend, p_img)
+                duracao_ms = (time.perf_counter() - inicio) * 1000
+                self._registar_tentativa(variantes.metricas, nome, backend, prefixo, dados_qr,
+                                         duracao_ms, inicio_descodificacao)
+                if not dados_qr:
+                    return None
+                encontrado.set()
+                return nome, backend, dados_qr, duracao_ms
+            finally:
+                variantes.libertar(nome)
+
+        variantes.contar_usos(tentativas)
+        pool = self._obter_pool(self.max_threads)
+        futuros = [self._submeter(pool, tentar, nome, backend) for nome, backend in tentativas]
+        limite_s = max(metricas.restante_ms() / 1000, 0) if metricas is not None and metricas.prazo else None
+        try:
+            for futuro in as_completed(futuros, timeout=limite_s):
+                resultado = futuro.result()
+                if resultado:
+                    nome, backend, dados_qr, duracao_ms = resultado
+                    self._marcar_vencedora(variantes.metricas, nome, backend, prefixo)
+                    _log(f"✓ QR encontrado com {backend} em {prefixo}{nome} ({duracao_ms:.0f} ms)!")
+                    _log(f"Dados do QR (primeiros 100 chars): {dados_qr[:100]}...")
+                    return dados_qr
+            return None
+        except FuturosTimeoutError:
+            # Prazo esgotado: as tentativas em curso terminam sozinhas, as pendentes são canceladas
+            metricas.prazo_atingido = True
+            _log("Prazo da leitura esgotado")
+            return None
+        finally:
+            encontrado.set()
+            for futuro in futuros:
+                futuro.cancel()
+
+    def _tentar_por_variante(self, variantes: 'VariantesImagem', tentativas: List[Tuple[str, str]],
+                             prefixo: str = '') -> Optional[str]:
+        """
+        Políticas 'race' e 'consensus': as tentativas são agrupadas por variante e todos os
+        backends compatíveis correm sobre a mesma variante (no pool, se forem vários). Em
+        'race' ganha o primeiro texto lido; em 'consensus' um texto só é aceite quando dois
+        backends diferentes o leem (um, se só houver um backend). Se as variantes acabarem sem
+        consenso, fica o texto lido por mais backends.
+        """
+        grupos: Dict[str, List[str]] = {}
+        for nome, backend in tentativas:
+            grupos.setdefault(nome, []).append(backend)
+        variantes.contar_usos(tentativas)
+        quorum = 1
+        if self.politica == 'consensus':
+            quorum = min(2, len({backend for _, backend in tentativas}))
+        _log(f"A tentar {len(grupos)} variantes com a política {self.politica} (quórum {quorum})...")
+
+        metricas = variantes.metricas
+        votos: Dict[str, set] = {}
+        primeira: Dict[str, Tuple[str, str]] = {}
+        for nome, backends in grupos.items():
+            if metricas is not None and metricas.esgotado():
+                _log("Prazo da leitura esgotado")
+                break
+            for texto, backend in self._correr_backends(variantes, nome, backends, prefixo, quorum == 1):
+                votos.setdefault(texto, set()).add(backend)
+                primeira.setdefault(texto, (nome, backend))
+                if len(votos[texto]) >= quorum:
+                    backends_texto = '+'.join(sorted(votos[texto]))
+                    self._marcar_vencedora(metricas, nome, backends_texto, prefixo)
+                    _log(f"✓ QR encontrado com {backends_texto} em {prefixo}{nome}!")
+                    _log(f"Dados do QR (primeiros 100 chars): {texto[:100]}...")
+                    return texto
+
+        if not votos:
+            return None
+        texto = max(votos, key=lambda t: len(votos[t]))
+        nome, backend = primeira[texto]
+        self._marcar_vencedora(metricas, nome, backend, prefixo)
+        _log(f"⚠ Sem consenso entre backends: fica a leitura de {backend} em {prefixo}{nome}")
+        return texto
+
+    def _correr_backends(self, variantes: 'VariantesImagem', nome: str, backends: List[str],
+                         prefixo: str, primeiro: bool) -> List[Tuple[str, str]]:
+        """
+        Corre vários backends sobre a variante `nome` e devolve os pares (texto, backend) lidos.
+        Com primeiro=True pára na primeira leitura (as tentativas pendentes são canceladas).
+        """
+        metricas = variantes.metricas
+
+        def tentar(backend: str) -> Optional[str]:
+            try:
+                inicio = time.perf_counter()
+                p_img = variantes.obter(nome)
+                if p_img is None:
+                    return None
+                inicio_descodificacao = time.perf_counter()
+                dados_qr = self._descodificar_com(backend, p_img)
+                self._registar_tentativa(metricas, nome, backend, prefixo, dados_qr,
+                                         (time.perf_counter() - inicio) * 1000, inicio_descodificacao)
+                return dados_qr
+            finally:
+                variantes.libertar(nome)
+
+        if len(backends) == 1:
+            dados_qr = tentar(backends[0])
+            return [(dados_qr, backends[0])] if dados_qr else []
+
+        pool = self._obter_pool(self.max_threads)
+        futuros = {self._submeter(pool, tentar, backend): backend for backend in backends}
+        limite_s = max(metricas.restante_ms() / 1000, 0) if metricas is not None and metricas.prazo else None
+        lidos = []
+        try:
+            for futuro in as_completed(futuros, timeout=limite_s):
+                dados_qr = futuro.result()
+                if dados_qr:
+                    lidos.append((dados_qr, futuros[futuro]))
+                    if primeiro:
+                        break
+        except FuturosTimeoutError:
+            metricas.prazo_atingido = True
+        finally:
+            for futuro in futuros:
+                futuro.cancel()
+        return lidos
+
+    def _procurar_no_nivel(self, imagem: np.ndarray, tentativas: List[Tuple[str, str]],
+                           caminho_imagem: str, debug_mode: bool = False, prefixo: str = '',
+                           metricas: Optional['MetricasLeitura'] = None) -> Optional[str]:
+        """Procura o QR numa imagem (um nível da pirâmide): primeiro nos recortes candidatos, depois completa"""
+        inicio = time.perf_counter()
+        height, width = imagem.shape[:2]
+        dados_qr = None
+
+        # Em imagens grandes, localizar primeiro o QR e tentar só nos recortes candidatos
+        caixas = self._localizar_qr(imagem) if metricas is None or not metricas.esgotado() else []
+        if metricas is not None and max(height, width) > self.LIMIAR_LOCALIZACAO:
+            metricas.registar('localizar', (time.perf_counter() - inicio) * 1000,
+                              nivel=prefixo.rstrip('_') or 'original', candidatos=len(caixas))
+        for j, (x0, y0, x1, y1) in enumerate(caixas):
+            if metricas is not None and metricas.esgotado():
+                break
+            _log(f"Região candidata {j}: ({x0},{y0})-({x1},{y1})")
+            with self._variantes(imagem[y0:y1, x0:x1], metricas) as recorte:
+                dados_qr = self._tentar_variantes(recorte, tentativas, caminho_imagem,
+                                                  debug_mode, f"{prefixo}roi{j}_")
+            if dados_qr:
+                break
+
+        if not dados_qr and (metricas is None or not metricas.esgotado()):
+            # Imagem completa (sem candidatos, ou nenhum recorte descodificou)
+            _log(f"A tentar a imagem completa ({width}x{height})...")
+            with self._variantes(imagem, metricas) as variantes:
+                dados_qr = self._tentar_variantes(variantes, tentativas, caminho_imagem, debug_mode, prefixo)
+
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        if metricas is not None:
+            metricas.registar('nivel', duracao_ms, nivel=prefixo.rstrip('_') or 'original',
+                              largura=width, altura=height, sucesso=bool(dados_qr))
+        _log(f"Nível {width}x{height}: {duracao_ms:.0f} ms ({'sucesso' if dados_qr else 'sem QR'})")
+        return dados_qr
+
+    def _ladrilhos(self, width: int, height: int) -> Tuple[List[Tuple[int, int, int, int]], float]:
+        """
+        Caixas (x0, y0, x1, y1) dos ladrilhos sobrepostos que cobrem a imagem e a escala a que
+        cada ladrilho é procurado. Os ladrilhos de cada eixo são distribuídos uniformemente, por
+        isso a sobreposição nunca fica abaixo da de QR_MAX_MM.
+        """
+        px_mm = min(width, height) / self.LARGURA_PAGINA_MM
+        sobreposicao = max(int(self.QR_MAX_MM * px_mm), 128)
+        lado = 3 * sobreposicao
+        passo_modulo = self.QR_MIN_MM * px_mm / self.MODULOS_QR_AT
+        escala = min(1.0, self.PASSO_MODULO_PX / passo_modulo)
+
+        def inicios(total: int) -> List[int]:
+            if total <= lado:
+                return [0]
+            n = math.ceil((total - lado) / (lado - sobreposicao)) + 1
+            return [round(i * (total - lado) / (n - 1)) for i in range(n)]
+
+        caixas = [(x0, y0, min(width, x0 + lado), min(height, y0 + lado))
+                  for y0 in inicios(height) for x0 in inicios(width)]
+        return caixas, escala
+
+    def _ler_ladrilho(self, imagem: np.ndarray, caixa: Tuple[int, int, int, int], escala: float,
+                      tentativas: List[Tuple[str, str]], prefixo: str, metricas: 'MetricasLeitura',
+                      parar: threading.Event, multi: bool) -> Optional[Tuple[str, str, List[str]]]:
+        """
+        Corre as tentativas (variante, backend) sobre um ladrilho até à primeira leitura útil:
+        um payload AT válido ou, no modo multi, todos os códigos que o backend lê de uma vez.
+        Devolve (variante, backend, textos) ou None; pára quando outro ladrilho ganha (`parar`).
+        """
+        x0, y0, x1, y1 = caixa
+        ladrilho = imagem[y0:y1, x0:x1]
+        reservado = 0
+        if escala < 1.0:
+            ladrilho = cv2.resize(ladrilho, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+            reservado = ladrilho.nbytes
+            metricas.reservar_memoria(reservado, forcar=True)
+        try:
+            with self._variantes(ladrilho, metricas) as variantes:
+                variantes.contar_usos(tentativas)
+                for nome, backend in tentativas:
+                    try:
+                        if parar.is_set() or metricas.esgotado():
+                            return None
+                        inicio = time.perf_counter()
+                        p_img = variantes.obter(nome)
+                        if p_img is None:
+                            continue
+                        inicio_descodificacao = time.perf_counter()
+                        try:
+                            if multi:
+                                lidos = [texto for texto, _ in BACKENDS_QR[backend].descodificar_todos(self, p_img)
+                                         if texto]
+                            else:
+                                dados_qr = self._descodificar_com(backend, p_img)
+                                lidos = [dados_qr] if dados_qr and _payload_at_valido(dados_qr) else []
+                        except cv2.error:
+                            # Ladrilhos de papel em branco ou texto fazem falhar asserts internos do detetor
+                            lidos = []
+                        self._registar_tentativa(metricas, nome, backend, prefixo, lidos[0] if lidos else None,
+                                                 (time.perf_counter() - inicio) * 1000, inicio_descodificacao,
+                                                 aprender=False)
+                        if lidos:
+                            return nome, backend, lidos
+                    finally:
+                        variantes.libertar(nome)
+            return None
+        finally:
+            metricas.libertar_memoria(reservado)
+
+    def _procurar_em_mosaico(self, imagem: np.ndarray, tentativas: List[Tuple[str, str]],
+                             metricas: 'MetricasLeitura', multi: bool = False) -> Optional[List[str]]:
+        """
+        Procura por ladrilhos sobrepostos (ver _ladrilhos), distribuídos pelo pool, mais a imagem
+        inteira na resolução de trabalho (QR maiores que a sobreposição), com as suas variantes em
+        duas passagens: as TENTATIVAS_RAPIDAS_MOSAICO mais promissoras em todos os ladrilhos e
+        só então as restantes. Sem multi ganha o primeiro
+        payload AT válido e o resto é cancelado; com multi juntam-se os códigos de todos.
+
+        Returns:
+            Textos lidos (sem repetidos), ou None se a imagem cabe num só ladrilho
+        """
+        inicio = time.perf_counter()
+        height, width = imagem.shape[:2]
+        caixas, escala = self._ladrilhos(width, height)
+        if len(caixas) < 2:
+            return None
+        lado = caixas[0][2] - caixas[0][0]
+        _log(f"Mosaico: {len(caixas)} ladrilhos de {lado}px (escala {escala:.2f}) em até {self.max_threads} threads")
+
+        geral = ((0, 0, width, height), min(1.0, self.LADO_TRABALHO / max(width, height)), 'geral_')
+        ladrilhos = [geral] + [(caixa, escala, f"ladrilho{i}_") for i, caixa in enumerate(caixas)]
+        rapidas = tentativas[:self.TENTATIVAS_RAPIDAS_MOSAICO]
+        trabalhos = [(caixa, escala_trabalho, fase, prefixo)
+                     for fase in (rapidas, tentativas[len(rapidas):]) if fase
+                     for caixa, escala_trabalho, prefixo in ladrilhos]
+        parar = threading.Event()
+        pool = self._obter_pool(self.max_threads)
+        futuros = {self._submeter(pool, self._ler_ladrilho, imagem, caixa, escala_trabalho, fase, prefixo,
+                                  metricas, parar, multi): prefixo
+                   for caixa, escala_trabalho, fase, prefixo in trabalhos}
+        limite_s = max(metricas.restante_ms() / 1000, 0) if metricas.prazo else None
+        encontrados: Dict[str, None] = {}
+        try:
+            for futuro in as_completed(futuros, timeout=limite_s):
+                resultado = futuro.result()
+                if not resultado:
+                    continue
+                nome, backend, lidos = resultado
+                for texto in lidos:
+                    encontrados.setdefault(texto, None)
+                if not multi:
+                    self._marcar_vencedora(metricas, nome, backend, futuros[futuro])
+                    _log(f"✓ QR encontrado com {backend} em {futuros[futuro]}{nome}!")
+                    break
+        except FuturosTimeoutError:
+            metricas.prazo_atingido = True
+            _log("Prazo da leitura esgotado")
+        finally:
+            parar.set()
+            for futuro in futuros:
+                futuro.cancel()
+
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        metricas.registar('mosaico', duracao_ms, ladrilhos=len(caixas), codigos=len(encontrados))
+        metricas.registar('nivel', duracao_ms, nivel='mosaico', largura=width, altura=height,
+                          sucesso=bool(encontrados))
+        return list(encontrados)
+
+    def _carregar_reduzida(self, origem: OrigemImagem) -> Optional[np.ndarray]:
+        """
+        Lê uma foto JPEG grande já reduzida (IMREAD_REDUCED_GRAYSCALE_*), com o lado maior
+        perto de LADO_TRABALHO. O descodificador JPEG reduz durante a descompressão, por isso
+        é muito mais barato do que ler a imagem completa e redimensionar.
+        """
+        if _cabecalho_imagem(origem, 3) != b'\xff\xd8\xff':
+            return None
+
+        minima = _ler_imagem(origem, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if minima is None:
+            return None
+        lado_total = max(minima.shape[:2]) * 8
+        for fator, flag in ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+                            (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                            (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)):
+            if lado_total / fator >= self.LADO_TRABALHO:
+                _log(f"Leitura reduzida 1/{fator} (lado maior ~{lado_total // fator}px)")
+                return minima if fator == 8 else _ler_imagem(origem, flag)
+        return None
+
+    def _carregar_completa(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> Optional[np.ndarray]:
+        """
+        Lê a imagem completa. No modo de pouca memória é lida já em tons de cinzento (um terço
+        dos bytes; nenhum backend usa a cor) e, se não couber no orçamento com uma variante do
+        mesmo tamanho ao lado, reduzida: os JPEG pelo próprio descodificador
+        (IMREAD_REDUCED_GRAYSCALE_*), os outros formatos com um resize logo depois da leitura.
+        """
+        if self.max_memoria_mb is None or isinstance(origem, np.ndarray):
+            return _ler_imagem(origem)
+
+        limite = metricas.max_memoria // 2 if metricas.max_memoria else None
+        flag = cv2.IMREAD_GRAYSCALE
+        if limite and _cabecalho_imagem(origem, 3) == b'\xff\xd8\xff':
+            minima = _ler_imagem(origem, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if minima is not None:
+                area = minima.size * 64
+                for fator, flag in ((1, cv2.IMREAD_GRAYSCALE), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+                                    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (8, cv2.IMREAD_REDUCED_GRAYSCALE_8)):
+                    if area / fator ** 2 <= limite:
+                        break
+                if fator > 1:
+                    _log(f"Pouca memória: leitura reduzida 1/{fator} para caber em {self.max_memoria_mb:g} MB")
+        imagem = _ler_imagem(origem, flag)
+        if imagem is None:
+            return None
+        if limite and imagem.nbytes > limite:
+            escala = (limite / imagem.nbytes) ** 0.5
+            imagem = cv2.resize(imagem, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+            _log(f"Pouca memória: imagem reduzida para {imagem.shape[1]}x{imagem.shape[0]}")
+        metricas.reservar_memoria(imagem.nbytes, forcar=True)
+        return imagem
+
+    def _niveis_piramide(self, imagem: np.ndarray) -> Iterator[Tuple[float, np.ndarray]]:
+        """
+        Gera (escala, imagem) do nível mais grosseiro (lado maior = LADO_TRABALHO) até à
+        resolução original, duplicando a resolução em cada nível. Cada nível só é calculado
+        quando o anterior falhou.
+        """
+        lado = max(imagem.shape[:2])
+        alvo = self.LADO_TRABALHO
+        while self.piramide and alvo * 1.5 < lado:
+            escala = alvo / lado
+            yield escala, cv2.resize(imagem, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+            alvo *= 2
+        yield 1.0, imagem
+
+    def ler_qr_de_imagem(self, origem: OrigemImagem, debug_mode: bool = False,
+                         metricas: Optional['MetricasLeitura'] = None,
+                         max_ms: Optional[float] = None, perfil_ms: Optional[float] = None) -> Optional[str]:
         """
         Lê o código QR de uma imagem de fatura
 
         Args:
-            caminho_imagem: Caminho para o ficheiro de imagem
+            origem: Caminho para o ficheiro de imagem, bytes do ficheiro (ex.: lidos do stdin)
+                ou imagem já descodificada (np.ndarray)
             debug_mode: Se True, salva imagens pré-processadas para debug
+            metricas: Onde registar os tempos por etapa; se omitido, a leitura cria as suas
+                métricas (ficam em self.ultimas_metricas e no RegistoMetricas partilhado)
+            max_ms: Prazo da leitura em ms (por omissão self.max_ms). Quando se esgota a procura
+                pára entre tentativas e devolve None; ver resumo_nao_encontrado()
+            perfil_ms: Grava o perfil da leitura se demorar pelo menos isto (por omissão
+                self.perfil_ms); só quando a leitura é chamada diretamente
 
         Returns:
             String com os dados do QR ou None se não encontrar
         """
-        try:
-            print(f"Lendo imagem: {caminho_imagem}", file=sys.stderr)
-            # Ler a imagem
-            imagem = cv2.imread(caminho_imagem)
+        propria = metricas is None
+        if propria:
+            metricas = self._novas_metricas(max_ms)
+            self.ultimas_metricas = metricas
+        dados_qr = None
+        with self._perfilar(origem, perfil_ms) if propria else nullcontext():
+            try:
+                dados_qr = self._ler_qr(origem, debug_mode, metricas)
+                return dados_qr
+            except Exception as e:
+                print(f"Erro ao ler QR code: {e}", file=sys.stderr)
+                import traceback
+                traceback.print_exc(file=sys.stderr)
+                metricas.resultado = 'erro'
+                return None
+            finally:
+                if propria:
+                    metricas.concluir(metricas.resultado or self._resultado_leitura(dados_qr, metricas))
+                    RegistoMetricas.partilhado().acumular(metricas.para_dict())
+
+    @staticmethod
+    def _resultado_leitura(encontrado, metricas: 'MetricasLeitura') -> str:
+        if encontrado:
+            return 'sucesso'
+        return 'prazo_esgotado' if metricas.prazo_atingido else 'sem_qr'
+
+    def resumo_nao_encontrado(self) -> Optional[Dict]:
+        """
+        Resumo estruturado da última leitura sem QR: motivo ('prazo_esgotado', 'sem_qr', 'erro'),
+        tempo gasto, prazo e as tentativas feitas (variante, backend, nível, ms)
+        """
+        metricas = self.ultimas_metricas
+        if metricas is None or metricas.resultado in (None, 'sucesso'):
+            return None
+        return {'motivo': metricas.resultado, 'tempo_ms': metricas.total_ms, 'max_ms': metricas.max_ms,
+                'tentativas': metricas.tentativas()}
+
+    def _ler_qr(self, origem: OrigemImagem, debug_mode: bool, metricas: 'MetricasLeitura') -> Optional[str]:
+        if DocumentoPDF.e_pdf(origem):
+            return self._ler_qr_pdf(origem, debug_mode, metricas)
+        descricao = _descrever_origem(origem)
+        _log(f"Lendo imagem: {descricao}")
+        # Imagens de debug de origens em memória vão para a diretoria temporária
+        caminho_imagem = origem if isinstance(origem, str) else \
+            os.path.join(tempfile.gettempdir(), 'qr-memoria.png')
+
+        # Tentativas (variante, backend) ordenadas pela probabilidade de sucesso por milissegundo
+        tentativas = self.estatisticas.ordenar(self._tentativas_disponiveis())
+        try:
+            # Fotos JPEG grandes: tentar primeiro uma versão reduzida lida diretamente pelo descodificador
+            lado_reduzido = 0
+            reduzida = None
+            if self.piramide and not self.mosaico:
+                with metricas.medir('carregar', modo='reduzida'):
+                    reduzida = self._carregar_reduzida(origem)
+            if reduzida is not None:
+                lado_reduzido = max(reduzida.shape[:2])
+                metricas.dimensoes = (reduzida.shape[1], reduzida.shape[0])
+                metricas.reservar_memoria(reduzida.nbytes, forcar=True)
+                dados_qr = self._procurar_no_nivel(reduzida, tentativas, caminho_imagem, debug_mode,
+                                                   'reduzida_', metricas)
+                metricas.libertar_memoria(reduzida.nbytes)
+                reduzida = None
+                if dados_qr:
+                    return dados_qr
+
+            # Ler a imagem
+            if metricas.esgotado():
+                return None
+            with metricas.medir('carregar', modo='completa'):
+                imagem = self._carregar_completa(origem, metricas)
+
+            if imagem is None:
+                print(f"Erro: Não foi possível ler a imagem {descricao}", file=sys.stderr)
+                metricas.resultado = 'erro'
+                return None
+
+            _log(f"Imagem carregada com sucesso. Dimensões: {imagem.shape}")
+            height, width = imagem.shape[:2]
+            metricas.dimensoes = (width, height)
+            _log(f"Resolução: {width}x{height} pixels")
+
+            # Modo mosaico: digitalizações grandes procuradas por ladrilhos em vez de filtros globais
+            if self.mosaico:
+                lidos = self._procurar_em_mosaico(imagem, tentativas, metricas)
+                if lidos is not None:
+                    return lidos[0] if lidos else None
+
+            # Pirâmide: resolução de trabalho primeiro, resoluções maiores só se falhar
+            for escala, nivel in self._niveis_piramide(imagem):
+                if escala < 1.0 and max(nivel.shape[:2]) <= lado_reduzido:
+                    continue  # já tentado com a versão reduzida
+                if metricas.esgotado():
+                    break
+                prefixo = f"x{escala:.2f}_" if escala < 1.0 else ''
+                reservado = nivel.nbytes if escala < 1.0 else 0
+                metricas.reservar_memoria(reservado, forcar=True)
+                dados_qr = self._procurar_no_nivel(nivel, tentativas, caminho_imagem, debug_mode, prefixo,
+                                                   metricas)
+                metricas.libertar_memoria(reservado)
+                if dados_qr:
+                    return dados_qr
+        finally:
+            self.estatisticas.guardar()
+
+        if metricas.prazo_atingido:
+            _log(f"⚠ Prazo de {metricas.max_ms:.0f} ms esgotado sem encontrar o QR")
+            return None
+        _log("⚠ Nenhum código QR encontrado na imagem")
+        _log("Dica: Certifique-se de que:")
+        _log("  - O QR code está visível e legível")
+        _log("  - A imagem tem boa qualidade")
+        _log("  - O QR não está cortado ou muito distorcido")
+        return None
+    
+    # ------------------------------------------------------------------
+    # Modo multi-QR: todas as faturas de uma página numa só passagem
+    # ------------------------------------------------------------------
+
+    def ler_todos_qr_de_imagem(self, origem: OrigemImagem, max_ms: Optional[float] = None,
+                               metricas: Optional['MetricasLeitura'] = None) -> List[str]:
+        """
+        Lê todos os códigos QR de uma imagem (páginas digitalizadas, colagens de talões).
+
+        1. todos os códigos que cada backend lê de uma vez (detectAndDecodeMulti do OpenCV e
+           do detetor Aruco, lista completa do pyzbar, ...), na resolução de trabalho
+        2. procura por variantes, na resolução original, nas regiões detetadas mas não lidas
+           (ou em todas as que a localização encontrar, se a passagem 1 não detetou nada)
+        3. no modo mosaico, os códigos de todos os ladrilhos (ver _procurar_em_mosaico)
+        4. sem nenhum código, a procura normal de um único QR
+
+        Returns:
+            Lista de payloads distintos, pela ordem em que foram encontrados
+        """
+        propria = metricas is None
+        if propria:
+            metricas = self._novas_metricas(max_ms)
+            self.ultimas_metricas = metricas
+        codigos: List[str] = []
+        try:
+            codigos = self._ler_todos_qr(origem, metricas)
+            return codigos
+        except Exception as e:
+            print(f"Erro ao ler QR codes: {e}", file=sys.stderr)
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            metricas.resultado = 'erro'
+            return codigos
+        finally:
+            if propria:
+                metricas.concluir(metricas.resultado or self._resultado_leitura(codigos, metricas))
+                RegistoMetricas.partilhado().acumular(metricas.para_dict())
+
+    def _ler_todos_qr(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> List[str]:
+        if DocumentoPDF.e_pdf(origem):
+            return self._ler_todos_qr_pdf(origem, metricas)
+        _log(f"Lendo imagem (multi-QR): {_descrever_origem(origem)}")
+        with metricas.medir('carregar', modo='completa'):
+            imagem = self._carregar_completa(origem, metricas)
+        if imagem is None:
+            print(f"Erro: Não foi possível ler a imagem {_descrever_origem(origem)}", file=sys.stderr)
+            metricas.resultado = 'erro'
+            return []
+        height, width = imagem.shape[:2]
+        metricas.dimensoes = (width, height)
+
+        encontrados: Dict[str, None] = {}   # dicionário como conjunto ordenado
+        zonas: List[Tuple[float, float, float, float]] = []   # caixas dos códigos já lidos
+        por_ler: List[Tuple[int, int, int, int]] = []         # QR detetados mas não descodificados
+
+        def juntar(texto: str, quad, escala: float = 1.0):
+            if quad is not None and not texto:
+                caixa = self._caixa_do_quad(quad, escala, width, height)
+                if caixa is not None:
+                    por_ler.append(caixa)
+            if not texto:
+                return
+            encontrados.setdefault(texto, None)
+            if quad is not None:
+                quad = np.asarray(quad, dtype=np.float32).reshape(-1, 2) / escala
+                zonas.append((*quad.min(axis=0), *quad.max(axis=0)))
+
+        # 1) Descodificação de vários códigos de uma vez na resolução de trabalho
+        gray = imagem if imagem.ndim == 2 else cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
+        escala = min(1.0, self.LADO_TRABALHO / max(height, width))
+        nivel = gray if escala == 1.0 else cv2.resize(gray, None, fx=escala, fy=escala,
+                                                       interpolation=cv2.INTER_AREA)
+        for backend in self.backends_ativos():
+            if metricas.esgotado():
+                break
+            inicio = time.perf_counter()
+            codigos = backend.descodificar_todos(self, nivel)
+            lidos = [texto for texto, _ in codigos if texto]
+            metricas.registar('descodificar', (time.perf_counter() - inicio) * 1000, variante='multi',
+                              backend=backend.nome, nivel='multi', sucesso=bool(lidos), codigos=len(lidos))
+            for texto, cantos in codigos:
+                juntar(texto, cantos, escala)
+
+        # 2) Regiões com QR que a passagem anterior não leu: procura por variantes em cada uma
+        tentativas = self.estatisticas.ordenar(self._tentativas_disponiveis())
+        caminho_debug = os.path.join(tempfile.gettempdir(), 'qr-multi.png')
+        try:
+            caixas = list(por_ler)
+            if not caixas and not zonas and not metricas.esgotado():
+                with metricas.medir('localizar', nivel='multi'):
+                    caixas = self._localizar_qr(imagem, sempre=True)
+            for j, (x0, y0, x1, y1) in enumerate(caixas):
+                if metricas.esgotado():
+                    break
+                # Saltar regiões já lidas (ou já tentadas: os dois detetores veem os mesmos QR)
+                cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+                if any(zx0 <= cx <= zx1 and zy0 <= cy <= zy1 for zx0, zy0, zx1, zy1 in zonas):
+                    continue
+                zonas.append((x0, y0, x1, y1))
+                _log(f"Região candidata {j} ainda por ler: ({x0},{y0})-({x1},{y1})")
+                with self._variantes(imagem[y0:y1, x0:x1], metricas) as recorte:
+                    texto = self._tentar_variantes(recorte, tentativas, caminho_debug, prefixo=f"roi{j}_")
+                if texto:
+                    encontrados.setdefault(texto, None)
+
+            # 3) Modo mosaico: ladrilhos sobrepostos, para os códigos pequenos que a passagem 1 não viu
+            if self.mosaico and not metricas.esgotado():
+                for texto in self._procurar_em_mosaico(imagem, tentativas, metricas, multi=True) or ():
+                    encontrados.setdefault(texto, None)
+
+            # 4) Nada encontrado: procura normal de um único QR (pirâmide, retificação, ...)
+            if not encontrados and not metricas.esgotado():
+                juntar(self._ler_qr(imagem, False, metricas), None)
+        finally:
+            self.estatisticas.guardar()
+
+        _log(f"{len(encontrados)} código(s) QR distinto(s) encontrado(s)")
+        return list(encontrados)
+
+    # ------------------------------------------------------------------
+    # PDF: imagens embutidas de cada página, sem rasterizar
+    # ------------------------------------------------------------------
+
+    def _abrir_pdf(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> 'DocumentoPDF':
+        _log(f"Lendo PDF: {_descrever_origem(origem)}")
+        with metricas.medir('pdf', etapa_pdf='abrir'):
+            documento = DocumentoPDF.abrir(origem)
+        if documento.cifrado:
+            _log("PDF cifrado: as imagens embutidas não são legíveis, só a página rasterizada")
+        return documento
+
+    def _imagens_pagina_pdf(self, documento: 'DocumentoPDF', numero: int, imagens: List['_StreamPDF'],
+                            vistas: set, metricas: 'MetricasLeitura') -> Iterator[Tuple[str, np.ndarray]]:
+        """
+        Gera as imagens da página prontas a procurar, pela probabilidade de serem o QR (quadradas
+        primeiro, depois as maiores). Cada imagem só é descodificada quando é pedida, e só uma vez
+        por documento (logótipos repetidos em todas as páginas): um QR pequeno que venha primeiro
+        é lido antes de as digitalizações da página inteira serem descomprimidas. Pára quando o
+        prazo se esgota.
+        """
+        candidatas = []
+        for stream in [] if documento.cifrado else imagens:
+            if stream.numero in vistas:
+                continue
+            vistas.add(stream.numero)
+            largura = documento.resolver(stream.dicionario.get('Width'))
+            altura = documento.resolver(stream.dicionario.get('Height'))
+            # Um QR tem pelo menos 21 módulos de lado
+            if not isinstance(largura, int) or not isinstance(altura, int) or min(largura, altura) < 21:
+                continue
+            candidatas.append((abs(math.log(largura / altura)) > 0.25, -largura * altura, stream))
+        _log(f"Página {numero}: {len(candidatas)} imagem(ns) embutida(s) candidata(s)")
+        for _, _, stream in sorted(candidatas, key=lambda candidata: candidata[:2]):
+            if metricas.esgotado():
+                return
+            with metricas.medir('pdf', etapa_pdf='imagem', pagina=numero, objeto=stream.numero):
+                imagem = documento.imagem(stream)
+                if imagem is not None:
+                    imagem = self._preparar_imagem_pdf(imagem)
+            if imagem is not None:
+                yield f"p{numero}_obj{stream.numero}_", imagem
+
+    def _preparar_imagem_pdf(self, imagem: np.ndarray) -> np.ndarray:
+        """
+        Imagens pequenas (QR gerados com 1-2 px por módulo) ampliadas sem interpolação, e uma
+        margem branca à volta das que não são páginas inteiras: o QR embutido raramente traz a
+        zona de silêncio, que fica no papel à volta da imagem.
+        """
+        lado = max(imagem.shape[:2])
+        if lado < self.LADO_MIN_IMAGEM_PDF:
+            fator = math.ceil(self.LADO_MIN_IMAGEM_PDF / lado)
+            imagem = cv2.resize(imagem, None, fx=fator, fy=fator, interpolation=cv2.INTER_NEAREST)
+        if max(imagem.shape[:2]) <= self.LADO_TRABALHO:
+            margem = max(imagem.shape[:2]) // 10
+            imagem = cv2.copyMakeBorder(imagem, margem, margem, margem, margem, cv2.BORDER_CONSTANT,
+                                        value=(255, 255, 255))
+        return imagem
+
+    def _ler_direto(self, imagem: np.ndarray, metricas: 'MetricasLeitura', prefixo: str) -> Optional[str]:
+        """Uma tentativa por backend sobre a imagem em cinzento, sem variantes (QR gerados digitalmente)"""
+        gray = imagem if imagem.ndim == 2 else cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
+        for backend in self.backends_ativos():
+            if 'cinzento' not in backend.entradas or metricas.esgotado():
+                continue
+            inicio = time.perf_counter()
+            try:
+                dados_qr = backend.descodificar(self, gray)
+            except cv2.error:
+                dados_qr = None
+            self._registar_tentativa(metricas, 'gray', backend.nome, prefixo, dados_qr,
+                                     (time.perf_counter() - inicio) * 1000, inicio)
+            if dados_qr and _payload_at_valido(dados_qr):
+                self._marcar_vencedora(metricas, 'gray', backend.nome, prefixo)
+                return dados_qr
+        return None
+
+    def _rasterizar_pagina_pdf(self, origem: OrigemImagem, documento: 'DocumentoPDF', numero: int,
+                               metricas: 'MetricasLeitura') -> Optional[bytes]:
+        """
+        Recurso para páginas sem imagem com QR (QR desenhado a vetores, imagens CCITT/JBIG2,
+        PDFs cifrados): a página rasterizada pelo Ghostscript, em PNG cinzento, pelo stdout.
+        """
+        gs = shutil.which('gs')
+        if gs is None:
+            _log(f"Página {numero}: sem QR nas imagens embutidas e Ghostscript não instalado")
+            return None
+        comando = [gs, '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE', f'-dFirstPage={numero}', f'-dLastPage={numero}',
+                   f'-r{self.DPI_RASTER_PDF}', '-sDEVICE=pnggray', '-sOutputFile=-',
+                   origem if isinstance(origem, str) else '-']
+        limite_s = max(metricas.restante_ms() / 1000, 1) if metricas.prazo else None
+        try:
+            with metricas.medir('pdf', etapa_pdf='rasterizar', pagina=numero):
+                processo = subprocess.run(comando, input=None if isinstance(origem, str) else documento.dados,
+                                          capture_output=True, timeout=limite_s)
+        except subprocess.TimeoutExpired:
+            metricas.prazo_atingido = True
+            return None
+        if processo.returncode != 0 or not processo.stdout:
+            print(f"Aviso: Ghostscript não rasterizou a página {numero}: "
+                  f"{processo.stderr.decode(errors='replace').strip()[:200]}", file=sys.stderr)
+            return None
+        _log(f"Página {numero} rasterizada a {self.DPI_RASTER_PDF} dpi")
+        return processo.stdout
+
+    def _ler_qr_pdf(self, origem: OrigemImagem, debug_mode: bool, metricas: 'MetricasLeitura') -> Optional[str]:
+        """
+        Página a página, pára na primeira com um payload AT válido: leitura direta de todas as
+        imagens embutidas, procura completa em cada uma e, sem QR, a página rasterizada.
+        """
+        documento = self._abrir_pdf(origem, metricas)
+        vistas: set = set()
+        for numero, imagens in documento.paginas():
+            if metricas.esgotado():
+                break
+            # Leitura direta de cada imagem assim que é descodificada; a procura completa
+            # só depois, sobre as mesmas imagens
+            candidatas = []
+            for prefixo, imagem in self._imagens_pagina_pdf(documento, numero, imagens, vistas, metricas):
+                dados_qr = self._ler_direto(imagem, metricas, prefixo)
+                if dados_qr:
+                    _log(f"✓ QR lido diretamente da imagem embutida na página {numero}")
+                    return dados_qr
+                candidatas.append((prefixo, imagem))
+            for _, imagem in candidatas:
+                if metricas.esgotado():
+                    break
+                dados_qr = self._ler_qr(imagem, debug_mode, metricas)
+                if dados_qr and _payload_at_valido(dados_qr):
+                    return dados_qr
+            if metricas.esgotado():
+                break
+            raster = self._rasterizar_pagina_pdf(origem, documento, numero, metricas)
+            if raster is not None:
+                dados_qr = self._ler_qr(raster, debug_mode, metricas)
+                if dados_qr and _payload_at_valido(dados_qr):
+                    return dados_qr
+        if not metricas.prazo_atingido:
+            _log("⚠ Nenhum QR de fatura encontrado no PDF")
+        return None
 
-            if imagem is None:
-                print(f"Erro: Não foi possível ler a imagem {caminho_imagem}", file=sys.stderr)
-                return None
+    def _ler_todos_qr_pdf(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> List[str]:
+        """Modo multi-QR num PDF: os códigos de todas as imagens de todas as páginas"""
+        documento = self._abrir_pdf(origem, metricas)
+        encontrados: Dict[str, None] = {}
+        vistas: set = set()
+        for numero, imagens in documento.paginas():
+            if metricas.esgotado():
+                break
+            antes = len(encontrados)
+            for _, imagem in self._imagens_pagina_pdf(documento, numero, imagens, vistas, metricas):
+                if metricas.esgotado():
+                    break
+                for texto in self._ler_todos_qr(imagem, metricas):
+                    encontrados.setdefault(texto, None)
+            if len(encontrados) == antes and not metricas.esgotado():
+                raster = self._rasterizar_pagina_pdf(origem, documento, numero, metricas)
+                if raster is not None:
+                    for texto in self._ler_todos_qr(raster, metricas):
+                        encontrados.setdefault(texto, None)
+        return list(encontrados)
 
-            print(f"Imagem carregada com sucesso. Dimensões: {imagem.shape}", file=sys.stderr)
-            height, width = imagem.shape[:2]
-            print(f"Resolução: {width}x{height} pixels", file=sys.stderr)
+    def processar_faturas_multiplas(self, origem: OrigemImagem, max_ms: Optional[float] = None,
+                                    perfil_ms: Optional[float] = None) -> List[Dict]:
+        """
+        Processa uma página com várias faturas: lê todos os QR, descodifica os que têm o
+        formato AT e remove os repetidos (mesmo ATCUD e hash).
 
-            # Usar OpenCV QRCodeDetector (mais robusto)
-            qr_detector = cv2.QRCodeDetector()
+        Returns:
+            Lista de faturas (vazia se nenhuma for encontrada)
+        """
+        metricas = self._novas_metricas(max_ms)
+        self.ultimas_metricas = metricas
+        faturas: List[Dict] = []
+        with self._perfilar(origem, perfil_ms):
+            try:
+                faturas = self._processar_faturas_multiplas(origem, metricas)
+                if faturas and self.indice is not None:
+                    with metricas.medir('indice'):
+                        for fatura in faturas:
+                            self.verificar_duplicado(fatura, origem)
+                return faturas
+            except Exception:
+                metricas.resultado = 'erro'
+                raise
+            finally:
+                metricas.concluir(metricas.resultado or self._resultado_leitura(faturas, metricas))
+                RegistoMetricas.partilhado().acumular(metricas.para_dict())
 
-            # Gerar imagens pré-processadas
-            processed_images = self._preprocess_image(imagem)
-            # Adicionar a imagem original em escala de cinza para tentar também
-            gray_original = cv2.cvtColor(imagem, cv2.COLOR_BGR2GRAY)
-            processed_images.insert(0, gray_original) # Prioritize grayscale
+    def _processar_faturas_multiplas(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> List[Dict]:
+        chave_cache = None
+        if self.cache is not None and not isinstance(origem, np.ndarray):
+            with metricas.medir('cache'):
+                if isinstance(origem, str):
+                    try:
+                        with open(origem, 'rb') as f:
+                            origem = f.read()
+                    except OSError:
+                        pass
+                if _origem_em_memoria(origem):
+                    chave_cache = self.cache.chave(origem, self._assinatura_configuracao() + '|multi')
+                entrada = self.cache.obter(chave_cache) if chave_cache else None
+            if entrada is not None:
+                metricas.resultado = 'cache'
+                _log("Cache: resultado reutilizado")
+                return entrada.get('faturas', [])
 
-            # Tentar detectar QR com OpenCV em cada imagem pré-processada
-            print("Tentando detectar QR com OpenCV em imagens pré-processadas...", file=sys.stderr)
-            for i, p_img in enumerate(processed_images):
-                print(f"  Tentando imagem processada {i}...", file=sys.stderr)
+        codigos = self.ler_todos_qr_de_imagem(origem, metricas=metricas)
 
-                # Save debug image if in debug mode
-                if debug_mode:
-                    debug_path = caminho_imagem.replace('.png', f'_debug_{i}.png')
-                    cv2.imwrite(debug_path, p_img)
-                    print(f"  Debug: Salva em {debug_path}", file=sys.stderr)
-
-                decoded_text, points, straight_qr = qr_detector.detectAndDecode(p_img)
-                if decoded_text and len(decoded_text) > 0:
-                    print(f"✓ QR encontrado em imagem processada {i}!", file=sys.stderr)
-                    print(f"Dados do QR (primeiros 100 chars): {decoded_text[:100]}...", file=sys.stderr)
-                    return decoded_text
-
-            # Se não encontrar, tentar com rotações na imagem original (ainda é válido)
-            print("QR não encontrado em pré-processadas. Tentando com rotações na imagem original...", file=sys.stderr)
-            for angulo in [90, 180, 270]:
-                print(f"  Tentando rotação de {angulo}°...", file=sys.stderr)
-                rotacionada = cv2.rotate(imagem, cv2.ROTATE_90_CLOCKWISE if angulo == 90 else
-                                       cv2.ROTATE_180 if angulo == 180 else
-                                       cv2.ROTATE_90_COUNTERCLOCKWISE)
-                decoded_text, points, straight_qr = qr_detector.detectAndDecode(rotacionada)
-                if decoded_text and len(decoded_text) > 0:
-                    print(f"  ✓ QR encontrado com rotação de {angulo}°", file=sys.stderr)
-                    print(f"Dados do QR (primeiros 100 chars): {decoded_text[:100]}...", file=sys.stderr)
-                    return decoded_text
-
-            # Se OpenCV ainda não funcionar, tentar pyzbar como fallback em todas as versões da imagem
-            if PYZBAR_AVAILABLE:
-                print("OpenCV não encontrou em nenhuma tentativa. Tentando com pyzbar em todas as versões...", file=sys.stderr)
-
-                # Tentar pyzbar na imagem original colorida
-                codigos_qr = pyzbar.decode(imagem)
-                if codigos_qr:
-                    print(f"✓ {len(codigos_qr)} código(s) QR encontrado(s) com pyzbar (original colorida)", file=sys.stderr)
-                    dados_qr = codigos_qr[0].data.decode('utf-8')
-                    print(f"Dados do QR (primeiros 100 chars): {dados_qr[:100]}...", file=sys.stderr)
-                    return dados_qr
+        faturas = []
+        vistas = set()
+        with metricas.medir('parse'):
+            for dados_qr in codigos:
+                # Outros QR da página (URLs, talões de multibanco, ...) não são faturas AT
+                if not _payload_at_valido(dados_qr):
+                    continue
+                fatura = self.descodificar_qr_fatura(dados_qr)
+                if 'erro' in fatura:
+                    continue
+                chave = (fatura.get('atcud'), fatura.get('hash'))
+                if chave == (None, None):
+                    chave = dados_qr
+                if chave in vistas:
+                    continue
+                vistas.add(chave)
+                faturas.append(fatura)
 
-                # Tentar pyzbar em cada imagem pré-processada (incluindo grayscale original)
-                for i, p_img in enumerate(processed_images):
-                    print(f"  Tentando pyzbar em imagem processada {i}...", file=sys.stderr)
-                    codigos_qr = pyzbar.decode(p_img)
-                    if codigos_qr:
-                        print(f"✓ {len(codigos_qr)} código(s) QR encontrado(s) com pyzbar (processada {i})", file=sys.stderr)
-                        dados_qr = codigos_qr[0].data.decode('utf-8')
-                        print(f"Dados do QR (primeiros 100 chars): {dados_qr[:100]}...", file=sys.stderr)
-                        return dados_qr
-
-            print("⚠ Nenhum código QR encontrado na imagem", file=sys.stderr)
-            print("Dica: Certifique-se de que:", file=sys.stderr)
-            print("  - O QR code está visível e legível", file=sys.stderr)
-            print("  - A imagem tem boa qualidade", file=sys.stderr)
-            print("  - O QR não está cortado ou muito distorcido", file=sys.stderr)
-            return None
+        # Leituras cortadas pelo prazo ou interrompidas por um erro não ficam em cache
+        if chave_cache and not metricas.prazo_atingido and metricas.resultado != 'erro':
+            self.cache.guardar(chave_cache, {'faturas': faturas} if faturas else None)
+        return faturas
 
-        except Exception as e:
-            print(f"Erro ao ler QR code: {e}", file=sys.stderr)
-            import traceback
-            traceback.print_exc(file=sys.stderr)
-            return None
-    
     def descodificar_qr_fatura(self, dados_qr: str) -> Dict:
         """
         Descodifica os dados do QR code de uma fatura portuguesa
@@ -207,249 +3382,233 @@ class LeitorQRFaturaAT:
             Dicionário com os dados descodificados
         """
         try:
-            # Dividir os campos pelo asterisco
-            campos = dados_qr.split('*')
-            
-            fatura = {
-                'raw_data': dados_qr,
-                'nif_emitente': None,
-                'nif_adquirente': None,
-                'pais_adquirente': None,
-                'tipo_documento': None,
-                'estado_documento': None,
-                'data_emissao': None,
-                'numero_documento': None,
-                'atcud': None,
-                'linhas_iva': [],
-                'valor_total': None,
-                'retencao_iva': None,
-                'hash': None,
-                'numero_certificado': None,
-                'outras_infos': None
-            }
-            
-            linhas_iva_temp = {}
-            
-            for campo in campos:
-                if ':' not in campo:
-                    continue
-                    
-                chave, valor = campo.split(':', 1)
-                
-                if chave == 'A':
-                    fatura['nif_emitente'] = valor
-                elif chave == 'B':
-                    fatura['nif_adquirente'] = valor
-                elif chave == 'C':
-                    fatura['pais_adquirente'] = valor
-                elif chave == 'D':
-                    fatura['tipo_documento'] = valor
-                elif chave == 'E':
-                    fatura['estado_documento'] = valor
-                elif chave == 'F':
-                    # Data no formato YYYYMMDD
-                    try:
-                        data_obj = datetime.strptime(valor, '%Y%m%d')
-                        fatura['data_emissao'] = data_obj.strftime('%Y-%m-%d')
-                    except:
-                        fatura['data_emissao'] = valor
-                elif chave == 'G':
-                    fatura['numero_documento'] = valor
-                elif chave == 'H':
-                    fatura['atcud'] = valor
-                elif chave.startswith('I'):
-                    # Linhas de IVA: múltiplas linhas possíveis
-                    # Formato: I1=país, I2=base1, I3=base2, I4=iva1, I5=iva2, I6=taxa1, I7=base3, I8=iva3...
-                    # OU: I1=país, I3=base1, I4=iva1, I7=base2, I8=iva2
-
-                    numero_str = chave[1:]
-                    try:
-                        numero = int(numero_str)
-
-                        # I1 geralmente é país
-                        if numero == 1:
-                            try:
-                                float(valor)
-                                # Se for número, tratar como base da linha 1
-                                if '1' not in linhas_iva_temp:
-                                    linhas_iva_temp['1'] = {}
-                                linhas_iva_temp['1']['base_tributavel'] = float(valor)
-                            except:
-                                # É país - aplicar a todas as linhas
-                                pass
-
-                        # Pares de base/iva podem estar em diferentes formatos:
-                        # Formato 1: I3/I4 = linha 1, I7/I8 = linha 2, I11/I12 = linha 3... (padrão antigo)
-                        # Formato 2: I5/I6 = linha 1, I7/I8 = linha 2, I9/I10 = linha 3... (padrão novo)
-                        # Verificar qual padrão é usado e mapear corretamente
-                        elif numero >= 3:
-                            # Tentar determinar o padrão baseado nos números ímpares/pares
-                            # Se temos I5/I6, I7/I8, I9/I10... (pares consecutivos de ímpar/par)
-                            # Se temos I3/I4, I7/I8, I11/I12... (pares com saltos de 4)
-
-                            # Verificar se é par consecutivo (I5/I6, I7/I8, I9/I10...)
-                            # Neste caso, ímpar é base, par seguinte é IVA
-                            if numero % 2 == 1:  # Número ímpar (I5, I7, I9, I11...)
-                                # Base tributável
-                                # I5 = linha 1, I7 = linha 2, I9 = linha 3...
-                                # OU I3 = linha 1, I7 = linha 2, I11 = linha 3...
-
-                                # Tentar mapear baseado em ímpares >= 5
-                                if numero >= 5:
-                                    linha_num = str((numero - 5) // 2 + 1)
-                                else:  # I3
-                                    linha_num = str((numero - 3) // 4 + 1)
-
-                                if linha_num not in linhas_iva_temp:
-                                    linhas_iva_temp[linha_num] = {}
-
-                                try:
-                                    linhas_iva_temp[linha_num]['base_tributavel'] = float(valor)
-                                except:
-                                    pass
-
-                            elif numero % 2 == 0:  # Número par (I4, I6, I8, I10...)
-                                # Valor IVA
-                                # I6 = linha 1, I8 = linha 2, I10 = linha 3...
-                                # OU I4 = linha 1, I8 = linha 2, I12 = linha 3...
-
-                                # Tentar mapear baseado em pares >= 6
-                                if numero >= 6:
-                                    linha_num = str((numero - 6) // 2 + 1)
-                                else:  # I4
-                                    linha_num = str((numero - 4) // 4 + 1)
-
-                                if linha_num not in linhas_iva_temp:
-                                    linhas_iva_temp[linha_num] = {}
-
-                                try:
-                                    linhas_iva_temp[linha_num]['valor_iva'] = float(valor)
-                                except:
-                                    pass
-                    except:
-                        pass
-                        
-                elif chave == 'N':
-                    # N pode ser valor total OU retenção, dependendo da posição no QR
-                    # Vamos guardar temporariamente e decidir depois
-                    fatura['campo_n'] = float(valor)
-                elif chave == 'O':
-                    # O pode ser retenção OU valor total, dependendo da posição no QR
-                    # Vamos guardar temporariamente e decidir depois
-                    fatura['campo_o'] = float(valor) if valor else 0
-                elif chave == 'P':
-                    fatura['hash'] = valor
-                elif chave == 'Q':
-                    fatura['numero_certificado'] = valor
-                elif chave == 'R':
-                    fatura['outras_infos'] = valor
-            
-            # Converter linhas de IVA para lista e calcular taxa se necessário
-            for num_linha in sorted(linhas_iva_temp.keys()):
-                linha = linhas_iva_temp[num_linha]
-                # If percentage is not explicitly set, but base and iva value are, try to calculate
-                if ('base_tributavel' in linha and 'valor_iva' in linha and
-                        ('taxa_iva_percentagem' not in linha or linha['taxa_iva_percentagem'] is None or linha['taxa_iva_percentagem'] == 0)):
-                    base = float(linha['base_tributavel'])
-                    iva_valor = float(linha['valor_iva'])
-                    if base > 0:
-                        calculated_taxa = round((iva_valor / base) * 100, 2) # Round to 2 decimal places
-                        linha['taxa_iva_percentagem'] = calculated_taxa
-                        # Assign a generic code if not present, e.g., 'CALC'
-                        if 'taxa_iva_codigo' not in linha or linha['taxa_iva_codigo'] == 'OUT':
-                            linha['taxa_iva_codigo'] = f"CALC({calculated_taxa}%)"
-                    else:
-                        # If base is 0, and iva_valor is 0, it's 0% IVA (exempt)
-                        if iva_valor == 0:
-                            linha['taxa_iva_percentagem'] = 0
-                            linha['taxa_iva_codigo'] = 'ISE'
-                fatura['linhas_iva'].append(linha)
-
-            # Calcular valor total correto como base_tributavel + valor_iva
-            total_base = 0
-            total_iva = 0
-            for linha in fatura['linhas_iva']:
-                total_base += linha.get('base_tributavel', 0)
-                total_iva += linha.get('valor_iva', 0)
-
-            # Calcular o valor total esperado (base + IVA)
-            valor_total_calculado = round(total_base + total_iva, 2)
-
-            campo_n = fatura.get('campo_n', 0)
-            campo_o = fatura.get('campo_o', 0)
-
-            # Estratégia melhorada para determinar valor_total e IVA total:
-            # 1. Se temos linhas de IVA válidas, o valor calculado é mais confiável
-            # 2. Campo N geralmente é o IVA total ou valor total do documento
-            # 3. Campo O pode ser o valor total, retenção, ou outros valores
-
-            if len(fatura['linhas_iva']) > 0 and total_base > 0:
-                # Temos linhas de IVA válidas - usar valor calculado como total
-                fatura['valor_total'] = valor_total_calculado
-
-                # Verificar se N ou O corresponde ao total de IVA
-                if abs(campo_n - total_iva) < 0.01:
-                    # N é o IVA total
-                    fatura['total_iva_qr'] = campo_n
-                    fatura['retencao_iva'] = campo_o if campo_o else 0
-                elif abs(campo_o - total_iva) < 0.01:
-                    # O é o IVA total
-                    fatura['total_iva_qr'] = campo_o
-                    fatura['retencao_iva'] = campo_n if campo_n else 0
-                else:
-                    # Nenhum corresponde ao IVA - guardar ambos para referência
-                    fatura['campo_n_original'] = campo_n
-                    fatura['campo_o_original'] = campo_o
-                    fatura['retencao_iva'] = 0
-            else:
-                # Sem linhas de IVA válidas - usar lógica antiga
-                # Comparar qual dos campos está mais próximo do valor calculado
-                if abs(campo_n - valor_total_calculado) < abs(campo_o - valor_total_calculado):
-                    fatura['valor_total'] = campo_n
-                    fatura['retencao_iva'] = campo_o
-                else:
-                    fatura['valor_total'] = campo_o
-                    fatura['retencao_iva'] = campo_n
-
-            # Adicionar campos auxiliares para debug/verificação
-            fatura['total_base_calculado'] = round(total_base, 2)
-            fatura['total_iva_calculado'] = round(total_iva, 2)
-
-            # Remover campos temporários
-            fatura.pop('campo_n', None)
-            fatura.pop('campo_o', None)
-
-            return fatura
-            
+            return _descodificar_payload_at(dados_qr)
         except Exception as e:
             print(f"Erro ao descodificar QR: {e}", file=sys.stderr)
             return {'erro': str(e), 'raw_data': dados_qr}
+
+    def verificar_duplicado(self, fatura: Dict, origem: Union[OrigemImagem, str] = '') -> Dict:
+        """
+        Consulta e atualiza o índice de faturas (ver IndiceFaturas). Se a fatura já tinha sido
+        lida, acrescenta-lhe 'duplicado' com a origem, a data e o resultado dessa primeira leitura.
+
+        Chamado depois de a fatura ir para a cache, por isso a marca nunca fica guardada nela.
+        """
+        if self.indice is None or not fatura:
+            return fatura
+        import sqlite3
+        try:
+            anterior = self.indice.registar(fatura, origem if isinstance(origem, str) else '')
+        except sqlite3.Error as e:
+            print(f"Aviso: não foi possível consultar o índice de faturas: {e}", file=sys.stderr)
+            return fatura
+        if anterior is not None:
+            fatura['duplicado'] = anterior
+            _log(f"Fatura repetida: já lida em {anterior['visto_em']}"
+                 + (f" ({anterior['origem']})" if anterior['origem'] else ''))
+        return fatura
+
+    def descodificar_lote(self, payloads: Iterable[str], memoizar: bool = True) -> List[Dict]:
+        """
+        Descodifica muitos payloads QR de uma vez (ex.: reprocessar o raw_data guardado).
+
+        Args:
+            payloads: Iterável de strings QR
+            memoizar: Se True, payloads repetidos são descodificados uma única vez
+                      (cada resultado devolvido é uma cópia independente)
+
+        Returns:
+            Lista de dicionários, pela mesma ordem dos payloads
+
+        Débito medido: ~75 mil payloads distintos por segundo (o limite de _descodificar_payload_at);
+        com payloads repetidos, centenas de milhares.
+        """
+        # Todos os resultados ficam vivos na lista: sem isto o GC geracional volta a percorrê-los
+        # a cada poucos milhares de dicionários criados (~25% do tempo num lote grande)
+        gc_ligado = gc.isenabled()
+        gc.disable()
+        try:
+            if not memoizar:
+                return [self.descodificar_qr_fatura(dados_qr) for dados_qr in payloads]
+
+            vistos: Dict[str, Dict] = {}
+            resultados = []
+            for dados_qr in payloads:
+                fatura = vistos.get(dados_qr)
+                if fatura is None:
+                    fatura = self.descodificar_qr_fatura(dados_qr)
+                    vistos[dados_qr] = fatura
+                    resultados.append(fatura)
+                else:
+                    resultados.append(_copiar_fatura(fatura))
+            return resultados
+        finally:
+            if gc_ligado:
+                gc.enable()
     
-    def processar_fatura(self, caminho_imagem: str) -> Optional[Dict]:
+    def ler_fluxo(self, frames: Iterable[OrigemImagem], max_ms: Optional[float] = None,
+                  sessao: Optional['SessaoFluxo'] = None) -> Optional[Dict]:
+        """
+        Lê uma sequência de frames (ex.: câmara) até um deles ter uma fatura AT válida, com o
+        estado levado de frame em frame (ver SessaoFluxo).
+
+        Args:
+            frames: Iterável de frames (bytes JPEG/PNG ou np.ndarray), consumido à medida que chegam
+            max_ms: Prazo do fluxo inteiro em ms (por omissão self.max_ms)
+            sessao: Sessão a continuar (por omissão uma nova)
+
+        Returns:
+            Dicionário com os dados da fatura, ou None se os frames acabarem (ou o prazo) sem QR
+        """
+        sessao = sessao or SessaoFluxo(self)
+        max_ms = max_ms if max_ms is not None else self.max_ms
+        for frame in frames:
+            dados_qr = sessao.processar_frame(frame)
+            if dados_qr:
+                _log(f"✓ QR lido no frame {sessao.frames} ({json.dumps(sessao.resumo())})")
+                return self.verificar_duplicado(self.descodificar_qr_fatura(dados_qr))
+            if max_ms is not None and (time.perf_counter() - sessao.inicio) * 1000 >= max_ms:
+                _log(f"⚠ Prazo de {max_ms:.0f} ms esgotado ao fim de {sessao.frames} frame(s)")
+                break
+        _log(f"⚠ Nenhum QR lido em {sessao.frames} frame(s)")
+        return None
+
+    def processar_fatura(self, origem: OrigemImagem, max_ms: Optional[float] = None,
+                         perfil_ms: Optional[float] = None) -> Optional[Dict]:
         """
         Processa uma imagem de fatura: lê o QR e descodifica os dados
         
         Args:
-            caminho_imagem: Caminho para a imagem da fatura
+            origem: Caminho para a imagem da fatura ou bytes do ficheiro de imagem
+            max_ms: Prazo da leitura em ms (por omissão self.max_ms)
+            perfil_ms: Grava o perfil da leitura (ver PerfilLeitura) se demorar pelo menos isto
+                (por omissão self.perfil_ms)
             
         Returns:
             Dicionário com os dados da fatura ou None se falhar
+
+        Os tempos por etapa ficam em self.ultimas_metricas (ver MetricasLeitura) e, sem
+        resultado, resumo_nao_encontrado() indica o motivo e as tentativas feitas; o perfil
+        gravado, se houver, em self.ultimo_perfil.
         """
-        print(f"A processar: {caminho_imagem}", file=sys.stderr)
-        
+        metricas = self._novas_metricas(max_ms)
+        self.ultimas_metricas = metricas
+        fatura = None
+        with self._perfilar(origem, perfil_ms):
+            try:
+                fatura = self._processar_fatura(origem, metricas)
+                if fatura and self.indice is not None:
+                    with metricas.medir('indice'):
+                        self.verificar_duplicado(fatura, origem)
+                return fatura
+            except Exception:
+                metricas.resultado = 'erro'
+                raise
+            finally:
+                metricas.concluir(metricas.resultado or self._resultado_leitura(fatura, metricas))
+                RegistoMetricas.partilhado().acumular(metricas.para_dict())
+
+    def _processar_fatura(self, origem: OrigemImagem, metricas: 'MetricasLeitura') -> Optional[Dict]:
+        _log(f"A processar: {_descrever_origem(origem)}")
+
+        # Cache por conteúdo: a mesma foto enviada de novo não repete a procura
+        chave_cache = None
+        if self.cache is not None and not isinstance(origem, np.ndarray):
+            with metricas.medir('cache'):
+                if isinstance(origem, str):
+                    # Ler o ficheiro uma única vez: os mesmos bytes servem a chave e a descodificação
+                    try:
+                        with open(origem, 'rb') as f:
+                            origem = f.read()
+                    except OSError:
+                        pass
+                if _origem_em_memoria(origem):
+                    chave_cache = self.cache.chave(origem, self._assinatura_configuracao())
+                entrada = self.cache.obter(chave_cache) if chave_cache else None
+            if entrada is not None:
+                metricas.resultado = 'cache'
+                if entrada.get('falhou'):
+                    _log("Cache: imagem falhou recentemente, a ignorar nova tentativa")
+                    return None
+                _log("Cache: resultado reutilizado")
+                return entrada['fatura']
+
         # Ler QR code
-        dados_qr = self.ler_qr_de_imagem(caminho_imagem)
+        dados_qr = self.ler_qr_de_imagem(origem, metricas=metricas)
         
         if not dados_qr:
+            # Uma leitura cortada pelo prazo ou por um erro (imagem ilegível, asserção do OpenCV,
+            # ...) não prova que a imagem não tem QR: não fica em cache
+            if chave_cache and not metricas.prazo_atingido and metricas.resultado != 'erro':
+                self.cache.guardar(chave_cache, None)
             return None
         
-        print(f"QR Code encontrado! Tamanho: {len(dados_qr)} caracteres", file=sys.stderr)
+        _log(f"QR Code encontrado! Tamanho: {len(dados_qr)} caracteres")
         
         # Descodificar dados
-        fatura = self.descodificar_qr_fatura(dados_qr)
+        with metricas.medir('parse'):
+            fatura = self.descodificar_qr_fatura(dados_qr)
+
+        if chave_cache:
+            self.cache.guardar(chave_cache, {'dados_qr': dados_qr, 'fatura': fatura})
         
         return fatura
     
+    def _classificar_taxas(self, percentagens: np.ndarray, tolerancia: float = 0.6) -> np.ndarray:
+        """
+        Converte percentagens de IVA calculadas no código de taxa de taxas_iva_pt mais próximo
+        (NOR 23, INT 13, RED 6, ISE 0); fora da tolerância ou NaN fica 'OUT'.
+        """
+        codigos = np.array([codigo for codigo in self.taxas_iva_pt if codigo != 'OUT'])
+        taxas = np.array([self.taxas_iva_pt[codigo] for codigo in codigos], dtype='f8')
+        distancias = np.abs(percentagens[:, None] - taxas[None, :])
+        mais_proxima = np.argmin(np.nan_to_num(distancias, nan=np.inf), axis=1)
+        resultado = codigos[mais_proxima].astype('U4') if len(percentagens) else np.array([], dtype='U4')
+        fora = ~(distancias[np.arange(len(percentagens)), mais_proxima] <= tolerancia) if len(percentagens) else []
+        resultado[fora] = 'OUT'
+        return resultado
+
+    def para_colunas(self, faturas: Iterable[Dict]) -> 'ColunasFaturas':
+        """
+        Converte faturas descodificadas (descodificar_qr_fatura / descodificar_lote) em
+        tabelas colunares. Faturas com erro de descodificação são ignoradas.
+        """
+        cabecalhos = []
+        linhas = []
+        for indice, fatura in enumerate(faturas):
+            if not fatura or 'erro' in fatura:
+                continue
+            try:
+                data = np.datetime64(fatura.get('data_emissao') or 'NaT', 'D')
+            except ValueError:
+                data = np.datetime64('NaT', 'D')
+            posicao = len(cabecalhos)
+            cabecalhos.append((
+                indice,
+                fatura.get('nif_emitente') or '',
+                fatura.get('nif_adquirente') or '',
+                fatura.get('tipo_documento') or '',
+                data,
+                fatura.get('valor_total') or 0.0,
+                fatura.get('retencao_iva') or 0.0,
+                fatura.get('total_base_calculado') or 0.0,
+                fatura.get('total_iva_calculado') or 0.0,
+            ))
+            for linha in fatura.get('linhas_iva', []):
+                taxa = linha.get('taxa_iva_percentagem')
+                linhas.append((
+                    posicao,
+                    linha.get('base_tributavel', 0.0),
+                    linha.get('valor_iva', 0.0),
+                    np.nan if taxa is None else taxa,
+                    '',
+                ))
+
+        tabela_cabecalhos = np.array(cabecalhos, dtype=ColunasFaturas.DTYPE_CABECALHO)
+        tabela_linhas = np.array(linhas, dtype=ColunasFaturas.DTYPE_LINHA)
+        tabela_linhas['taxa_iva_codigo'] = self._classificar_taxas(tabela_linhas['taxa_iva_percentagem'])
+        return ColunasFaturas(tabela_cabecalhos, tabela_linhas)
+
     def formatar_fatura(self, fatura: Dict) -> str:
         """
         Formata os dados da fatura para apresentação legível
@@ -513,11 +3672,1025 @@ class LeitorQRFaturaAT:
             print(f"Erro ao exportar JSON: {e}", file=sys.stderr)
 
 
+class SessaoFluxo:
+    """
+    Leitura de uma sequência de frames (câmara), com estado entre frames: os cantos do último
+    QR detetado e a tentativa (variante, backend) que descodificou. Cada frame custa pouco:
+
+    1. com um QR seguido, só as TENTATIVAS_ROI mais promissoras (a vencedora primeiro) no
+       recorte à volta dos últimos cantos;
+    2. senão (ou se falhar), localizar o QR numa versão reduzida do frame, guardar os cantos
+       para o frame seguinte e, se o QR mudou de sítio, tentar logo o novo recorte (frames
+       tremidos em que não se localiza nada mantêm os cantos, até MAX_FRAMES_PERDIDO seguidos);
+    3. sem QR localizado, uma só tentativa no frame completo.
+
+    Cada frame tem um prazo de MS_POR_FRAME; a procura completa de ler_qr_de_imagem nunca corre.
+    """
+
+    MS_POR_FRAME = float(os.environ.get('QR_FLUXO_MS_FRAME', '150'))
+    TENTATIVAS_ROI = 3
+    # Deslocamento (fração do lado do recorte) a partir do qual os cantos novos justificam outra tentativa
+    DESLOCAMENTO_MINIMO = 0.2
+    MAX_FRAMES_PERDIDO = 5
+
+    def __init__(self, leitor: 'LeitorQRFaturaAT', ms_por_frame: Optional[float] = None):
+        self.leitor = leitor
+        self.ms_por_frame = self.MS_POR_FRAME if ms_por_frame is None else _validar_ms(ms_por_frame)
+        _carregar_visao()
+        self.cantos: Optional[np.ndarray] = None
+        self.tentativa: Optional[Tuple[str, str]] = None
+        self.frames = 0
+        # Prazo do fluxo inteiro em ms (modo servidor; ler_fluxo recebe-o como argumento)
+        self.max_ms: Optional[float] = None
+        self._perdido = 0
+        self.inicio = time.perf_counter()
+        self.ultimo_uso = time.monotonic()
+        self._tamanho: Optional[Tuple[int, int]] = None
+        self._ordenadas: Optional[List[Tuple[str, str]]] = None
+        # Frames da mesma sessão não são processados em paralelo (modo servidor: ver ServidorQR)
+        self.lock = threading.Lock()
+
+    def _tentativas(self, n: int) -> List[Tuple[str, str]]:
+        if self._ordenadas is None:
+            self._ordenadas = self.leitor.estatisticas.ordenar(self.leitor._tentativas_disponiveis())
+        tentativas = [self.tentativa] if self.tentativa else []
+        return tentativas + [par for par in self._ordenadas if par != self.tentativa][:n - len(tentativas)]
+
+    def _tentar(self, imagem: np.ndarray, tentativas: List[Tuple[str, str]], prefixo: str,
+                metricas: 'MetricasLeitura') -> Optional[str]:
+        with self.leitor._variantes(imagem, metricas) as variantes:
+            dados_qr = self.leitor._tentar_variantes(variantes, tentativas, '', prefixo=prefixo)
+        if not dados_qr or not _payload_at_valido(dados_qr):
+            return None
+        if metricas.sucesso:
+            self.tentativa = (metricas.sucesso['variante'], metricas.sucesso['backend'])
+        return dados_qr
+
+    def _recorte(self, gray: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+        if self.cantos is None:
+            return None
+        height, width = gray.shape[:2]
+        return self.leitor._caixa_do_quad(self.cantos, 1.0, width, height)
+
+    def _localizar(self, gray: np.ndarray, metricas: 'MetricasLeitura') -> Optional[np.ndarray]:
+        """Cantos do QR no frame (coordenadas do frame completo), procurados numa versão reduzida"""
+        with metricas.medir('localizar'):
+            escala = min(1.0, self.leitor.LADO_LOCALIZACAO / max(gray.shape[:2]))
+            reduzida = gray if escala == 1.0 else \
+                cv2.resize(gray, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA)
+            try:
+                cantos = self.leitor._cantos_qr(reduzida)
+            except cv2.error:
+                return None
+        return None if cantos is None else cantos / escala
+
+    def processar_frame(self, frame: OrigemImagem) -> Optional[str]:
+        """Payload AT lido neste frame, ou None (o estado fica pronto para o frame seguinte)"""
+        self.frames += 1
+        self.ultimo_uso = time.monotonic()
+        metricas = MetricasLeitura(self.ms_por_frame)
+        # Frames sem QR são a regra enquanto a câmara procura: não ensinam nada à ordenação das
+        # imagens fixas (a sessão guarda a sua própria tentativa vencedora)
+        metricas.aprender = False
+        with metricas.medir('carregar', modo='frame'):
+            gray = _ler_imagem(frame, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return None
+        if self._tamanho != gray.shape[:2]:
+            self._tamanho = gray.shape[:2]
+            self.cantos = None
+
+        caixa = self._recorte(gray)
+        if caixa is not None:
+            x0, y0, x1, y1 = caixa
+            dados_qr = self._tentar(gray[y0:y1, x0:x1], self._tentativas(self.TENTATIVAS_ROI), 'fluxo_roi_',
+                                    metricas)
+            if dados_qr:
+                return dados_qr
+        if metricas.esgotado():
+            return None
+
+        # O QR mudou de sítio (ou ainda não foi visto): localizar para este frame e os seguintes
+        cantos = self._localizar(gray, metricas)
+        if cantos is not None:
+            self.cantos, self._perdido = cantos, 0
+        else:
+            self._perdido += 1
+            if self._perdido >= self.MAX_FRAMES_PERDIDO:
+                self.cantos = None
+        nova = self._recorte(gray)
+        if nova is not None and not metricas.esgotado():
+            lado = max(nova[2] - nova[0], nova[3] - nova[1])
+            if caixa is None or max(abs(a - b) for a, b in zip(caixa, nova)) > lado * self.DESLOCAMENTO_MINIMO:
+                x0, y0, x1, y1 = nova
+                return self._tentar(gray[y0:y1, x0:x1], self._tentativas(self.TENTATIVAS_ROI), 'fluxo_roi_',
+                                    metricas)
+        elif nova is None and not metricas.esgotado():
+            return self._tentar(gray, self._tentativas(1), 'fluxo_', metricas)
+        return None
+
+    def resumo(self) -> Dict:
+        return {'frames': self.frames, 'ms': round((time.perf_counter() - self.inicio) * 1000, 1),
+                'variante': self.tentativa[0] if self.tentativa else None,
+                'backend': self.tentativa[1] if self.tentativa else None}
+
+
+def _fim_jpeg(buffer: bytearray, inicio: int) -> int:
+    """
+    Posição a seguir ao EOI do JPEG que começa em `inicio` (SOI), ou -1 se ainda não chegou
+    inteiro. Os segmentos são saltados pelo seu comprimento até ao SOS e só os dados comprimidos
+    são procurados por FF D9: a miniatura EXIF (APP1) traz o seu próprio SOI/EOI. Um marcador
+    inválido faz voltar à procura simples do primeiro FF D9.
+    """
+    pos = inicio + 2
+    while True:
+        while pos + 1 < len(buffer) and buffer[pos] == 0xFF and buffer[pos + 1] == 0xFF:
+            pos += 1   # bytes de enchimento antes de um marcador
+        if pos + 1 >= len(buffer):
+            return -1
+        if buffer[pos] != 0xFF:
+            fim = buffer.find(b'\xff\xd9', pos)
+            return fim + 2 if fim >= 0 else -1
+        marcador = buffer[pos + 1]
+        if marcador == 0xD9:
+            return pos + 2
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:
+            pos += 2
+            continue
+        if pos + 4 > len(buffer):
+            return -1
+        pos += 2 + (buffer[pos + 2] << 8 | buffer[pos + 3])
+        if marcador != 0xDA:
+            continue
+        # Dados comprimidos do scan: FF 00 é um byte FF e FF D0-D7 são reinícios; qualquer outro
+        # marcador acaba o scan (EOI, ou DHT/SOS seguintes de um JPEG progressivo)
+        while True:
+            pos = buffer.find(b'\xff', pos)
+            if pos < 0 or pos + 1 >= len(buffer):
+                return -1
+            seguinte = buffer[pos + 1]
+            if seguinte == 0x00 or 0xD0 <= seguinte <= 0xD7 or seguinte == 0xFF:
+                pos += 1 if seguinte == 0xFF else 2
+                continue
+            break
+
+
+def _frames_de_fluxo(entrada) -> Iterator[bytes]:
+    """
+    Frames JPEG de um stream binário: MJPEG (JPEG concatenados, com ou sem cabeçalhos
+    multipart entre eles) ou JPEG com o tamanho à frente (4 bytes big-endian). O formato é
+    detetado pelos primeiros bytes. Lê só o que já chegou, por isso cada frame é entregue
+    logo que está completo.
+    """
+    ler = getattr(entrada, 'read1', entrada.read)
+    buffer = bytearray()
+    while len(buffer) < 4:
+        bloco = ler(65536)
+        if not bloco:
+            return
+        buffer += bloco
+
+    if buffer[:2] == b'\xff\xd8' or buffer[:2] == b'--' or buffer[:1].isalpha():
+        # MJPEG: do SOI (FF D8) ao EOI do mesmo JPEG (ver _fim_jpeg); o que está entre frames é ignorado
+        while True:
+            inicio = buffer.find(b'\xff\xd8')
+            fim = _fim_jpeg(buffer, inicio) if inicio >= 0 else -1
+            if fim >= 0:
+                yield bytes(buffer[inicio:fim])
+                del buffer[:fim]
+                continue
+            if inicio > 0:
+                del buffer[:inicio]
+            bloco = ler(65536)
+            if not bloco:
+                return
+            buffer += bloco
+
+    while True:
+        while len(buffer) < 4:
+            bloco = ler(65536)
+            if not bloco:
+                return
+            buffer += bloco
+        tamanho = struct.unpack('>I', bytes(buffer[:4]))[0]
+        while len(buffer) < 4 + tamanho:
+            bloco = ler(max(65536, 4 + tamanho - len(buffer)))
+            if not bloco:
+                return
+            buffer += bloco
+        yield bytes(buffer[4:4 + tamanho])
+        del buffer[:4 + tamanho]
+
+
+def _obter_opcao(args: List[str], nome: str, default: Optional[str] = None) -> Optional[str]:
+    """Devolve o valor que segue a opção `nome` na lista de argumentos (ou o default)"""
+    if nome in args:
+        indice = args.index(nome)
+        if indice + 1 < len(args):
+            return args[indice + 1]
+    return default
+
+
+def _opcoes_leitor(args: List[str]) -> Dict:
+    """
+    Opções do LeitorQRFaturaAT a partir da linha de comando (ou variáveis de ambiente):
+    --parallel (QR_PARALELO=1), --threads N (QR_MAX_THREADS), --no-cache (QR_CACHE=0),
+    --max-ms N (QR_MAX_MS), o prazo por imagem, --backends opencv,pyzbar,... (QR_BACKENDS),
+    --policy fastest-first|race|consensus (QR_POLITICA), --low-memory (QR_POUCA_MEMORIA=1)
+    ou --max-memory-mb N (QR_MEMORIA_MAX_MB), o modo de pouca memória com o seu orçamento, e
+    --tiles (QR_MOSAICO=1), a procura por ladrilhos sobrepostos em digitalizações grandes, e
+    --dedup (QR_DEDUP=1), que marca as faturas já lidas antes (ver IndiceFaturas), e
+    --profile-ms N (QR_PERFIL_MS) com --profile cprofile|amostras (QR_PERFIL), o perfil das
+    leituras que demoram pelo menos N ms (ver PerfilLeitura; só --profile: N = 1000)
+    """
+    opcoes = {}
+    if '--parallel' in args or os.environ.get('QR_PARALELO', '').lower() in ('1', 'true', 'sim'):
+        opcoes['paralelo'] = True
+    max_threads = _obter_opcao(args, '--threads', os.environ.get('QR_MAX_THREADS'))
+    if max_threads:
+        opcoes['max_threads'] = int(max_threads)
+    if '--no-cache' in args or os.environ.get('QR_CACHE', '').lower() in ('0', 'false', 'nao'):
+        opcoes['usar_cache'] = False
+    max_ms = _obter_opcao(args, '--max-ms', os.environ.get('QR_MAX_MS'))
+    if max_ms:
+        opcoes['max_ms'] = _validar_ms(max_ms, '--max-ms')
+    backends = _obter_opcao(args, '--backends', os.environ.get('QR_BACKENDS'))
+    if backends:
+        opcoes['backends'] = [nome.strip() for nome in backends.split(',') if nome.strip()]
+    politica = _obter_opcao(args, '--policy', os.environ.get('QR_POLITICA'))
+    if politica:
+        opcoes['politica'] = politica
+    max_memoria = _obter_opcao(args, '--max-memory-mb', os.environ.get('QR_MEMORIA_MAX_MB'))
+    if max_memoria:
+        opcoes['max_memoria_mb'] = float(max_memoria)
+    elif '--low-memory' in args or os.environ.get('QR_POUCA_MEMORIA', '').lower() in ('1', 'true', 'sim'):
+        opcoes['max_memoria_mb'] = LeitorQRFaturaAT.MEMORIA_POUCA_MB
+    if '--tiles' in args or os.environ.get('QR_MOSAICO', '').lower() in ('1', 'true', 'sim'):
+        opcoes['mosaico'] = True
+    if '--dedup' in args or os.environ.get('QR_DEDUP', '').lower() in ('1', 'true', 'sim'):
+        opcoes['usar_indice'] = True
+    perfil_ms = _obter_opcao(args, '--profile-ms', os.environ.get('QR_PERFIL_MS'))
+    perfil_modo = _obter_opcao(args, '--profile', os.environ.get('QR_PERFIL'))
+    if perfil_ms or perfil_modo:
+        opcoes['perfil_ms'] = float(perfil_ms or 1000)
+    if perfil_modo:
+        opcoes['perfil_modo'] = perfil_modo
+    return opcoes
+
+
+class ServidorQR:
+    """
+    Modo servidor: mantém leitores "quentes" e responde a pedidos JSON, um por linha.
+
+    Cada pedido é uma linha JSON no stdin:
+        {"id": "1", "image": "/caminho/imagem.png"}
+        {"id": "2", "text": "A:123456789*B:..."}
+    Cada resposta é uma linha JSON no stdout (pela ordem em que terminam):
+        {"id": "1", "ok": true, "result": {...}}
+        {"id": "2", "ok": false, "error": "..."}
+
+    Com "metrics": true num pedido de imagem a resposta inclui os tempos por etapa;
+    {"op": "metrics"} devolve os contadores acumulados no formato de texto do Prometheus.
+    "max_ms" num pedido de imagem limita o tempo de leitura; sem QR, a resposta traz
+    "not_found" com o motivo e as tentativas feitas. Com "multi": true o resultado é a
+    lista de todas as faturas da imagem (sem repetidas). Com o índice de faturas ligado
+    (--dedup), uma fatura já lida antes traz "duplicado" com a primeira leitura. Com
+    "profile": true (ou um limite em ms) a resposta traz "profile" com o perfil gravado.
+
+    Frames de câmara: {"id": "3", "stream": "s1", "frame_b64": "<JPEG em base64>"}. Os frames com
+    o mesmo "stream" partilham o estado (ver SessaoFluxo); enquanto não houver QR a resposta é
+    {"ok": false, "pending": true, "frames": N} ("skipped": true se o frame chegou com o anterior
+    ainda em curso e foi descartado). O primeiro QR AT devolve a fatura e fecha a sessão;
+    {"op": "stream_end", "stream": "s1"} fecha-a antes disso. "max_ms" (no primeiro frame) é o
+    prazo do fluxo inteiro, como nas outras leituras; "frame_ms" o tempo de cada frame.
+    """
+
+    # Sessões de frames sem pedidos há mais do que isto (s) são descartadas
+    TTL_FLUXOS_S = 60
+    # Pedidos em curso ou na fila por worker (ver servir)
+    MAX_PEDIDOS_POR_WORKER = 2
+
+    def __init__(self, num_workers: int = 2, opcoes_leitor: Optional[Dict] = None):
+        self.num_workers = max(1, num_workers)
+        self.opcoes_leitor = opcoes_leitor or {}
+        self._local = threading.local()
+        self._lock_saida = threading.Lock()
+        self._fluxos: Dict[str, SessaoFluxo] = {}
+        self._lock_fluxos = threading.Lock()
+
+    def _leitor(self) -> LeitorQRFaturaAT:
+        """Um LeitorQRFaturaAT por thread (QRCodeDetector não é thread-safe)"""
+        leitor = getattr(self._local, 'leitor', None)
+        if leitor is None:
+            leitor = LeitorQRFaturaAT(**self.opcoes_leitor)
+            self._local.leitor = leitor
+        return leitor
+
+    def _responder(self, resposta: Dict):
+        linha = json.dumps(resposta, ensure_ascii=False)
+        with self._lock_saida:
+            sys.stdout.write(linha + "\n")
+            sys.stdout.flush()
+
+    @staticmethod
+    def _processar_imagem(leitor: LeitorQRFaturaAT, origem: OrigemImagem, pedido: Dict):
+        # "profile": true perfila este pedido; um número grava o perfil só acima desses ms
+        perfil = pedido.get('profile')
+        perfil_ms = None if perfil in (None, False) else 0.0 if perfil is True else float(perfil)
+        if pedido.get('multi'):
+            return leitor.processar_faturas_multiplas(origem, pedido.get('max_ms'), perfil_ms)
+        return leitor.processar_fatura(origem, pedido.get('max_ms'), perfil_ms)
+
+    def _processar_frame(self, leitor: LeitorQRFaturaAT, pedido: Dict) -> Dict:
+        id_pedido = pedido.get('id')
+        id_fluxo = str(pedido['stream'])
+        try:
+            frame = base64.b64decode(pedido['frame_b64'], validate=True)
+        except (ValueError, TypeError):
+            return {'id': id_pedido, 'ok': False, 'error': "Campo 'frame_b64' não é base64 válido"}
+
+        agora = time.monotonic()
+        with self._lock_fluxos:
+            for chave in [chave for chave, sessao in self._fluxos.items()
+                          if agora - sessao.ultimo_uso > self.TTL_FLUXOS_S]:
+                del self._fluxos[chave]
+            sessao = self._fluxos.get(id_fluxo)
+            if sessao is None:
+                sessao = self._fluxos[id_fluxo] = SessaoFluxo(leitor, pedido.get('frame_ms'))
+                # Como nos outros pedidos, max_ms é o prazo da leitura inteira (aqui, do fluxo)
+                sessao.max_ms = pedido.get('max_ms') if pedido.get('max_ms') is not None else leitor.max_ms
+
+        decorrido_ms = (time.perf_counter() - sessao.inicio) * 1000
+        if sessao.max_ms is not None and decorrido_ms >= sessao.max_ms:
+            with self._lock_fluxos:
+                self._fluxos.pop(id_fluxo, None)
+            return {'id': id_pedido, 'ok': False, 'stream': sessao.resumo(),
+                    'error': f"Tempo limite de leitura excedido ({sessao.max_ms:.0f} ms)"}
+
+        # Um frame de cada vez por sessão; os que chegam entretanto são descartados (o seguinte é mais recente)
+        if not sessao.lock.acquire(blocking=False):
+            return {'id': id_pedido, 'ok': False, 'pending': True, 'skipped': True, 'frames': sessao.frames}
+        try:
+            dados_qr = sessao.processar_frame(frame)
+        finally:
+            sessao.lock.release()
+        if not dados_qr:
+            return {'id': id_pedido, 'ok': False, 'pending': True, 'frames': sessao.frames}
+        with self._lock_fluxos:
+            self._fluxos.pop(id_fluxo, None)
+        fatura = leitor.verificar_duplicado(leitor.descodificar_qr_fatura(dados_qr))
+        return {'id': id_pedido, 'ok': True, 'result': fatura, 'stream': sessao.resumo()}
+
+    def processar_pedido(self, pedido: Dict) -> Dict:
+        """Processa um pedido já descodificado e devolve a resposta (sem a escrever)"""
+        id_pedido = pedido.get('id')
+        try:
+            pedido = dict(pedido, max_ms=_validar_ms(pedido.get('max_ms')))
+            perfil = pedido.get('profile')
+            if perfil not in (None, True, False):
+                pedido['profile'] = _validar_ms(perfil, 'profile')
+            if 'frame_ms' in pedido:
+                pedido['frame_ms'] = _validar_ms(pedido['frame_ms'], 'frame_ms')
+        except ValueError as e:
+            return {'id': id_pedido, 'ok': False, 'error': str(e)}
+        try:
+            leitor = self._leitor()
+            leitor.ultimas_metricas = None
+            leitor.ultimo_perfil = None
+            if 'text' in pedido:
+                fatura = leitor.verificar_duplicado(leitor.descodificar_qr_fatura(str(pedido['text']).strip()),
+                                                    'texto')
+            elif 'image' in pedido:
+                if not os.path.exists(pedido['image']):
+                    return {'id': id_pedido, 'ok': False,
+                            'error': f"Ficheiro de imagem não encontrado: {pedido['image']}"}
+                fatura = self._processar_imagem(leitor, pedido['image'], pedido)
+            elif 'image_b64' in pedido:
+                try:
+                    conteudo = base64.b64decode(pedido['image_b64'], validate=True)
+                except (ValueError, TypeError):
+                    return {'id': id_pedido, 'ok': False, 'error': "Campo 'image_b64' não é base64 válido"}
+                fatura = self._processar_imagem(leitor, conteudo, pedido)
+            elif 'frame_b64' in pedido and 'stream' in pedido:
+                return self._processar_frame(leitor, pedido)
+            elif pedido.get('op') == 'stream_end':
+                with self._lock_fluxos:
+                    sessao = self._fluxos.pop(str(pedido.get('stream')), None)
+                return {'id': id_pedido, 'ok': True, 'result': sessao.resumo() if sessao else None}
+            elif pedido.get('op') == 'ping':
+                return {'id': id_pedido, 'ok': True, 'result': 'pong'}
+            elif pedido.get('op') == 'metrics':
+                return {'id': id_pedido, 'ok': True, 'result': RegistoMetricas.partilhado().para_prometheus()}
+            else:
+                return {'id': id_pedido, 'ok': False, 'error': "Pedido sem 'image', 'image_b64' nem 'text'"}
+
+            if not fatura:
+                resposta = {'id': id_pedido, 'ok': False, 'error': "QR Code não encontrado ou ilegível."}
+                nao_encontrado = leitor.resumo_nao_encontrado()
+                if nao_encontrado:
+                    resposta['not_found'] = nao_encontrado
+                    if nao_encontrado['motivo'] == 'prazo_esgotado':
+                        resposta['error'] = f"Tempo limite de leitura excedido ({nao_encontrado['max_ms']:.0f} ms)"
+            else:
+                resposta = {'id': id_pedido, 'ok': True, 'result': fatura}
+            if pedido.get('metrics') and leitor.ultimas_metricas is not None:
+                resposta['metrics'] = leitor.ultimas_metricas.para_dict()
+            if leitor.ultimo_perfil is not None:
+                resposta['profile'] = leitor.ultimo_perfil
+            return resposta
+        except Exception as e:
+            import traceback
+            traceback.print_exc(file=sys.stderr)
+            return {'id': id_pedido, 'ok': False,
+                    'error': f"Ocorreu um erro inesperado no script Python: {str(e)}"}
+
+    def _tratar_linha(self, linha: str, chegada: Optional[float] = None):
+        try:
+            pedido = json.loads(linha)
+            if not isinstance(pedido, dict):
+                raise ValueError("o pedido tem de ser um objeto JSON")
+        except ValueError as e:
+            self._responder({'id': None, 'ok': False, 'error': f"Pedido JSON inválido: {e}"})
+            return
+        max_ms = pedido.get('max_ms')
+        if chegada is not None and isinstance(max_ms, (int, float)) and not isinstance(max_ms, bool):
+            espera_ms = (time.monotonic() - chegada) * 1000
+            if espera_ms >= max_ms:
+                # O cliente já desistiu (lib/qrWorker.ts envia max_ms abaixo do seu tempo limite)
+                self._responder({'id': pedido.get('id'), 'ok': False,
+                                 'error': f"Tempo limite de leitura excedido ({max_ms:.0f} ms) "
+                                          f"antes de o pedido começar ({espera_ms:.0f} ms na fila)"})
+                return
+        self._responder(self.processar_pedido(pedido))
+
+    def servir(self, entrada=None):
+        """
+        Lê pedidos até EOF, distribuindo-os pelo pool de workers. Só há MAX_PEDIDOS_POR_WORKER x
+        num_workers pedidos em curso ou na fila, como no modo lote: com todas as vagas ocupadas o
+        stdin deixa de ser lido e os pedidos seguintes esperam no pipe, em vez de acumularem em
+        memória. Um pedido que passa mais de max_ms na fila é recusado sem ser lido.
+        """
+        entrada = entrada or sys.stdin
+        _log(f"Servidor QR iniciado com {self.num_workers} worker(s)")
+        self._responder({'ready': True, 'workers': self.num_workers})
+
+        vagas = threading.BoundedSemaphore(self.num_workers * self.MAX_PEDIDOS_POR_WORKER)
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix='qr-worker') as pool:
+            for linha in entrada:
+                linha = linha.strip()
+                if linha:
+                    vagas.acquire()
+                    futuro = pool.submit(self._tratar_linha, linha, time.monotonic())
+                    futuro.add_done_callback(lambda _: vagas.release())
+
+
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+# PDFs são lidos diretamente (imagens embutidas, ver DocumentoPDF)
+EXTENSOES_PDF = ('.pdf',)
+
+# Leitor de cada processo do pool do modo lote (criado em _iniciar_worker_lote)
+_leitor_lote: Optional[LeitorQRFaturaAT] = None
+# Se True, cada linha de resultado do lote inclui as métricas da leitura
+_metricas_lote = False
+# Se True, cada imagem pode ter várias faturas (result passa a ser uma lista)
+_multi_lote = False
+
+
+def _listar_entradas_lote(origem: str) -> Iterator[str]:
+    """
+    Ficheiros a processar no modo lote, gerados de forma preguiçosa:
+    uma diretoria (recursiva), um padrão glob ('faturas/*.jpg') ou '@lista.txt' com um caminho por linha.
+    """
+    if origem.startswith('@'):
+        with open(origem[1:], 'r', encoding='utf-8') as f:
+            for linha in f:
+                linha = linha.strip()
+                if linha and not linha.startswith('#'):
+                    yield linha
+    elif os.path.isdir(origem):
+        for raiz, diretorias, ficheiros in os.walk(origem):
+            diretorias.sort()
+            for nome in sorted(ficheiros):
+                if nome.lower().endswith(EXTENSOES_IMAGEM + EXTENSOES_PDF):
+                    yield os.path.join(raiz, nome)
+    else:
+        for caminho in sorted(glob.iglob(origem, recursive=True)):
+            if os.path.isfile(caminho):
+                yield caminho
+
+
+def _iniciar_worker_lote(opcoes_leitor: Dict, com_metricas: bool = False, multi: bool = False):
+    global _leitor_lote, _metricas_lote, _multi_lote
+    _leitor_lote = LeitorQRFaturaAT(**opcoes_leitor)
+    _metricas_lote = com_metricas
+    _multi_lote = multi
+
+
+def _processar_item_lote(caminho: str) -> Dict:
+    """Processa uma imagem num worker do pool e devolve a linha de resultado do lote"""
+    inicio = time.perf_counter()
+    resultado = {'file': caminho, 'ok': False}
+    try:
+        if not os.path.exists(caminho):
+            resultado['error'] = f"Ficheiro de imagem não encontrado: {caminho}"
+        elif _multi_lote:
+            faturas = _leitor_lote.processar_faturas_multiplas(caminho)
+            resultado['ok'] = bool(faturas)
+            resultado['result'] = faturas
+            if not faturas:
+                resultado['error'] = "QR Code não encontrado ou ilegível."
+        else:
+            fatura = _leitor_lote.processar_fatura(caminho)
+            if fatura:
+                resultado['ok'] = 'erro' not in fatura
+                resultado['result'] = fatura
+                if 'erro' in fatura:
+                    resultado['error'] = fatura['erro']
+            else:
+                resultado['error'] = "QR Code não encontrado ou ilegível."
+                nao_encontrado = _leitor_lote.resumo_nao_encontrado()
+                if nao_encontrado:
+                    resultado['not_found'] = nao_encontrado
+    except Exception as e:
+        resultado['error'] = f"Ocorreu um erro inesperado no script Python: {str(e)}"
+    resultado['time_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    if _leitor_lote is not None and _leitor_lote.ultimo_perfil is not None:
+        resultado['profile'] = _leitor_lote.ultimo_perfil
+        _leitor_lote.ultimo_perfil = None
+    if _metricas_lote and _leitor_lote is not None and _leitor_lote.ultimas_metricas is not None:
+        resultado['metrics'] = _leitor_lote.ultimas_metricas.para_dict()
+        _leitor_lote.ultimas_metricas = None
+    return resultado
+
+
+def _resultado_lote(futuro, caminho: str) -> Dict:
+    """Linha de resultado de um futuro do pool; a exceção de um worker que falhou vira uma linha de erro"""
+    try:
+        return futuro.result()
+    except Exception as e:
+        return {'file': caminho, 'ok': False, 'error': f"O worker do lote falhou: {e}"}
+
+
+def _terminados_lote(pool, em_curso: Dict, criar_pool: Callable, timeout: Optional[float] = None):
+    """
+    Espera pelos futuros que terminam primeiro e devolve (terminados, pool). Um worker que morre
+    (sinal, falta de memória, crash numa biblioteca nativa) parte o pool inteiro: as imagens em
+    curso falham todas e o lote continua num pool novo.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    terminados, _ = wait(em_curso, timeout=timeout, return_when=FIRST_COMPLETED)
+    if any(isinstance(futuro.exception(), BrokenProcessPool) for futuro in terminados):
+        terminados, _ = wait(em_curso)
+        print(f"Aviso: um worker do lote terminou de forma inesperada; {len(terminados)} ficheiro(s) "
+              f"em curso marcados como falhados, a recriar o pool", file=sys.stderr)
+        pool.shutdown(wait=False)
+        pool = criar_pool()
+    return terminados, pool
+
+
+def _ficheiros_ja_processados(caminho_saida: str) -> set:
+    """Caminhos já presentes num JSONL de saída (para --resume); ignora uma última linha truncada"""
+    processados = set()
+    if not os.path.exists(caminho_saida):
+        return processados
+    with open(caminho_saida, 'r', encoding='utf-8') as f:
+        for linha in f:
+            try:
+                processados.add(json.loads(linha)['file'])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return processados
+
+
+def _faturas_de_jsonl(caminho: str) -> Iterator[Tuple[Dict, str]]:
+    """
+    Faturas (fatura, origem) de um JSONL: linhas de resultado do modo lote ('result' é uma
+    fatura ou uma lista delas, com 'file') ou uma fatura por linha. Linhas inválidas são ignoradas.
+    """
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for linha in f:
+            try:
+                registo = json.loads(linha)
+            except ValueError:
+                continue
+            if not isinstance(registo, dict):
+                continue
+            if 'result' in registo:
+                faturas = registo['result'] if isinstance(registo['result'], list) else [registo['result']]
+                origem = registo.get('file') or ''
+            else:
+                faturas, origem = [registo], ''
+            for fatura in faturas:
+                if isinstance(fatura, dict):
+                    yield fatura, origem
+
+
+def carregar_indice(caminho_jsonl: str, caminho_indice: Optional[str] = None) -> Dict:
+    """
+    Carrega no índice de faturas os resultados de lotes anteriores (ver _faturas_de_jsonl),
+    numa só transação. As faturas já indexadas mantêm a primeira leitura.
+    """
+    inicio = time.perf_counter()
+    # Instância própria (não a partilhada): os workers do lote não herdam a ligação SQLite
+    indice = IndiceFaturas(caminho_indice if caminho_indice is not None else IndiceFaturas.caminho_padrao())
+    try:
+        novas = indice.carregar_lote(_faturas_de_jsonl(caminho_jsonl))
+        resumo = {'novas': novas, 'total': len(indice)}
+    finally:
+        indice.fechar()
+    resumo['tempo_s'] = round(time.perf_counter() - inicio, 2)
+    return resumo
+
+
+def _relatorio_perfis(perfis: List[Tuple[str, float, str]], n: int = 25) -> Optional[str]:
+    """Grava em PerfilLeitura.DIRETORIA o relatório das leituras lentas do lote e devolve o caminho"""
+    caminho = os.path.join(PerfilLeitura.DIRETORIA, f"lote_{datetime.now():%Y%m%d-%H%M%S}_{os.getpid()}.txt")
+    linhas = [f"{len(perfis)} leitura(s) lenta(s), da mais lenta para a mais rápida:"]
+    linhas += [f"{ms:10.0f} ms  {ficheiro}  ->  {perfil}" for ficheiro, ms, perfil in sorted(perfis, key=lambda p: -p[1])]
+    try:
+        relatorio = '\n'.join(linhas) + '\n\n' + PerfilLeitura.resumo([perfil for _, _, perfil in perfis], n)
+        with open(caminho, 'w', encoding='utf-8') as f:
+            f.write(relatorio)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Aviso: não foi possível gravar o relatório de perfis: {e}", file=sys.stderr)
+        return None
+    return caminho
+
+
+def processar_lote(origem: str, caminho_saida: Optional[str] = None, num_workers: Optional[int] = None,
+                   retomar: bool = False, opcoes_leitor: Optional[Dict] = None,
+                   formato_metricas: Optional[str] = None, multi: bool = False) -> Dict:
+    """
+    Processa muitas faturas num pool de processos, escrevendo uma linha JSON por fatura
+    (no stdout ou em caminho_saida) assim que cada uma termina.
+
+    Só há 2 x num_workers imagens em curso de cada vez, por isso a memória fica constante
+    mesmo com milhares de ficheiros. Com retomar=True os ficheiros já presentes no JSONL
+    de saída são ignorados e os novos resultados são acrescentados.
+
+    formato_metricas='json' acrescenta as métricas de cada leitura à sua linha; 'prometheus'
+    acumula-as e escreve os contadores/histogramas do lote no stderr no fim.
+    Com multi=True cada imagem pode conter várias faturas ('result' é uma lista). Com o
+    índice de faturas ligado (usar_indice nas opções), o resumo conta as faturas repetidas.
+    Com perfil_ms nas opções, os perfis das leituras lentas são juntos num relatório com os
+    pontos quentes do lote (ver PerfilLeitura.resumo). Uma imagem cujo worker falha fica com
+    uma linha de erro e o lote continua (ver _terminados_lote).
+    """
+    # multiprocessing só é importado no modo lote (arranque mais rápido nos outros modos)
+    from concurrent.futures import ProcessPoolExecutor
+
+    num_workers = num_workers or os.cpu_count() or 1
+    ja_processados = _ficheiros_ja_processados(caminho_saida) if (retomar and caminho_saida) else set()
+    if ja_processados:
+        print(f"A retomar: {len(ja_processados)} ficheiro(s) já processados", file=sys.stderr)
+
+    if caminho_saida:
+        saida = open(caminho_saida, 'a' if retomar else 'w', encoding='utf-8')
+        if retomar and saida.tell() > 0:
+            # Garantir que uma linha interrompida não fica colada à seguinte
+            with open(caminho_saida, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    saida.write('\n')
+    else:
+        saida = sys.stdout
+
+    resumo = {'total': 0, 'ok': 0, 'falhas': 0, 'ignorados': 0}
+    if (opcoes_leitor or {}).get('usar_indice'):
+        resumo['duplicados'] = 0
+    registo = RegistoMetricas() if formato_metricas else None
+    perfis: List[Tuple[str, float, str]] = []
+    inicio = time.perf_counter()
+    entradas = _listar_entradas_lote(origem)
+
+    def criar_pool():
+        return ProcessPoolExecutor(max_workers=num_workers, initializer=_iniciar_worker_lote,
+                                   initargs=(opcoes_leitor or {}, bool(formato_metricas), multi))
+
+    pool = criar_pool()
+    try:
+        em_curso: Dict = {}
+        esgotado = False
+        while em_curso or not esgotado:
+            # Manter a fila cheia, mas limitada
+            while not esgotado and len(em_curso) < num_workers * 2:
+                caminho = next(entradas, None)
+                if caminho is None:
+                    esgotado = True
+                elif caminho in ja_processados:
+                    resumo['ignorados'] += 1
+                else:
+                    em_curso[pool.submit(_processar_item_lote, caminho)] = caminho
+            if not em_curso:
+                break
+
+            terminados, pool = _terminados_lote(pool, em_curso, criar_pool)
+            for futuro in terminados:
+                resultado = _resultado_lote(futuro, em_curso.pop(futuro))
+                resumo['total'] += 1
+                resumo['ok' if resultado['ok'] else 'falhas'] += 1
+                if 'duplicados' in resumo:
+                    faturas = resultado.get('result')
+                    faturas = faturas if isinstance(faturas, list) else [faturas]
+                    resumo['duplicados'] += sum(1 for fatura in faturas
+                                                if isinstance(fatura, dict) and 'duplicado' in fatura)
+                if resultado.get('profile', {}).get('perfil'):
+                    perfis.append((resultado['file'], resultado['profile']['ms'], resultado['profile']['perfil']))
+                if registo is not None and 'metrics' in resultado:
+                    registo.acumular(resultado['metrics'])
+                    if formato_metricas != 'json':
+                        del resultado['metrics']
+                saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+                saida.flush()
+    finally:
+        pool.shutdown(cancel_futures=True)
+        if saida is not sys.stdout:
+            saida.close()
+
+    resumo['tempo_s'] = round(time.perf_counter() - inicio, 2)
+    if perfis:
+        resumo['perfis'] = len(perfis)
+        resumo['relatorio_perfis'] = _relatorio_perfis(perfis)
+    print(f"Lote concluído: {json.dumps(resumo, ensure_ascii=False)}", file=sys.stderr)
+    if registo is not None and formato_metricas == 'prometheus':
+        sys.stderr.write(registo.para_prometheus())
+    return resumo
+
+
+def _iniciar_worker_ingestao(opcoes_leitor: Dict, multi: bool = False):
+    # Ctrl+C chega a todo o grupo de processos: só o processo principal decide quando parar
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _iniciar_worker_lote(opcoes_leitor, False, multi)
+
+
+class IngestaoContinua:
+    """
+    Modo de ingestão contínua: vigia uma ou mais diretorias (polling, recursivo) e processa cada
+    fatura nova num pool limitado de processos, sem lançar um processo por ficheiro.
+
+    Um ficheiro só é processado quando o tamanho e a data de modificação não mudam entre duas
+    passagens e já passaram QUIETO_S segundos desde a última escrita (scanners e gateways de
+    email escrevem aos poucos). Os resultados vão para um JSONL (as linhas do modo lote) ou um
+    CSV (uma linha por fatura) e cada ficheiro terminado fica no checkpoint (caminho, tamanho e
+    data de modificação), por isso um reinício não repete nada e um ficheiro substituído com o
+    mesmo nome volta a ser lido.
+    """
+
+    INTERVALO_S = float(os.environ.get('QR_WATCH_INTERVALO', '2'))
+    QUIETO_S = float(os.environ.get('QR_WATCH_QUIETO', '2'))
+    # Ficheiros ainda a ser copiados/descarregados por outros programas
+    SUFIXOS_TEMPORARIOS = ('.tmp', '.part', '.partial', '.crdownload', '.swp', '.filepart')
+
+    COLUNAS_CSV = ('file', 'ok', 'error', 'time_ms', 'nif_emitente', 'nif_adquirente', 'data_emissao',
+                   'tipo_documento', 'numero_documento', 'atcud', 'valor_total', 'total_iva_calculado',
+                   'hash', 'duplicado', 'raw_data')
+
+    def __init__(self, diretorias: List[str], caminho_saida: Optional[str] = None,
+                 num_workers: Optional[int] = None, opcoes_leitor: Optional[Dict] = None, multi: bool = False,
+                 caminho_checkpoint: Optional[str] = None, intervalo: Optional[float] = None,
+                 quieto: Optional[float] = None):
+        self.diretorias = [os.path.abspath(diretoria) for diretoria in diretorias]
+        self.caminho_saida = caminho_saida
+        self.csv = bool(caminho_saida) and caminho_saida.lower().endswith('.csv')
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.opcoes_leitor = opcoes_leitor or {}
+        self.multi = multi
+        # Sem --checkpoint, o checkpoint fica ao lado da saída; sem saída (stdout), só em memória
+        self.caminho_checkpoint = caminho_checkpoint or (f"{caminho_saida}.checkpoint" if caminho_saida else None)
+        self.intervalo = self.INTERVALO_S if intervalo is None else intervalo
+        self.quieto = self.QUIETO_S if quieto is None else quieto
+
+        self._processados: set = set()
+        # Última observação de cada ficheiro por processar: caminho -> (tamanho, mtime_ns)
+        self._observados: Dict[str, Tuple[int, int]] = {}
+        self._parar = threading.Event()
+        self.resumo = {'total': 0, 'ok': 0, 'falhas': 0}
+
+    @staticmethod
+    def _chave(caminho: str, tamanho: int, mtime_ns: int) -> str:
+        return f"{caminho}|{tamanho}|{mtime_ns}"
+
+    def _carregar_checkpoint(self):
+        """Lê o checkpoint e compacta-o, deixando só os ficheiros que ainda existem"""
+        if not self.caminho_checkpoint or not os.path.exists(self.caminho_checkpoint):
+            return
+        entradas = []
+        with open(self.caminho_checkpoint, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    entrada = json.loads(linha)
+                    entradas.append((entrada['file'], int(entrada['size']), int(entrada['mtime_ns'])))
+                except (ValueError, KeyError, TypeError):
+                    continue  # última linha truncada por uma paragem a meio
+        atuais = [entrada for entrada in entradas if os.path.exists(entrada[0])]
+        self._processados = {self._chave(*entrada) for entrada in atuais}
+        if len(atuais) < len(entradas):
+            temporario = f"{self.caminho_checkpoint}.{os.getpid()}.tmp"
+            with open(temporario, 'w', encoding='utf-8') as f:
+                for caminho, tamanho, mtime_ns in atuais:
+                    f.write(json.dumps({'file': caminho, 'size': tamanho, 'mtime_ns': mtime_ns},
+                                       ensure_ascii=False) + '\n')
+            os.replace(temporario, self.caminho_checkpoint)
+        _log(f"Checkpoint: {len(self._processados)} ficheiro(s) já processados")
+
+    def _listar(self) -> Iterator[Tuple[str, os.stat_result]]:
+        for diretoria in self.diretorias:
+            for raiz, diretorias, ficheiros in os.walk(diretoria):
+                diretorias[:] = sorted(nome for nome in diretorias if not nome.startswith('.'))
+                for nome in sorted(ficheiros):
+                    minusculo = nome.lower()
+                    if nome.startswith('.') or minusculo.endswith(self.SUFIXOS_TEMPORARIOS):
+                        continue
+                    if not minusculo.endswith(EXTENSOES_IMAGEM + EXTENSOES_PDF):
+                        continue
+                    caminho = os.path.join(raiz, nome)
+                    try:
+                        yield caminho, os.stat(caminho)
+                    except OSError:
+                        continue  # removido entre o walk e o stat
+
+    def _prontos(self) -> List[Tuple[str, str, Tuple[int, int]]]:
+        """Ficheiros novos que já não estão a ser escritos: (caminho, chave, (tamanho, mtime_ns))"""
+        agora = time.time()
+        prontos = []
+        observados = {}
+        for caminho, info in self._listar():
+            estado = (info.st_size, info.st_mtime_ns)
+            chave = self._chave(caminho, *estado)
+            if chave in self._processados:
+                continue
+            if (self._observados.get(caminho) == estado and info.st_size > 0
+                    and agora - info.st_mtime >= self.quieto):
+                prontos.append((caminho, chave, estado))
+            else:
+                observados[caminho] = estado
+        self._observados = observados
+        return prontos
+
+    def _linhas_csv(self, resultado: Dict) -> List[Dict]:
+        faturas = resultado.get('result')
+        faturas = faturas if isinstance(faturas, list) else [faturas or {}]
+        linhas = []
+        for fatura in faturas or [{}]:
+            linha = {coluna: fatura.get(coluna) for coluna in self.COLUNAS_CSV}
+            linha.update(file=resultado['file'], ok=resultado['ok'], error=resultado.get('error'),
+                         time_ms=resultado.get('time_ms'), duplicado='duplicado' in fatura)
+            linhas.append(linha)
+        return linhas
+
+    def parar(self):
+        """Pede o fim da ingestão: os ficheiros em curso terminam e ficam no checkpoint"""
+        self._parar.set()
+
+    def executar(self) -> Dict:
+        """Vigia as diretorias até parar() (ou SIGTERM / Ctrl+C) e devolve o resumo"""
+        import csv
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        if threading.current_thread() is threading.main_thread():
+            import signal
+            signal.signal(signal.SIGTERM, lambda *_: self.parar())
+
+        self._carregar_checkpoint()
+        checkpoint = open(self.caminho_checkpoint, 'a', encoding='utf-8') if self.caminho_checkpoint else None
+        if self.caminho_saida:
+            saida = open(self.caminho_saida, 'a', encoding='utf-8', newline='' if self.csv else None)
+        else:
+            saida = sys.stdout
+        escritor_csv = None
+        if self.csv:
+            escritor_csv = csv.DictWriter(saida, fieldnames=self.COLUNAS_CSV)
+            if saida.tell() == 0:
+                escritor_csv.writeheader()
+
+        _log(f"A vigiar {', '.join(self.diretorias)} (a cada {self.intervalo:g} s, "
+             f"{self.num_workers} worker(s))")
+        fila: 'deque[Tuple[str, str, Tuple[int, int]]]' = deque()
+        em_fila = set()
+        em_curso: Dict = {}
+        proxima_passagem = 0.0
+
+        def criar_pool():
+            return ProcessPoolExecutor(max_workers=self.num_workers, initializer=_iniciar_worker_ingestao,
+                                       initargs=(self.opcoes_leitor, self.multi))
+
+        pool = criar_pool()
+        try:
+            while not self._parar.is_set() or em_curso:
+                try:
+                    if not self._parar.is_set() and time.monotonic() >= proxima_passagem:
+                        for item in self._prontos():
+                            if item[1] not in em_fila:
+                                em_fila.add(item[1])
+                                fila.append(item)
+                        proxima_passagem = time.monotonic() + self.intervalo
+                    # Só 2 x num_workers ficheiros em curso; os restantes esperam na fila
+                    while fila and len(em_curso) < self.num_workers * 2 and not self._parar.is_set():
+                        item = fila.popleft()
+                        em_curso[pool.submit(_processar_item_lote, item[0])] = item
+
+                    espera = max(0.0, proxima_passagem - time.monotonic())
+                    if not em_curso:
+                        self._parar.wait(espera)
+                        continue
+                    terminados, pool = _terminados_lote(pool, em_curso, criar_pool, espera)
+                    for futuro in terminados:
+                        caminho, chave, (tamanho, mtime_ns) = em_curso.pop(futuro)
+                        em_fila.discard(chave)
+                        resultado = _resultado_lote(futuro, caminho)
+                        self.resumo['total'] += 1
+                        self.resumo['ok' if resultado['ok'] else 'falhas'] += 1
+                        if escritor_csv is not None:
+                            escritor_csv.writerows(self._linhas_csv(resultado))
+                        else:
+                            saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+                        saida.flush()
+                        # Checkpoint só depois do resultado escrito: uma paragem entre os dois
+                        # repete o ficheiro, nunca o perde
+                        self._processados.add(chave)
+                        if checkpoint is not None:
+                            checkpoint.write(json.dumps({'file': caminho, 'size': tamanho, 'mtime_ns': mtime_ns},
+                                                        ensure_ascii=False) + '\n')
+                            checkpoint.flush()
+                except KeyboardInterrupt:
+                    self.parar()
+        finally:
+            pool.shutdown(cancel_futures=True)
+            if saida is not sys.stdout:
+                saida.close()
+            if checkpoint is not None:
+                checkpoint.close()
+
+        print(f"Ingestão terminada: {json.dumps(self.resumo)}", file=sys.stderr)
+        return self.resumo
+
+
 def main():
     """
     Função principal que lê a imagem de um ficheiro OU texto QR e escreve o resultado JSON para ficheiro.
     """
-    leitor = LeitorQRFaturaAT()
+    # --quiet: sem mensagens de progresso (também nos workers do modo lote)
+    if '--quiet' in sys.argv:
+        os.environ['QR_QUIET'] = '1'
+        definir_silencioso(True)
+    # --metrics json|prometheus: tempos por etapa no stderr (modo lote: ver processar_lote)
+    formato_metricas = _obter_opcao(sys.argv, '--metrics')
+    if formato_metricas not in (None, 'json', 'prometheus'):
+        print(json.dumps({"error": f"Formato de métricas desconhecido: {formato_metricas} (json ou prometheus)"}))
+        sys.exit(1)
+    perfil_modo = _obter_opcao(sys.argv, '--profile', os.environ.get('QR_PERFIL'))
+    if perfil_modo not in (None, *PerfilLeitura.MODOS):
+        print(json.dumps({"error": f"Modo de perfil desconhecido: {perfil_modo} ({', '.join(PerfilLeitura.MODOS)})"}))
+        sys.exit(1)
+    politica = _obter_opcao(sys.argv, '--policy', os.environ.get('QR_POLITICA'))
+    if politica not in (None, *LeitorQRFaturaAT.POLITICAS):
+        print(json.dumps({"error": f"Política desconhecida: {politica} ({', '.join(LeitorQRFaturaAT.POLITICAS)})"}))
+        sys.exit(1)
+
+    try:
+        opcoes_leitor = _opcoes_leitor(sys.argv)
+    except ValueError as e:
+        print(json.dumps({"error": f"Opção inválida: {e}"}, ensure_ascii=False))
+        sys.exit(1)
+
+    # Modo servidor: processo de longa duração com pedidos JSON por linha no stdin/stdout
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        num_workers = int(_obter_opcao(sys.argv, '--workers', os.environ.get('QR_WORKERS', '2')))
+        ServidorQR(num_workers, opcoes_leitor).servir()
+        return
+
+    # --index-load resultados.jsonl: carrega lotes anteriores no índice de faturas (sozinho ou antes de --batch)
+    caminho_carga = _obter_opcao(sys.argv, '--index-load')
+    if caminho_carga:
+        if not os.path.exists(caminho_carga):
+            print(json.dumps({"error": f"Ficheiro JSONL não encontrado: {caminho_carga}"}))
+            sys.exit(1)
+        print(f"Índice de faturas carregado: {json.dumps(carregar_indice(caminho_carga))}", file=sys.stderr)
+        if sys.argv[1] == '--index-load':
+            return
+
+    # Modo lote: diretoria, glob ou @lista, resultados em JSONL (um por linha)
+    if len(sys.argv) >= 3 and sys.argv[1] == '--batch':
+        workers = _obter_opcao(sys.argv, '--workers')
+        resumo = processar_lote(sys.argv[2], _obter_opcao(sys.argv, '--output'),
+                                int(workers) if workers else None, '--resume' in sys.argv,
+                                opcoes_leitor, formato_metricas, '--multi' in sys.argv)
+        sys.exit(0 if resumo['falhas'] == 0 else 2)
+
+    # Ingestão contínua: vigia diretorias e processa as faturas novas (JSONL ou CSV, com checkpoint)
+    if len(sys.argv) >= 3 and sys.argv[1] == '--watch':
+        workers = _obter_opcao(sys.argv, '--workers')
+        intervalo = _obter_opcao(sys.argv, '--interval')
+        IngestaoContinua([diretoria for diretoria in sys.argv[2].split(',') if diretoria],
+                         _obter_opcao(sys.argv, '--output'), int(workers) if workers else None,
+                         opcoes_leitor, '--multi' in sys.argv, _obter_opcao(sys.argv, '--checkpoint'),
+                         float(intervalo) if intervalo else None).executar()
+        return
+
+    leitor = LeitorQRFaturaAT(**opcoes_leitor)
     fatura = None
     image_path = None
     output_path = None
@@ -525,7 +4698,7 @@ def main():
     try:
         # Verificar argumentos da linha de comando
         if len(sys.argv) < 2:
-            print(json.dumps({"error": "Utilização: python script.py <image_path|--text text_path> [--json <output_path>]"}))
+            print(json.dumps({"error": "Utilização: python script.py <image_path|pdf_path|-|--text text_path|--stream|--batch dir|--watch dir[,dir]|--serve|--index-load jsonl> [--json <output_path>]"}))
             sys.exit(1)
 
         # Check if --text argument is provided (for direct QR text processing)
@@ -540,11 +4713,22 @@ def main():
                 qr_text = f.read().strip()
 
             # Decode QR text directly
-            fatura = leitor.descodificar_qr_fatura(qr_text)
+            fatura = leitor.verificar_duplicado(leitor.descodificar_qr_fatura(qr_text), text_file)
 
             # Handle --json output
             if len(sys.argv) >= 5 and sys.argv[3] == '--json':
                 output_path = sys.argv[4]
+        elif sys.argv[1] == '--stream':
+            # Frames da câmara no stdin (MJPEG ou JPEG com o tamanho à frente): pára no primeiro QR AT
+            fatura = leitor.ler_fluxo(_frames_de_fluxo(sys.stdin.buffer))
+        elif sys.argv[1] in ('-', '--stdin'):
+            # Bytes da imagem no stdin: sem ficheiro temporário, descodificados em memória
+            conteudo = sys.stdin.buffer.read()
+            if not conteudo:
+                print(json.dumps({"error": "Nenhum byte de imagem recebido no stdin"}))
+                sys.exit(1)
+            fatura = leitor.processar_faturas_multiplas(conteudo) if '--multi' in sys.argv \
+                else leitor.processar_fatura(conteudo)
         else:
             # Process from image file (original behavior)
             image_path = sys.argv[1]
@@ -554,8 +4738,16 @@ def main():
                 print(json.dumps({"error": f"Ficheiro de imagem não encontrado: {image_path}"}))
                 sys.exit(1)
 
-            # Processar a fatura a partir do ficheiro
-            fatura = leitor.processar_fatura(image_path)
+            # Processar a fatura a partir do ficheiro (--multi: todas as faturas da imagem, numa lista)
+            fatura = leitor.processar_faturas_multiplas(image_path) if '--multi' in sys.argv \
+                else leitor.processar_fatura(image_path)
+
+        if formato_metricas and leitor.ultimas_metricas is not None:
+            if formato_metricas == 'prometheus':
+                sys.stderr.write(RegistoMetricas.partilhado().para_prometheus())
+            else:
+                print(json.dumps({"metrics": leitor.ultimas_metricas.para_dict()}, ensure_ascii=False),
+                      file=sys.stderr)
 
         if fatura:
             # Se houver um caminho de saída JSON, escrever para ficheiro
@@ -582,7 +4774,11 @@ def main():
                 print(json.dumps(fatura, ensure_ascii=False))
         else:
             # Retornar um erro JSON se a fatura não for processada
-            print(json.dumps({"error": "QR Code não encontrado ou ilegível."}))
+            erro = {"error": "QR Code não encontrado ou ilegível."}
+            nao_encontrado = leitor.resumo_nao_encontrado()
+            if nao_encontrado:
+                erro["not_found"] = nao_encontrado
+            print(json.dumps(erro))
             sys.exit(1)
 
     except Exception as e:
@@ -0,0 +1,122 @@
+"""
+Cache de resultados de leitura (CacheDescodificacao): chave por conteúdo e configuração,
+ida e volta pelo disco, validade das falhas (TTL_FALHAS) e despejo LRU por tamanho.
+
+    python3 -m pytest scripts/test_cache_descodificacao.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+CacheDescodificacao = leitor_qr.CacheDescodificacao
+RESULTADO = {'dados_qr': 'A:123456789*O:1.00', 'fatura': {'nif_emitente': '123456789', 'valor_total': 1.0}}
+
+
+class TestCacheDescodificacao(unittest.TestCase):
+
+    def setUp(self):
+        self._temporaria = tempfile.TemporaryDirectory()
+        self.diretoria = self._temporaria.name
+
+    def tearDown(self):
+        self._temporaria.cleanup()
+
+    def _ficheiros(self) -> list:
+        return sorted(nome for _, _, nomes in os.walk(self.diretoria) for nome in nomes)
+
+    def test_chave_depende_do_conteudo_e_da_assinatura(self):
+        chave = CacheDescodificacao.chave(b'imagem', 'v1|opencv')
+        self.assertEqual(chave, CacheDescodificacao.chave(b'imagem', 'v1|opencv'))
+        self.assertNotEqual(chave, CacheDescodificacao.chave(b'imagem', 'v1|opencv,pyzbar'))
+        self.assertNotEqual(chave, CacheDescodificacao.chave(b'imagem2', 'v1|opencv'))
+        # O separador impede que parte da assinatura passe por conteúdo
+        self.assertNotEqual(CacheDescodificacao.chave(b'b', 'a'), CacheDescodificacao.chave(b'', 'ab'))
+
+    def test_assinatura_muda_com_as_opcoes(self):
+        estatisticas = leitor_qr.EstatisticasTentativas(None)
+        opcoes = [{}, {'piramide': False}, {'mosaico': True}, {'max_memoria_mb': 64}]
+        assinaturas = {leitor_qr.LeitorQRFaturaAT(estatisticas=estatisticas, usar_cache=False,
+                                                  **opcao)._assinatura_configuracao() for opcao in opcoes}
+        self.assertEqual(len(assinaturas), len(opcoes))
+
+    def test_ida_e_volta_pelo_disco(self):
+        chave = CacheDescodificacao.chave(b'imagem')
+        CacheDescodificacao(self.diretoria).guardar(chave, RESULTADO)
+        self.assertEqual(self._ficheiros(), [f"{chave}.json"])
+
+        entrada = CacheDescodificacao(self.diretoria).obter(chave)
+        self.assertEqual(entrada['fatura'], RESULTADO['fatura'])
+        self.assertEqual(entrada['dados_qr'], RESULTADO['dados_qr'])
+        self.assertIsNone(CacheDescodificacao(self.diretoria).obter(CacheDescodificacao.chave(b'outra')))
+
+    def test_obter_devolve_copia(self):
+        cache = CacheDescodificacao(None)
+        chave = CacheDescodificacao.chave(b'imagem')
+        cache.guardar(chave, RESULTADO)
+        cache.obter(chave)['fatura']['valor_total'] = -1
+        self.assertEqual(cache.obter(chave)['fatura']['valor_total'], 1.0)
+
+    def test_falha_expira_depois_do_ttl(self):
+        chave = CacheDescodificacao.chave(b'sem qr')
+        cache = CacheDescodificacao(self.diretoria)
+        cache.guardar(chave, None)
+        self.assertEqual(cache.obter(chave)['falhou'], True)
+
+        cache.TTL_FALHAS = 0.05
+        time.sleep(0.1)
+        self.assertIsNone(cache.obter(chave))
+        # Também no disco: uma instância nova não a lê e o ficheiro expirado é removido
+        nova = CacheDescodificacao(self.diretoria)
+        nova.TTL_FALHAS = 0.05
+        self.assertIsNone(nova.obter(chave))
+        self.assertEqual(self._ficheiros(), [])
+
+    def test_resultados_nao_expiram(self):
+        chave = CacheDescodificacao.chave(b'imagem')
+        cache = CacheDescodificacao(self.diretoria)
+        cache.TTL_FALHAS = 0
+        cache.guardar(chave, RESULTADO)
+        self.assertIsNotNone(cache.obter(chave))
+
+    def test_despejo_dos_menos_usados(self):
+        cache = CacheDescodificacao(self.diretoria)
+        chaves = [CacheDescodificacao.chave(str(i).encode()) for i in range(10)]
+        tamanho = None
+        for i, chave in enumerate(chaves):
+            cache.guardar(chave, RESULTADO)
+            caminho = cache._caminho(chave)
+            tamanho = os.path.getsize(caminho)
+            os.utime(caminho, (1000 + i, 1000 + i))   # ordem de uso determinística
+        # Usar a primeira passa-a para a mais recente
+        cache._memoria.clear()
+        self.assertIsNotNone(cache.obter(chaves[0]))
+
+        cache.MAX_DISCO_BYTES = tamanho * 5
+        cache._tamanho_disco = None
+        cache.guardar(CacheDescodificacao.chave(b'nova'), RESULTADO)
+
+        restantes = {nome[:-len('.json')] for nome in self._ficheiros()}
+        self.assertLessEqual(len(restantes) * tamanho, cache.MAX_DISCO_BYTES)
+        self.assertIn(chaves[0], restantes)
+        self.assertIn(CacheDescodificacao.chave(b'nova'), restantes)
+        self.assertNotIn(chaves[1], restantes)
+
+    def test_lru_em_memoria(self):
+        cache = CacheDescodificacao(None)
+        cache.MAX_MEMORIA = 2
+        for conteudo in (b'a', b'b', b'c'):
+            cache.guardar(CacheDescodificacao.chave(conteudo), RESULTADO)
+        self.assertIsNone(cache.obter(CacheDescodificacao.chave(b'a')))
+        self.assertIsNotNone(cache.obter(CacheDescodificacao.chave(b'c')))
+
+
+if __name__ == '__main__':
+    unittest.main()
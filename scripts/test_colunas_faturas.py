@@ -0,0 +1,90 @@
+"""
+Totais colunares (para_colunas / ColunasFaturas): por NIF e por período contam todas as faturas
+com o total do QR, incluindo as que não têm linhas de IVA; por taxa somam as linhas.
+
+    python3 -m pytest scripts/test_colunas_faturas.py
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+TEM_NUMPY = importlib.util.find_spec('numpy') is not None
+
+
+def _fatura(nif: str, data: str, valor_total: float, linhas=()) -> dict:
+    linhas_iva = [{'base_tributavel': base, 'valor_iva': iva, 'taxa_iva_percentagem': round(iva / base * 100, 2)}
+                  for base, iva in linhas]
+    return {'nif_emitente': nif, 'nif_adquirente': '999999990', 'tipo_documento': 'FS', 'data_emissao': data,
+            'valor_total': valor_total, 'retencao_iva': 0,
+            'total_base_calculado': round(sum(base for base, _ in linhas), 2),
+            'total_iva_calculado': round(sum(iva for _, iva in linhas), 2), 'linhas_iva': linhas_iva}
+
+
+FATURAS = [
+    _fatura('500000000', '2024-01-15', 123.0, [(100.0, 23.0)]),
+    _fatura('500000000', '2024-01-20', 42.5),                           # sem linhas de IVA
+    _fatura('500000000', '2024-02-01', 84.1, [(20.0, 2.6), (50.0, 11.5)]),
+    _fatura('123456789', '2024-02-10', 10.6, [(10.0, 0.6)]),
+    {'erro': 'payload inválido', 'raw_data': 'lixo'},                   # ignorada
+    _fatura('123456789', 'sem data', 7.0),                              # NaT, sem linhas
+]
+
+
+@unittest.skipUnless(TEM_NUMPY, "requer NumPy")
+class TestColunasFaturas(unittest.TestCase):
+
+    def setUp(self):
+        leitor = leitor_qr.LeitorQRFaturaAT(usar_cache=False)
+        self.colunas = leitor.para_colunas(FATURAS)
+
+    @staticmethod
+    def _por_chave(totais, nome_chave: str) -> dict:
+        return {str(linha[nome_chave]): (float(linha['base_tributavel']), float(linha['valor_iva']),
+                                         float(linha['valor_total']), int(linha['num_faturas']))
+                for linha in totais}
+
+    def test_tabelas(self):
+        self.assertEqual(len(self.colunas), 5)
+        self.assertEqual(self.colunas.cabecalhos['indice'].tolist(), [0, 1, 2, 3, 5])
+        self.assertEqual(self.colunas.linhas['fatura'].tolist(), [0, 2, 2, 3])
+        self.assertEqual(self.colunas.linhas['taxa_iva_codigo'].tolist(), ['NOR', 'INT', 'NOR', 'RED'])
+
+    def test_totais_por_nif_contam_faturas_sem_linhas(self):
+        self.assertEqual(self._por_chave(self.colunas.totais_por_nif(), 'nif_emitente'), {
+            '123456789': (10.0, 0.6, 17.6, 2),
+            '500000000': (170.0, 37.1, 249.6, 3),
+        })
+
+    def test_totais_por_periodo_usam_o_total_do_qr(self):
+        self.assertEqual(self._por_chave(self.colunas.totais_por_periodo('M'), 'periodo'), {
+            '2024-01': (100.0, 23.0, 165.5, 2),
+            '2024-02': (80.0, 14.7, 94.7, 2),
+            'NaT': (0.0, 0.0, 7.0, 1),
+        })
+
+    def test_totais_por_taxa_somam_as_linhas(self):
+        self.assertEqual(self._por_chave(self.colunas.totais_por_taxa(), 'taxa_iva_codigo'), {
+            'INT': (20.0, 2.6, 22.6, 1),
+            'NOR': (150.0, 34.5, 184.5, 2),
+            'RED': (10.0, 0.6, 10.6, 1),
+        })
+
+    def test_guardar_e_carregar(self):
+        with tempfile.TemporaryDirectory() as diretoria:
+            caminho = os.path.join(diretoria, 'faturas.npz')
+            self.colunas.guardar(caminho)
+            carregadas = leitor_qr.ColunasFaturas.carregar(caminho)
+        self.assertEqual(carregadas.cabecalhos.tolist(), self.colunas.cabecalhos.tolist())
+        self.assertEqual(carregadas.linhas.tolist(), self.colunas.linhas.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Ordenação aprendida (EstatisticasTentativas): só as leituras de imagens fixas a alimentam.
+As tentativas em ladrilhos (--tiles) e nos frames de um fluxo (--stream) ficam nas métricas
+da leitura mas não mudam as estatísticas persistidas.
+
+    python3 -m pytest scripts/test_estatisticas_tentativas.py
+"""
+
+import importlib.util
+import os
+import sys
+import threading
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+TEM_VISAO = all(importlib.util.find_spec(nome) is not None for nome in ('cv2', 'numpy'))
+PAYLOAD = ('A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240115*G:FS 1/123*H:ABCD1234-123*'
+           'I1:PT*I7:100.00*I8:23.00*N:23.00*O:123.00*Q:abcd*R:1234')
+
+
+def _imagem_qr(texto: str, px_por_modulo: int = 4, margem: int = 40):
+    """QR gerado pelo OpenCV, em BGR, com uma margem branca à volta"""
+    import cv2
+    import numpy as np
+    codificador = cv2.QRCodeEncoder.create() if hasattr(cv2.QRCodeEncoder, 'create') else cv2.QRCodeEncoder()
+    matriz = codificador.encode(texto)
+    matriz = cv2.resize(matriz, None, fx=px_por_modulo, fy=px_por_modulo, interpolation=cv2.INTER_NEAREST)
+    matriz = cv2.copyMakeBorder(matriz, margem, margem, margem, margem, cv2.BORDER_CONSTANT, value=255)
+    return np.ascontiguousarray(cv2.cvtColor(matriz, cv2.COLOR_GRAY2BGR))
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestEstatisticasTentativas(unittest.TestCase):
+
+    def setUp(self):
+        self.estatisticas = leitor_qr.EstatisticasTentativas(None)
+        self.leitor = leitor_qr.LeitorQRFaturaAT(estatisticas=self.estatisticas, usar_cache=False)
+
+    def test_imagem_fixa_alimenta_as_estatisticas(self):
+        fatura = self.leitor.processar_fatura(_imagem_qr(PAYLOAD))
+        self.assertEqual(fatura['nif_emitente'], '123456789')
+        self.assertTrue(self.estatisticas._dados)
+        self.assertTrue(any(entrada['sucessos'] for entrada in self.estatisticas._dados.values()))
+
+    def test_fluxo_nao_altera_as_estatisticas(self):
+        import cv2
+        import numpy as np
+        qr = _imagem_qr(PAYLOAD)
+        vazio = np.full_like(qr, 255)
+        frames = [cv2.imencode('.jpg', imagem)[1].tobytes() for imagem in (vazio, vazio, qr)]
+        fatura = self.leitor.ler_fluxo(frames)
+        self.assertEqual(fatura['nif_emitente'], '123456789')
+        self.assertEqual(self.estatisticas._dados, {})
+
+    def test_ladrilhos_nao_alteram_as_estatisticas(self):
+        imagem = _imagem_qr(PAYLOAD)
+        altura, largura = imagem.shape[:2]
+        metricas = leitor_qr.MetricasLeitura()
+        vencedora = self.leitor._ler_ladrilho(imagem, (0, 0, largura, altura), 1.0,
+                                              self.leitor._tentativas_disponiveis(), 'ladrilho_', metricas,
+                                              threading.Event(), False)
+        self.assertIsNotNone(vencedora)
+        self.assertEqual(vencedora[2], [PAYLOAD])
+        self.assertTrue(metricas.tentativas())
+        self.assertEqual(self.estatisticas._dados, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
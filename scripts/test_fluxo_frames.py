@@ -0,0 +1,102 @@
+"""
+Separação de frames do modo --stream (_frames_de_fluxo): JPEG com o tamanho à frente, MJPEG
+concatenado e multipart, com os bytes a chegar aos bocados. Os JPEG com miniatura EXIF (um
+SOI/EOI dentro do APP1), progressivos ou com marcadores de reinício têm de sair inteiros.
+
+    python3 -m pytest scripts/test_fluxo_frames.py
+"""
+
+import importlib.util
+import os
+import struct
+import sys
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+TEM_VISAO = all(importlib.util.find_spec(nome) is not None for nome in ('cv2', 'numpy'))
+
+
+class _AosBocados:
+    """Stream binário que entrega no máximo `bloco` bytes por leitura (como um pipe ou socket)"""
+
+    def __init__(self, dados: bytes, bloco: int = 97):
+        self.dados = dados
+        self.pos = 0
+        self.bloco = bloco
+
+    def read(self, n: int = -1) -> bytes:
+        n = self.bloco if n < 0 else min(n, self.bloco)
+        parte = self.dados[self.pos:self.pos + n]
+        self.pos += len(parte)
+        return parte
+
+
+def _jpeg(semente: int, **parametros) -> bytes:
+    import cv2
+    import numpy as np
+    imagem = np.random.default_rng(semente).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    opcoes = []
+    for nome, valor in parametros.items():
+        opcoes += [getattr(cv2, nome), valor]
+    return cv2.imencode('.jpg', imagem, opcoes)[1].tobytes()
+
+
+def _com_miniatura_exif(jpeg: bytes, miniatura: bytes) -> bytes:
+    """APP1 EXIF com uma miniatura JPEG (SOI ... EOI) lá dentro, logo a seguir ao SOI"""
+    tiff = b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', 0) + struct.pack('<I', 0)
+    app1 = b'Exif\x00\x00' + tiff + miniatura
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + jpeg[2:]
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestFramesDeFluxo(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.frames = [
+            _jpeg(1),
+            _com_miniatura_exif(_jpeg(2), _jpeg(3)),
+            _jpeg(4, IMWRITE_JPEG_PROGRESSIVE=1),
+            _jpeg(5, IMWRITE_JPEG_RST_INTERVAL=2),
+        ]
+
+    def _ler(self, dados: bytes, bloco: int = 97) -> list:
+        return list(leitor_qr._frames_de_fluxo(_AosBocados(dados, bloco)))
+
+    def test_tamanho_a_frente(self):
+        dados = b''.join(struct.pack('>I', len(frame)) + frame for frame in self.frames)
+        self.assertEqual(self._ler(dados), self.frames)
+
+    def test_mjpeg_concatenado(self):
+        for bloco in (1, 97, 1 << 20):
+            with self.subTest(bloco=bloco):
+                self.assertEqual(self._ler(b''.join(self.frames), bloco), self.frames)
+
+    def test_multipart(self):
+        dados = b''.join(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(frame)
+                         + frame + b'\r\n' for frame in self.frames)
+        self.assertEqual(self._ler(dados), self.frames)
+
+    def test_frame_com_miniatura_exif_inteiro(self):
+        import cv2
+        import numpy as np
+        frame, = self._ler(self.frames[1])
+        self.assertEqual(frame, self.frames[1])
+        self.assertEqual(cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR).shape, (48, 64, 3))
+
+    def test_frame_incompleto_no_fim_e_ignorado(self):
+        dados = b''.join(self.frames)
+        self.assertEqual(self._ler(dados + self.frames[0][:50]), self.frames)
+        comprimento = struct.pack('>I', len(self.frames[0])) + self.frames[0]
+        self.assertEqual(self._ler(comprimento + comprimento[:30]), self.frames[:1])
+
+    def test_stream_vazio(self):
+        self.assertEqual(self._ler(b''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
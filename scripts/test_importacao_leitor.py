@@ -0,0 +1,88 @@
+"""
+Guarda do arranque rápido do leitor: descodificar texto QR (--text, parser AT) não pode
+importar a pilha de visão (OpenCV, NumPy, pyzbar), e o import do módulo tem de ficar
+abaixo de um orçamento de tempo.
+
+    python3 -m pytest scripts/test_importacao_leitor.py
+    python3 -m unittest discover -s scripts -p 'test_*.py'
+
+QR_IMPORT_MAX_MS muda o orçamento do import (por omissão 500 ms, folgado para máquinas lentas;
+com o OpenCV o import passa facilmente de 1 s).
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(DIRETORIA, 'leitor_qr_faturas_at.py')
+PAYLOAD = ('A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240115*G:FS 1/123*H:ABCD1234-123*'
+           'I1:PT*I7:100.00*I8:23.00*N:23.00*O:123.00*Q:abcd*R:1234')
+MODULOS_VISAO = ('cv2', 'numpy', 'pyzbar')
+ORCAMENTO_IMPORT_MS = float(os.environ.get('QR_IMPORT_MAX_MS', '500'))
+
+
+def _ambiente() -> dict:
+    # Sem estatísticas nem cache em disco: o teste não escreve na diretoria do utilizador
+    return dict(os.environ, QR_STATS_PATH='', QR_CACHE_DIR='', QR_QUIET='1')
+
+
+def _modulos_importados(stderr: str) -> dict:
+    """Módulos do relatório de -X importtime: nome -> tempo acumulado (µs)"""
+    modulos = {}
+    for linha in stderr.splitlines():
+        if not linha.startswith('import time:') or '|' not in linha:
+            continue
+        partes = [parte.strip() for parte in linha[len('import time:'):].split('|')]
+        if len(partes) == 3 and partes[1].isdigit():
+            modulos[partes[2]] = int(partes[1])
+    return modulos
+
+
+class TestImportacaoLeitor(unittest.TestCase):
+
+    def test_texto_nao_importa_visao(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+            f.write(PAYLOAD)
+        try:
+            processo = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT, '--text', f.name],
+                                      capture_output=True, text=True, env=_ambiente(), timeout=60)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(processo.returncode, 0, processo.stdout + processo.stderr)
+        self.assertEqual(json.loads(processo.stdout)['nif_emitente'], '123456789')
+        modulos = _modulos_importados(processo.stderr)
+        self.assertTrue(modulos, "relatório de -X importtime vazio")
+        importados = sorted(nome for nome in modulos if nome.split('.')[0] in MODULOS_VISAO)
+        self.assertEqual(importados, [], f"--text importou a pilha de visão: {importados}")
+
+    def test_parser_nao_carrega_visao(self):
+        codigo = (
+            "import sys, json\n"
+            f"sys.path.insert(0, {DIRETORIA!r})\n"
+            "import leitor_qr_faturas_at as m\n"
+            "leitor = m.LeitorQRFaturaAT(usar_cache=False)\n"
+            f"fatura = leitor.descodificar_qr_fatura({PAYLOAD!r})\n"
+            f"print(json.dumps({{'fatura': fatura, 'visao': [n for n in {MODULOS_VISAO!r} if n in sys.modules]}}))\n"
+        )
+        processo = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True,
+                                  env=_ambiente(), timeout=60)
+        self.assertEqual(processo.returncode, 0, processo.stderr)
+        resultado = json.loads(processo.stdout)
+        self.assertEqual(resultado['fatura']['valor_total'], 123.0)
+        self.assertEqual(resultado['visao'], [])
+
+    def test_orcamento_import(self):
+        processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import leitor_qr_faturas_at'],
+                                  capture_output=True, text=True, env=_ambiente(), cwd=DIRETORIA, timeout=60)
+        self.assertEqual(processo.returncode, 0, processo.stderr)
+        acumulado_ms = _modulos_importados(processo.stderr)['leitor_qr_faturas_at'] / 1000
+        self.assertLess(acumulado_ms, ORCAMENTO_IMPORT_MS,
+                        f"import do leitor demorou {acumulado_ms:.0f} ms (orçamento {ORCAMENTO_IMPORT_MS:.0f} ms)")
+
+
+if __name__ == '__main__':
+    unittest.main()
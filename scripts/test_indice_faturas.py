@@ -0,0 +1,90 @@
+"""
+Índice de faturas já lidas (IndiceFaturas): chave NIF|ATCUD ou número|hash, registo com a
+leitura anterior, contagem de repetições, carga em lote e verificar_duplicado do leitor.
+
+    python3 -m pytest scripts/test_indice_faturas.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+IndiceFaturas = leitor_qr.IndiceFaturas
+FATURA = {'nif_emitente': '500000000', 'atcud': 'ABCD1234-7', 'numero_documento': 'FT A/7',
+          'hash': 'XyZ1', 'valor_total': 84.1}
+
+
+class TestIndiceFaturas(unittest.TestCase):
+
+    def setUp(self):
+        self.indice = IndiceFaturas(None)
+
+    def tearDown(self):
+        self.indice.fechar()
+
+    def test_chave(self):
+        self.assertEqual(IndiceFaturas.chave(FATURA), '500000000|ABCD1234-7|XyZ1')
+        self.assertEqual(IndiceFaturas.chave(dict(FATURA, atcud=None, hash=None)), '500000000|FT A/7|')
+        self.assertIsNone(IndiceFaturas.chave(dict(FATURA, nif_emitente=None)))
+        self.assertIsNone(IndiceFaturas.chave(dict(FATURA, atcud=None, numero_documento=None)))
+        self.assertIsNone(IndiceFaturas.chave(dict(FATURA, erro='payload inválido')))
+
+    def test_registar_devolve_a_primeira_leitura(self):
+        self.assertIsNone(self.indice.registar(FATURA, 'a.jpg'))
+        anterior = self.indice.registar(dict(FATURA, valor_total=0), 'b.jpg')
+        self.assertEqual(anterior['origem'], 'a.jpg')
+        self.assertEqual(anterior['vezes'], 1)
+        self.assertEqual(anterior['fatura'], FATURA)
+        self.assertEqual(self.indice.registar(FATURA, 'c.jpg')['vezes'], 2)
+        self.assertEqual(self.indice.consultar(FATURA)['vezes'], 3)
+        self.assertEqual(len(self.indice), 1)
+
+    def test_faturas_diferentes_nao_colidem(self):
+        self.assertIsNone(self.indice.registar(FATURA))
+        self.assertIsNone(self.indice.registar(dict(FATURA, hash='outro')))
+        self.assertIsNone(self.indice.registar(dict(FATURA, nif_emitente='123456789')))
+        self.assertIsNone(self.indice.consultar(dict(FATURA, atcud='ABCD1234-8')))
+        self.assertEqual(len(self.indice), 3)
+
+    def test_sem_chave_nao_regista(self):
+        self.assertIsNone(self.indice.registar({'erro': 'x', 'raw_data': 'lixo'}))
+        self.assertEqual(len(self.indice), 0)
+
+    def test_carregar_lote_mantem_as_existentes(self):
+        self.indice.registar(FATURA, 'primeira.jpg')
+        novas = self.indice.carregar_lote([(FATURA, 'lote.jpg'), (dict(FATURA, atcud='X-1'), 'lote.jpg'),
+                                           ({'erro': 'x'}, 'lote.jpg')])
+        self.assertEqual(novas, 1)
+        self.assertEqual(len(self.indice), 2)
+        self.assertEqual(self.indice.consultar(FATURA)['origem'], 'primeira.jpg')
+
+    def test_persistente_entre_instancias(self):
+        with tempfile.TemporaryDirectory() as diretoria:
+            caminho = os.path.join(diretoria, 'faturas.sqlite3')
+            indice = IndiceFaturas(caminho)
+            indice.registar(FATURA, 'a.jpg')
+            indice.fechar()
+            indice = IndiceFaturas(caminho)
+            try:
+                self.assertEqual(indice.registar(FATURA, 'b.jpg')['origem'], 'a.jpg')
+            finally:
+                indice.fechar()
+
+    def test_verificar_duplicado(self):
+        leitor = leitor_qr.LeitorQRFaturaAT(usar_cache=False, indice=self.indice)
+        primeira = leitor.verificar_duplicado(dict(FATURA), 'a.jpg')
+        self.assertNotIn('duplicado', primeira)
+        repetida = leitor.verificar_duplicado(dict(FATURA), 'b.jpg')
+        self.assertEqual(repetida['duplicado']['origem'], 'a.jpg')
+        # A leitura guardada no índice não traz a marca de duplicado
+        self.assertNotIn('duplicado', repetida['duplicado']['fatura'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+"""
+Modo lote (processar_lote) e ingestão contínua (IngestaoContinua): retomar um lote sem repetir
+os ficheiros já no JSONL, um worker que morre vira uma linha de erro, e o checkpoint da
+ingestão evita repetir ficheiros depois de um reinício (mas não os substituídos).
+
+    python3 -m pytest scripts/test_lote_ingestao.py
+"""
+
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+TEM_VISAO = all(importlib.util.find_spec(nome) is not None for nome in ('cv2', 'numpy'))
+PAYLOAD = ('A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240115*G:FS 1/123*H:ABCD1234-123*'
+           'I1:PT*I7:100.00*I8:23.00*N:23.00*O:123.00*Q:abcd*R:1234')
+OPCOES_LEITOR = {'usar_cache': False}
+ESPERA_MAX_S = 60
+
+_ambiente = None
+
+
+def setUpModule():
+    # Os workers (processos) herdam o ambiente: sem estatísticas nem cache em disco
+    global _ambiente
+    _ambiente = mock.patch.dict(os.environ, QR_STATS_PATH='', QR_CACHE_DIR='', QR_QUIET='1')
+    _ambiente.start()
+
+
+def tearDownModule():
+    _ambiente.stop()
+
+
+def _gravar_qr(caminho: str, texto: str = PAYLOAD):
+    import cv2
+    import numpy as np
+    if texto:
+        codificador = cv2.QRCodeEncoder.create() if hasattr(cv2.QRCodeEncoder, 'create') else cv2.QRCodeEncoder()
+        imagem = cv2.resize(codificador.encode(texto), None, fx=4, fy=4, interpolation=cv2.INTER_NEAREST)
+        imagem = cv2.copyMakeBorder(imagem, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=255)
+    else:
+        imagem = np.full((120, 160), 255, dtype=np.uint8)
+    with open(caminho, 'wb') as f:
+        f.write(cv2.imencode('.png', imagem)[1].tobytes())
+
+
+def _linhas_jsonl(caminho: str) -> list:
+    """Linhas JSON completas da saída (uma linha truncada por uma paragem a meio fica de fora)"""
+    linhas = []
+    if not os.path.exists(caminho):
+        return linhas
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for linha in f:
+            try:
+                linhas.append(json.loads(linha))
+            except ValueError:
+                continue
+    return linhas
+
+
+class TestResultadoLote(unittest.TestCase):
+
+    def test_excecao_do_worker_vira_linha_de_erro(self):
+        from concurrent.futures import Future
+        futuro = Future()
+        futuro.set_exception(RuntimeError('falhou'))
+        self.assertEqual(leitor_qr._resultado_lote(futuro, 'a.jpg'),
+                         {'file': 'a.jpg', 'ok': False, 'error': 'O worker do lote falhou: falhou'})
+
+    def test_worker_morto_recria_o_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=1)
+        novo = None
+        try:
+            em_curso = {pool.submit(os._exit, 1): 'morre.jpg'}
+            with contextlib.redirect_stderr(io.StringIO()):
+                terminados, novo = leitor_qr._terminados_lote(pool, em_curso, lambda: ProcessPoolExecutor(1))
+            self.assertIsNot(novo, pool)
+            resultado = leitor_qr._resultado_lote(terminados.pop(), 'morre.jpg')
+            self.assertFalse(resultado['ok'])
+            self.assertIn('O worker do lote falhou', resultado['error'])
+            # O pool novo continua a aceitar trabalho
+            self.assertEqual(novo.submit(abs, -3).result(timeout=ESPERA_MAX_S), 3)
+        finally:
+            pool.shutdown(wait=False)
+            if novo is not None:
+                novo.shutdown()
+
+    def test_ficheiros_ja_processados_ignora_linha_truncada(self):
+        with tempfile.TemporaryDirectory() as diretoria:
+            caminho = os.path.join(diretoria, 'saida.jsonl')
+            with open(caminho, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'file': 'a.jpg', 'ok': True}) + '\n' + '{"file": "b.jpg", "ok"')
+            self.assertEqual(leitor_qr._ficheiros_ja_processados(caminho), {'a.jpg'})
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestProcessarLote(unittest.TestCase):
+
+    def setUp(self):
+        self._temporaria = tempfile.TemporaryDirectory()
+        self.entrada = os.path.join(self._temporaria.name, 'entrada')
+        os.makedirs(self.entrada)
+        self.saida = os.path.join(self._temporaria.name, 'saida.jsonl')
+
+    def tearDown(self):
+        self._temporaria.cleanup()
+
+    def _lote(self, **opcoes) -> dict:
+        with contextlib.redirect_stderr(io.StringIO()):
+            return leitor_qr.processar_lote(self.entrada, self.saida, num_workers=1,
+                                            opcoes_leitor=OPCOES_LEITOR, **opcoes)
+
+    def test_lote_e_retoma(self):
+        a, b, c = (os.path.join(self.entrada, nome) for nome in ('a.png', 'b.png', 'c.png'))
+        _gravar_qr(a)
+        _gravar_qr(b, '')
+        resumo = self._lote()
+        self.assertEqual((resumo['total'], resumo['ok'], resumo['falhas']), (2, 1, 1))
+        linhas = {linha['file']: linha for linha in _linhas_jsonl(self.saida)}
+        self.assertEqual(linhas[a]['result']['nif_emitente'], '123456789')
+        self.assertFalse(linhas[b]['ok'])
+
+        # Uma paragem a meio deixou uma linha truncada (de c) no fim do JSONL
+        _gravar_qr(c)
+        with open(self.saida, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'file': c})[:-3])
+        resumo = self._lote(retomar=True)
+        self.assertEqual((resumo['total'], resumo['ignorados']), (1, 2))
+        self.assertEqual([linha['file'] for linha in _linhas_jsonl(self.saida)], [a, b, c])
+
+    def test_sem_retomar_reescreve_a_saida(self):
+        _gravar_qr(os.path.join(self.entrada, 'a.png'))
+        self._lote()
+        resumo = self._lote()
+        self.assertEqual((resumo['total'], resumo['ignorados']), (1, 0))
+        self.assertEqual(len(_linhas_jsonl(self.saida)), 1)
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestIngestaoContinua(unittest.TestCase):
+
+    def setUp(self):
+        self._temporaria = tempfile.TemporaryDirectory()
+        self.entrada = os.path.join(self._temporaria.name, 'entrada')
+        os.makedirs(self.entrada)
+        self.saida = os.path.join(self._temporaria.name, 'saida.jsonl')
+
+    def tearDown(self):
+        self._temporaria.cleanup()
+
+    def _ingerir_ate(self, n_linhas: int) -> dict:
+        """Corre a ingestão numa thread até a saída ter n_linhas e pára-a como um SIGTERM faria"""
+        ingestao = leitor_qr.IngestaoContinua([self.entrada], self.saida, num_workers=1,
+                                              opcoes_leitor=OPCOES_LEITOR, intervalo=0.05, quieto=0)
+        resumos = []
+        with contextlib.redirect_stderr(io.StringIO()):
+            thread = threading.Thread(target=lambda: resumos.append(ingestao.executar()))
+            thread.start()
+            limite = time.monotonic() + ESPERA_MAX_S
+            while len(_linhas_jsonl(self.saida)) < n_linhas and time.monotonic() < limite:
+                time.sleep(0.05)
+            # Mais umas passagens: nada além do esperado pode aparecer
+            time.sleep(0.3)
+            ingestao.parar()
+            thread.join(ESPERA_MAX_S)
+        self.assertFalse(thread.is_alive())
+        return resumos[0]
+
+    def test_checkpoint_evita_repetir_depois_de_reiniciar(self):
+        a, b = os.path.join(self.entrada, 'a.png'), os.path.join(self.entrada, 'b.png')
+        _gravar_qr(a)
+        self.assertEqual(self._ingerir_ate(1), {'total': 1, 'ok': 1, 'falhas': 0})
+        with open(f"{self.saida}.checkpoint", 'r', encoding='utf-8') as f:
+            self.assertEqual([json.loads(linha)['file'] for linha in f], [a])
+
+        # Reinício: a.png já está no checkpoint, b.png é nova
+        _gravar_qr(b)
+        self.assertEqual(self._ingerir_ate(2)['total'], 1)
+        self.assertEqual([linha['file'] for linha in _linhas_jsonl(self.saida)], [a, b])
+
+        # Substituir a.png pelo mesmo nome (outro conteúdo) volta a lê-la
+        _gravar_qr(a, '')
+        self.assertEqual(self._ingerir_ate(3), {'total': 1, 'ok': 0, 'falhas': 1})
+        self.assertEqual([linha['file'] for linha in _linhas_jsonl(self.saida)], [a, b, a])
+
+    def test_ignora_ficheiros_temporarios(self):
+        _gravar_qr(os.path.join(self.entrada, 'a.png'))
+        _gravar_qr(os.path.join(self.entrada, 'b.png.part'))
+        self.assertEqual(self._ingerir_ate(1)['total'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Parser do payload AT (descodificar_qr_fatura / descodificar_lote) contra resultados de referência
+gerados pelo parser original (antes da passagem única por _descodificar_payload_at): qualquer
+diferença de campos, arredondamentos ou heurísticas N/O aparece aqui.
+
+    python3 -m pytest scripts/test_parser_at.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+# Uma taxa (I7/I8), campo O usado como total
+PAYLOAD_SIMPLES = ('A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240115*G:FS 1/123*H:ABCD1234-123*'
+                   'I1:PT*I7:100.00*I8:23.00*N:23.00*O:123.00*Q:abcd*R:1234')
+# Três taxas, N menor que O (heurística que guarda os campos originais e recalcula o total)
+PAYLOAD_VARIAS_TAXAS = ('A:500000000*B:123456789*C:PT*D:FT*E:N*F:20231231*G:FT A/7*H:0*I1:PT*'
+                        'I3:10.00*I4:0.60*I5:20.00*I6:2.60*I7:50.00*I8:11.50*N:14.70*O:94.70*'
+                        'P:1.50*Q:WXYZ*R:9999')
+# Sem linhas de IVA
+PAYLOAD_SEM_LINHAS = 'A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240301*G:FS 1/9*H:0*I1:PT*N:0.00*O:42.50*Q:qq*R:1'
+
+REFERENCIA = {
+    PAYLOAD_SIMPLES: {
+        'atcud': 'ABCD1234-123', 'data_emissao': '2024-01-15', 'estado_documento': 'N', 'hash': None,
+        'linhas_iva': [{'base_tributavel': 100.0, 'taxa_iva_codigo': 'CALC(23.0%)',
+                        'taxa_iva_percentagem': 23.0, 'valor_iva': 23.0}],
+        'nif_adquirente': '999999990', 'nif_emitente': '123456789', 'numero_certificado': 'abcd',
+        'numero_documento': 'FS 1/123', 'outras_infos': '1234', 'pais_adquirente': 'PT',
+        'raw_data': PAYLOAD_SIMPLES, 'retencao_iva': 123.0, 'tipo_documento': 'FS',
+        'total_base_calculado': 100.0, 'total_iva_calculado': 23.0, 'total_iva_qr': 23.0, 'valor_total': 123.0,
+    },
+    PAYLOAD_VARIAS_TAXAS: {
+        'atcud': '0', 'campo_n_original': 14.7, 'campo_o_original': 94.7, 'data_emissao': '2023-12-31',
+        'estado_documento': 'N', 'hash': '1.50',
+        'linhas_iva': [{'base_tributavel': 20.0, 'taxa_iva_codigo': 'CALC(13.0%)',
+                        'taxa_iva_percentagem': 13.0, 'valor_iva': 2.6},
+                       {'base_tributavel': 50.0, 'taxa_iva_codigo': 'CALC(23.0%)',
+                        'taxa_iva_percentagem': 23.0, 'valor_iva': 11.5}],
+        'nif_adquirente': '123456789', 'nif_emitente': '500000000', 'numero_certificado': 'WXYZ',
+        'numero_documento': 'FT A/7', 'outras_infos': '9999', 'pais_adquirente': 'PT',
+        'raw_data': PAYLOAD_VARIAS_TAXAS, 'retencao_iva': 0, 'tipo_documento': 'FT',
+        'total_base_calculado': 70.0, 'total_iva_calculado': 14.1, 'valor_total': 84.1,
+    },
+    PAYLOAD_SEM_LINHAS: {
+        'atcud': '0', 'data_emissao': '2024-03-01', 'estado_documento': 'N', 'hash': None, 'linhas_iva': [],
+        'nif_adquirente': '999999990', 'nif_emitente': '123456789', 'numero_certificado': 'qq',
+        'numero_documento': 'FS 1/9', 'outras_infos': '1', 'pais_adquirente': 'PT',
+        'raw_data': PAYLOAD_SEM_LINHAS, 'retencao_iva': 42.5, 'tipo_documento': 'FS',
+        'total_base_calculado': 0, 'total_iva_calculado': 0, 'valor_total': 0.0,
+    },
+    'lixo sem formato': {
+        'atcud': None, 'data_emissao': None, 'estado_documento': None, 'hash': None, 'linhas_iva': [],
+        'nif_adquirente': None, 'nif_emitente': None, 'numero_certificado': None, 'numero_documento': None,
+        'outras_infos': None, 'pais_adquirente': None, 'raw_data': 'lixo sem formato', 'retencao_iva': 0,
+        'tipo_documento': None, 'total_base_calculado': 0, 'total_iva_calculado': 0, 'valor_total': 0,
+    },
+}
+
+
+class TestParserAT(unittest.TestCase):
+
+    def setUp(self):
+        self.leitor = leitor_qr.LeitorQRFaturaAT(usar_cache=False)
+
+    def test_igual_a_referencia(self):
+        for payload, esperado in REFERENCIA.items():
+            with self.subTest(payload=payload):
+                self.assertEqual(self.leitor.descodificar_qr_fatura(payload), esperado)
+
+    def test_campo_invalido_devolve_erro(self):
+        payload = 'A:123456789*F:2024-13-45*O:abc'
+        with contextlib.redirect_stderr(io.StringIO()):
+            fatura = self.leitor.descodificar_qr_fatura(payload)
+        self.assertEqual(fatura, {'erro': "could not convert string to float: 'abc'", 'raw_data': payload})
+
+    def test_lote_igual_ao_individual(self):
+        payloads = list(REFERENCIA) * 3
+        for memoizar in (True, False):
+            with self.subTest(memoizar=memoizar):
+                self.assertEqual(self.leitor.descodificar_lote(payloads, memoizar=memoizar),
+                                 [REFERENCIA[payload] for payload in payloads])
+
+    def test_lote_memoizado_devolve_copias_independentes(self):
+        primeira, segunda = self.leitor.descodificar_lote([PAYLOAD_VARIAS_TAXAS, PAYLOAD_VARIAS_TAXAS])
+        primeira['valor_total'] = -1
+        primeira['linhas_iva'][0]['valor_iva'] = -1
+        primeira['linhas_iva'].append({})
+        self.assertEqual(segunda, REFERENCIA[PAYLOAD_VARIAS_TAXAS])
+
+    def test_lote_repoe_gc(self):
+        import gc
+        self.assertTrue(gc.isenabled())
+        self.leitor.descodificar_lote([PAYLOAD_SIMPLES])
+        self.assertTrue(gc.isenabled())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""
+Leitura de PDFs sem dependências: preditores PNG (_pdf_despredizer) contra um codificador de
+referência em Python puro, imagens embutidas reconstruídas por DocumentoPDF e leitura de uma
+fatura num PDF gerado, com as imagens descodificadas só quando são precisas.
+
+    python3 -m pytest scripts/test_pdf_leitor.py
+"""
+
+import importlib.util
+import os
+import sys
+import unittest
+import zlib
+from unittest import mock
+
+DIRETORIA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DIRETORIA)
+
+import leitor_qr_faturas_at as leitor_qr  # noqa: E402
+
+TEM_VISAO = all(importlib.util.find_spec(nome) is not None for nome in ('cv2', 'numpy'))
+PAYLOAD = ('A:123456789*B:999999990*C:PT*D:FS*E:N*F:20240115*G:FS 1/123*H:ABCD1234-123*'
+           'I1:PT*I7:100.00*I8:23.00*N:23.00*O:123.00*Q:abcd*R:1234')
+
+
+def _paeth(a: int, b: int, c: int) -> int:
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    return a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+
+
+def _predizer_png(dados: bytes, largura: int, bpp: int) -> bytes:
+    """Codificador de referência: linha y com o filtro y % 5 (None, Sub, Up, Average, Paeth)"""
+    saida = bytearray()
+    anterior = bytes(largura)
+    for y in range(len(dados) // largura):
+        linha = dados[y * largura:(y + 1) * largura]
+        filtro = y % 5
+        codificada = bytearray()
+        for i in range(largura):
+            a = linha[i - bpp] if i >= bpp else 0
+            b = anterior[i]
+            c = anterior[i - bpp] if i >= bpp else 0
+            previsto = (0, a, b, (a + b) // 2, _paeth(a, b, c))[filtro]
+            codificada.append((linha[i] - previsto) & 0xFF)
+        saida += bytes([filtro]) + codificada
+        anterior = linha
+    return bytes(saida)
+
+
+def _imagem_cinzenta(pdf: list, pixels, preditor: bool = True) -> int:
+    """Acrescenta um XObject de imagem DeviceGray de 8 bits (Flate) e devolve o número do objeto"""
+    altura, largura = pixels.shape
+    dados = pixels.tobytes()
+    parametros = ''
+    if preditor:
+        dados = _predizer_png(dados, largura, 1)
+        parametros = f' /DecodeParms << /Predictor 15 /Columns {largura} >>'
+    dados = zlib.compress(dados)
+    pdf.append((f'<< /Type /XObject /Subtype /Image /Width {largura} /Height {altura} /ColorSpace /DeviceGray'
+                f' /BitsPerComponent 8 /Filter /FlateDecode{parametros} /Length {len(dados)} >>', dados))
+    return len(pdf)
+
+
+def _pdf(paginas_imagens: list, pdf: list) -> bytes:
+    """PDF mínimo (sem tabela xref: o leitor localiza os objetos por varrimento)"""
+    primeiro_pagina = len(pdf) + 1
+    paginas = len(pdf) + len(paginas_imagens) + 1
+    for imagens in paginas_imagens:
+        xobjects = ' '.join(f'/Im{j} {numero} 0 R' for j, numero in enumerate(imagens))
+        pdf.append((f'<< /Type /Page /Parent {paginas} 0 R /MediaBox [0 0 595 842]'
+                    f' /Resources << /XObject << {xobjects} >> >> >>', None))
+    filhos = ' '.join(f'{numero} 0 R' for numero in range(primeiro_pagina, paginas))
+    pdf.append((f'<< /Type /Pages /Kids [{filhos}] /Count {len(paginas_imagens)} >>', None))
+    pdf.append((f'<< /Type /Catalog /Pages {paginas} 0 R >>', None))
+    saida = bytearray(b'%PDF-1.4\n')
+    for numero, (dicionario, stream) in enumerate(pdf, 1):
+        saida += f'{numero} 0 obj\n{dicionario}'.encode()
+        if stream is not None:
+            saida += b'\nstream\n' + stream + b'\nendstream'
+        saida += b'\nendobj\n'
+    saida += f'trailer\n<< /Size {len(pdf) + 1} /Root {len(pdf)} 0 R >>\n%%EOF\n'.encode()
+    return bytes(saida)
+
+
+def _qr(texto: str, px_por_modulo: int = 4):
+    import cv2
+    import numpy as np
+    codificador = cv2.QRCodeEncoder.create() if hasattr(cv2.QRCodeEncoder, 'create') else cv2.QRCodeEncoder()
+    matriz = codificador.encode(texto)
+    ys, xs = np.where(matriz < 128)
+    matriz = matriz[ys.min():ys.max() + 1, xs.min():xs.max() + 1]   # sem zona de silêncio
+    return np.kron(matriz, np.ones((px_por_modulo, px_por_modulo), dtype=np.uint8))
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestPreditoresPDF(unittest.TestCase):
+
+    def test_igual_ao_codificador_de_referencia(self):
+        import numpy as np
+        gerador = np.random.default_rng(7)
+        # bpp com PNG equivalente (libpng) e bpp 5 (caminho em Python)
+        for cores, bits in ((1, 8), (1, 16), (3, 8), (4, 8), (3, 16), (4, 16), (5, 8), (1, 1)):
+            colunas = 37
+            largura = (colunas * cores * bits + 7) // 8
+            bpp = max(1, cores * bits // 8)
+            with self.subTest(cores=cores, bits=bits):
+                original = gerador.integers(0, 256, largura * 11, dtype=np.uint8).tobytes()
+                parametros = {'Predictor': 15, 'Colors': cores, 'BitsPerComponent': bits, 'Columns': colunas}
+                despredito = leitor_qr._pdf_despredizer(_predizer_png(original, largura, bpp), parametros)
+                self.assertEqual(despredito, original)
+
+    def test_sem_preditor_png_devolve_os_dados(self):
+        self.assertEqual(leitor_qr._pdf_despredizer(b'\x01\x02\x03', {'Predictor': 1}), b'\x01\x02\x03')
+
+    def test_filtro_invalido(self):
+        with self.assertRaises(ValueError):
+            leitor_qr._pdf_despredizer(b'\x05\x00\x00', {'Predictor': 15, 'Columns': 2})
+
+
+@unittest.skipUnless(TEM_VISAO, "requer OpenCV e NumPy")
+class TestDocumentoPDF(unittest.TestCase):
+
+    def setUp(self):
+        self.leitor = leitor_qr.LeitorQRFaturaAT(estatisticas=leitor_qr.EstatisticasTentativas(None),
+                                                 usar_cache=False)
+
+    def test_imagem_embutida_reconstruida(self):
+        import numpy as np
+        pixels = np.random.default_rng(3).integers(0, 256, (23, 31), dtype=np.uint8)
+        pdf = []
+        numero = _imagem_cinzenta(pdf, pixels)
+        documento = leitor_qr.DocumentoPDF(_pdf([[numero]], pdf))
+        paginas = list(documento.paginas())
+        self.assertEqual([(pagina, [stream.numero for stream in imagens]) for pagina, imagens in paginas],
+                         [(1, [numero])])
+        imagem = documento.imagem(paginas[0][1][0])
+        self.assertEqual(imagem.shape[:2], pixels.shape)
+        cinzento = imagem if imagem.ndim == 2 else imagem[:, :, 0]
+        self.assertTrue(np.array_equal(cinzento, pixels))
+
+    def test_fatura_num_pdf(self):
+        pdf = []
+        numero = _imagem_cinzenta(pdf, _qr(PAYLOAD))
+        fatura = self.leitor.processar_fatura(_pdf([[numero]], pdf))
+        self.assertIsNotNone(fatura)
+        self.assertEqual(fatura['nif_emitente'], '123456789')
+        self.assertEqual(fatura['valor_total'], 123.0)
+
+    def test_qr_pequeno_lido_antes_de_descomprimir_a_digitalizacao(self):
+        import numpy as np
+        pdf = []
+        digitalizacao = _imagem_cinzenta(pdf, np.full((1200, 850), 255, dtype=np.uint8), preditor=False)
+        qr = _imagem_cinzenta(pdf, _qr(PAYLOAD))
+        outra_pagina = _imagem_cinzenta(pdf, np.full((1200, 850), 255, dtype=np.uint8), preditor=False)
+        dados = _pdf([[digitalizacao, qr], [outra_pagina]], pdf)
+
+        original = leitor_qr.DocumentoPDF.imagem
+        with mock.patch.object(leitor_qr.DocumentoPDF, 'imagem', autospec=True, side_effect=original) as imagem:
+            fatura = self.leitor.processar_fatura(dados)
+        self.assertEqual(fatura['nif_emitente'], '123456789')
+        self.assertEqual([chamada.args[1].numero for chamada in imagem.call_args_list], [qr])
+
+    def test_prazo_esgotado_nao_descodifica_imagens(self):
+        pdf = []
+        numero = _imagem_cinzenta(pdf, _qr(PAYLOAD))
+        metricas = leitor_qr.MetricasLeitura(max_ms=1)
+        metricas.prazo = metricas._inicio   # prazo já passado
+        documento = leitor_qr.DocumentoPDF(_pdf([[numero]], pdf))
+        (pagina, imagens), = documento.paginas()
+        with mock.patch.object(leitor_qr.DocumentoPDF, 'imagem') as imagem:
+            self.assertEqual(list(self.leitor._imagens_pagina_pdf(documento, pagina, imagens, set(), metricas)), [])
+        imagem.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()